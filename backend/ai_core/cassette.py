@@ -0,0 +1,143 @@
+"""
+Record/replay for model calls.
+
+    AI_CASSETTE_MODE=record  AI_CASSETTE_PATH=cassettes/meals.jsonl  -> calls the real provider and appends each
+                                                                         request/response pair to the cassette
+    AI_CASSETTE_MODE=replay  AI_CASSETTE_PATH=cassettes/meals.jsonl  -> serves responses from the cassette, never
+                                                                         touching the network
+    AI_REPLAY_LATENCY=recorded (default) | zero                      -> replay with the originally measured latency
+                                                                         or instantly
+
+Entries are keyed by a fingerprint of the provider, the function and its
+arguments (image files and audio are hashed by content, so temp file names
+don't matter). A replay miss raises CassetteMiss. Each entry also keeps the token
+usage the call recorded, and replay records it again, so usage and cost reports
+look the same under replay as they did live.
+"""
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from ai_core import usage
+
+_lock = threading.Lock()
+_loaded = {}  # path -> {fingerprint: entry}
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+def _mode():
+    return os.getenv("AI_CASSETTE_MODE", "off").lower()
+
+
+def _path():
+    return os.getenv("AI_CASSETTE_PATH", "cassettes/model_calls.jsonl")
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def fingerprint(name, arguments, file_args=()):
+    """Stable key for a call: provider/function name plus normalized arguments."""
+    normalized = {}
+    for key, value in sorted(arguments.items()):
+        if key in file_args and isinstance(value, str) and os.path.exists(value):
+            with open(value, "rb") as f:
+                normalized[key] = {"sha256": _digest(f.read())}
+        elif isinstance(value, (bytes, bytearray)):
+            normalized[key] = {"sha256": _digest(bytes(value))}
+        else:
+            normalized[key] = value
+    payload = json.dumps({"call": name, "args": normalized}, sort_keys=True, default=str)
+    return _digest(payload.encode("utf-8"))
+
+
+def _entries(path):
+    with _lock:
+        if path not in _loaded:
+            entries = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            entry = json.loads(line)
+                            # Last recording of a fingerprint wins
+                            entries[entry["key"]] = entry
+            _loaded[path] = entries
+        return _loaded[path]
+
+
+def _record(path, key, name, latency_ms, response, calls=()):
+    entry = {
+        "key": key,
+        "call": name,
+        "latency_ms": round(latency_ms, 3),
+        "response": response,
+        "usage": list(calls),
+        "recorded_at": datetime.now().isoformat(),
+    }
+    line = json.dumps(entry, default=str)
+    with _lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "a") as f:
+            f.write(line + "\n")
+        if path in _loaded:
+            _loaded[path][key] = entry
+
+
+def _lookup(path, key, name):
+    entry = _entries(path).get(key)
+    if entry is None:
+        raise CassetteMiss(f"No recording for {name} ({key[:12]}) in {path}")
+    delay = 0.0
+    if os.getenv("AI_REPLAY_LATENCY", "recorded").lower() != "zero":
+        delay = entry.get("latency_ms", 0.0) / 1000
+    return entry, delay
+
+
+def cassette(name, file_args=()):
+    """
+    Wraps an async model-call function so it can be recorded or replayed.
+    `file_args` names parameters holding file paths that should be fingerprinted by content.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def key_for(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return fingerprint(name, bound.arguments, file_args)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            mode = _mode()
+            if mode == "replay":
+                entry, delay = _lookup(_path(), key_for(args, kwargs), name)
+                if delay:
+                    await asyncio.sleep(delay)
+                for call in entry.get("usage", ()):
+                    usage.record(*call)
+                return entry["response"]
+            if mode == "record":
+                key = key_for(args, kwargs)
+                start = time.perf_counter()
+                with usage.capture_usage() as calls:
+                    response = await func(*args, **kwargs)
+                _record(_path(), key, name, (time.perf_counter() - start) * 1000, response, calls)
+                return response
+            return await func(*args, **kwargs)
+        return wrapper
+
+    return decorator
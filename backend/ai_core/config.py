@@ -0,0 +1,157 @@
+"""
+Process-wide configuration snapshot.
+
+The .env file and the Firebase credential file are read once, then watched
+by a background thread (stat polling every CONFIG_POLL_INTERVAL seconds,
+default 2; 0 disables watching). When either changes, a new immutable
+snapshot is published and subscribers for the changed keys are notified,
+so API clients are rebuilt only when a value they depend on actually changes.
+"""
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from dotenv import dotenv_values, find_dotenv
+
+# Read from the process environment (and overridable from .env) even if .env doesn't mention them
+WATCHED_KEYS = ("GOOGLE_API_KEY", "GROQ_API_KEY", "OPENAI_API_KEY", "FIREBASE_CREDENTIALS_PATH")
+DEFAULTS = {"FIREBASE_CREDENTIALS_PATH": "serviceAccountKey.json"}
+
+# Pseudo-key holding the (mtime, size) stamp of the credential file, so subscribers
+# can react to the key file being replaced even when its path stays the same.
+CREDENTIALS_FILE = "FIREBASE_CREDENTIALS_FILE"
+
+_lock = threading.Lock()
+_snapshot = None
+_base_env = None
+_env_stamp = None
+_subscribers = []
+_watcher = None
+
+
+class ConfigSnapshot:
+    """Immutable view of the configuration at one point in time."""
+
+    def __init__(self, values, version):
+        self._values = MappingProxyType(dict(values))
+        self.version = version
+
+    def get(self, key, default=None):
+        value = self._values.get(key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def items(self):
+        return self._values.items()
+
+
+def env_path():
+    return os.getenv("ENV_FILE") or find_dotenv(usecwd=True) or ".env"
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def _read():
+    """Builds the value dict: process environment at startup, overridden by .env."""
+    global _base_env
+    if _base_env is None:
+        _base_env = {k: os.environ.get(k) for k in WATCHED_KEYS}
+
+    path = env_path()
+    file_values = {k: v for k, v in dotenv_values(path).items() if v is not None} if os.path.exists(path) else {}
+
+    values = dict(DEFAULTS)
+    values.update({k: v for k, v in _base_env.items() if v is not None})
+    values.update(file_values)
+    values[CREDENTIALS_FILE] = _stamp(values["FIREBASE_CREDENTIALS_PATH"])
+
+    # Keep os.environ in line for code that still reads it directly (same as load_dotenv(override=True))
+    for key, value in file_values.items():
+        os.environ[key] = value
+    return values, _stamp(path)
+
+
+def _publish(values, stamp):
+    global _snapshot, _env_stamp
+    old = _snapshot
+    _snapshot = ConfigSnapshot(values, (old.version + 1) if old else 1)
+    _env_stamp = stamp
+    if old is None:
+        return set()
+    keys = set(old._values) | set(values)
+    return {k for k in keys if old.get(k) != values.get(k)}
+
+
+def get_config():
+    """Returns the current snapshot, loading it (and starting the watcher) on first use."""
+    snapshot = _snapshot
+    if snapshot is None:
+        with _lock:
+            if _snapshot is None:
+                _publish(*_read())
+                _start_watcher()
+        snapshot = _snapshot
+    return snapshot
+
+
+def reload_config():
+    """Re-reads .env and the credential file; notifies subscribers of changed keys."""
+    get_config()
+    with _lock:
+        changed = _publish(*_read())
+    if changed:
+        print(f"🔄 Config reloaded (v{_snapshot.version}); changed: {', '.join(sorted(changed))}")
+        _notify(changed)
+    return changed
+
+
+def subscribe(keys, callback):
+    """Calls callback(changed_keys) whenever any of `keys` changes."""
+    _subscribers.append((frozenset(keys), callback))
+
+
+def _notify(changed):
+    for keys, callback in list(_subscribers):
+        if keys & changed:
+            try:
+                callback(changed)
+            except Exception as e:
+                print(f"⚠️ Config subscriber {getattr(callback, '__name__', callback)} failed: {e}")
+
+
+def _changed_on_disk():
+    snapshot = _snapshot
+    if _stamp(env_path()) != _env_stamp:
+        return True
+    return _stamp(snapshot.get("FIREBASE_CREDENTIALS_PATH")) != snapshot.get(CREDENTIALS_FILE)
+
+
+def _watch(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            if _changed_on_disk():
+                reload_config()
+        except Exception as e:
+            print(f"⚠️ Config watcher error: {e}")
+
+
+def _start_watcher():
+    global _watcher
+    interval = float(os.getenv("CONFIG_POLL_INTERVAL", "2"))
+    if interval <= 0 or _watcher is not None:
+        return
+    _watcher = threading.Thread(target=_watch, args=(interval,), name="config-watcher", daemon=True)
+    _watcher.start()
@@ -0,0 +1,91 @@
+"""
+Per-request deadlines.
+
+An endpoint opens a budget with `with deadline(seconds, "analyze"):`. It lives in
+a contextvar, so every provider call and storage operation made while handling
+the request sees the same deadline without it being passed through arguments.
+Each attempt asks attempt_timeout() for the time left, so a fallback chain can
+never run past the budget; once it is spent, the next attempt raises
+DeadlineExceeded instead of starting. Code running outside any deadline
+(warm-up, journal replay) gets no extra limit.
+"""
+import asyncio
+import contextvars
+import inspect
+import time
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before `operation` could finish."""
+
+    def __init__(self, operation, budget=None):
+        self.operation = operation
+        self.budget = budget
+        spent = f" ({budget:g}s budget)" if budget else ""
+        super().__init__(f"Deadline exceeded{spent} during {operation}")
+
+
+class Deadline:
+    def __init__(self, budget, name=None):
+        self.budget = budget
+        self.name = name
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(budget, name=None):
+    """Runs the block under a budget of `budget` seconds. A nested deadline never extends an outer one."""
+    outer = _current.get()
+    d = Deadline(budget, name)
+    if outer is not None and outer.expires_at < d.expires_at:
+        d = outer
+    token = _current.set(d)
+    try:
+        yield d
+    finally:
+        _current.reset(token)
+
+
+def current_deadline():
+    return _current.get()
+
+
+def attempt_timeout(operation, cap=None):
+    """
+    Seconds the next attempt at `operation` may take: what is left of the budget,
+    capped at `cap`. None when there is no deadline and no cap.
+    """
+    d = _current.get()
+    if d is None:
+        return cap
+    left = d.remaining()
+    if left <= 0:
+        raise DeadlineExceeded(operation, d.budget)
+    return min(left, cap) if cap else left
+
+
+async def run_with_deadline(awaitable, operation, cap=None):
+    """
+    Awaits one provider attempt within attempt_timeout(). Raises DeadlineExceeded if the
+    budget ran out, or TimeoutError if only the per-attempt cap did (so the caller can fall back).
+    """
+    try:
+        timeout = attempt_timeout(operation, cap)
+    except DeadlineExceeded:
+        if inspect.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        d = _current.get()
+        if d is not None and d.remaining() <= 0:
+            raise DeadlineExceeded(operation, d.budget) from None
+        raise TimeoutError(f"{operation} timed out after {timeout:.1f}s") from None
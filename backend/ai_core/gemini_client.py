@@ -1,24 +1,89 @@
-from google import genai
-from google.genai import types
-import os
+import asyncio
 import json
-from dotenv import load_dotenv
+import os
+from ai_core.config import get_config
+from ai_core.deadline import DeadlineExceeded, run_with_deadline
+from ai_core import usage
 from ai_core.prompts import NUTRITION_PROMPT
-from PIL import Image
-import io
+from ai_core.cassette import cassette
+from ai_core.http_pool import get_http_client, timeout_seconds
+
+# google.genai is imported inside the functions that need it: its types module
+# alone is a large share of the backend's import time, which every cold start pays.
+
+# Models in order of preference; narrowed to what the key can actually use by resolve_models()
+PREFERRED_MODELS = ['gemini-2.0-flash-exp', 'gemini-1.5-flash', 'gemini-1.5-pro']
+
+# Optional cap (seconds) on a single model attempt, so one hung model leaves budget for the fallbacks.
+# Without it each attempt may use whatever is left of the request deadline.
+ATTEMPT_TIMEOUT = float(os.getenv("AI_ATTEMPT_TIMEOUT", "0")) or None
 
-load_dotenv()
+# Replies generate_text() gives instead of raising, so callers can tell them apart from real answers
+NO_KEY_REPLY = "Error: No API Key"
+UNAVAILABLE_REPLY = "I'm sorry, I'm having trouble connecting to my AI brain right now. Please try again in a moment."
 
-# Initialize Client (Best practice is to do this once or per request depending on architecture)
-# Here we'll do it lazily in functions to allow env var loading
+_client = None
+_client_key = None
+_client_pool = None
+_available_models = None
+
+# Initialize Client lazily. The client is reused until the key in the config snapshot
+# changes (which still allows hot-reloading .env) or the shared pool is replaced.
+# Calls go through client.aio, i.e. the shared httpx.AsyncClient from ai_core.http_pool.
 def get_client():
-    load_dotenv(override=True)
-    api_key = os.getenv("GOOGLE_API_KEY")
+    global _client, _client_key, _client_pool
+    api_key = get_config().get("GOOGLE_API_KEY")
     if not api_key:
         return None
-    return genai.Client(api_key=api_key)
+    pool = get_http_client()
+    if api_key != _client_key or pool is not _client_pool:
+        from google import genai
+        from google.genai import types
+        # Without an explicit timeout the SDK sends each request with timeout=None
+        http_options = types.HttpOptions(httpx_async_client=pool, timeout=int(timeout_seconds() * 1000))
+        _client = genai.Client(api_key=api_key, http_options=http_options)
+        _client_key = api_key
+        _client_pool = pool
+    return _client
+
+async def resolve_models():
+    """
+    Lists the models available to this key and keeps the preferred ones that exist,
+    so requests don't spend a round-trip on a model the key can't use.
+    """
+    global _available_models
+    client = get_client()
+    if not client:
+        return PREFERRED_MODELS
+    available = {m.name.replace('models/', '') async for m in await client.aio.models.list()}
+    usable = [m for m in PREFERRED_MODELS if m in available]
+    if not usable:
+        print(f"⚠️ None of {PREFERRED_MODELS} listed for this key; keeping the default order")
+    _available_models = usable or None
+    return get_models_to_try()
+
+def get_models_to_try():
+    return _available_models or PREFERRED_MODELS
+
+def record_usage(model_name, response):
+    meta = getattr(response, "usage_metadata", None)
+    if meta is not None:
+        usage.record("gemini", model_name, meta.prompt_token_count, meta.candidates_token_count)
+
+def parse_json_text(text):
+    """
+    Strips markdown code fences from a model reply and parses the JSON inside.
+    """
+    return json.loads(text.replace("```json", "").replace("```", "").strip())
+
+def load_image_part(image_path):
+    """Reads an image into a types.Part for the new SDK."""
+    from google.genai import types
+    with open(image_path, "rb") as f:
+        return types.Part.from_bytes(data=f.read(), mime_type="image/jpeg")
 
-def analyze_food_image(image_path):
+@cassette("gemini.analyze_food_image", file_args=("image_path",))
+async def analyze_food_image(image_path):
     """
     Sends image to Gemini 1.5 Flash and returns parsed JSON.
     """
@@ -27,17 +92,11 @@ def analyze_food_image(image_path):
         return {"error": "API Key not found. Please add GOOGLE_API_KEY to .env"}
 
     # Define models to try
-    models_to_try = ['gemini-2.0-flash-exp', 'gemini-1.5-flash', 'gemini-1.5-pro']
+    models_to_try = get_models_to_try()
             
-    # Read Image Bytes
+    # Read Image Bytes (off the event loop: uploads can be several MB)
     try:
-        with open(image_path, "rb") as f:
-            image_bytes = f.read()
-            
-        # Create Part/Image object - specific to new SDK
-        # For new SDK, we often just pass the bytes or specific types
-        # Let's use simple bytes/mime_type dict or types.Part
-        image_part = types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg") 
+        image_part = await asyncio.to_thread(load_image_part, image_path)
     except Exception as e:
         return {"error": f"Failed to read image file: {e}"}
 
@@ -48,48 +107,54 @@ def analyze_food_image(image_path):
             print(f"🤖 Trying AI Model: {model_name}...")
             
             # New SDK Call structure
-            response = client.models.generate_content(
+            response = await run_with_deadline(client.aio.models.generate_content(
                 model=model_name,
                 contents=[NUTRITION_PROMPT, image_part]
-            )
+            ), f"gemini {model_name}", cap=ATTEMPT_TIMEOUT)
+            record_usage(model_name, response)
             
             if response.text:
-                # Clean response
-                text_response = response.text.replace("```json", "").replace("```", "").strip()
-                return json.loads(text_response)
+                return parse_json_text(response.text)
             else:
                  raise Exception("Empty response text")
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"❌ {model_name} Failed: {e}")
             last_error = e
             
     return {"error": f"All models failed. Last error: {str(last_error)}"}
 
-def generate_text(prompt):
+@cassette("gemini.generate_text")
+async def generate_text(prompt):
     """
     Sends text prompt to Gemini and returns string response.
     """
     client = get_client()
     if not client:
-        return "Error: No API Key"
+        return NO_KEY_REPLY
     
-    models_to_try = ['gemini-2.0-flash-exp', 'gemini-1.5-flash', 'gemini-1.5-pro']
+    models_to_try = get_models_to_try()
 
     for model_name in models_to_try:
         try:
             print(f"🤖 NutriChat trying: {model_name}")
-            response = client.models.generate_content(
+            response = await run_with_deadline(client.aio.models.generate_content(
                 model=model_name,
                 contents=prompt
-            )
+            ), f"gemini {model_name}", cap=ATTEMPT_TIMEOUT)
+            record_usage(model_name, response)
             return response.text.strip() if response.text else "No response generated."
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"❌ NutriChat {model_name} Fail: {e}")
             
-    return "I'm sorry, I'm having trouble connecting to my AI brain right now. Please try again in a moment."
+    return UNAVAILABLE_REPLY
 
-def analyze_audio(audio_bytes, mime_type="audio/wav", prompt=""):
+@cassette("gemini.analyze_audio")
+async def analyze_audio(audio_bytes, mime_type="audio/wav", prompt=""):
     """
     Directly processes audio bytes with Gemini 1.5.
     """
@@ -97,7 +162,9 @@ def analyze_audio(audio_bytes, mime_type="audio/wav", prompt=""):
     if not client:
         return "Error: No API Key"
     
-    models_to_try = ['gemini-2.0-flash-exp', 'gemini-1.5-flash', 'gemini-1.5-pro']
+    from google.genai import types
+
+    models_to_try = get_models_to_try()
 
     for model_name in models_to_try:
         try:
@@ -106,11 +173,14 @@ def analyze_audio(audio_bytes, mime_type="audio/wav", prompt=""):
             # Construct Media Part
             audio_part = types.Part.from_bytes(data=audio_bytes, mime_type=mime_type)
 
-            response = client.models.generate_content(
+            response = await run_with_deadline(client.aio.models.generate_content(
                 model=model_name,
                 contents=[prompt, audio_part]
-            )
+            ), f"gemini {model_name}", cap=ATTEMPT_TIMEOUT)
+            record_usage(model_name, response)
             return response.text.strip() if response.text else "I couldn't process the audio."
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"❌ NutriVoice {model_name} Fail: {e}")
             
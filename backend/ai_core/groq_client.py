@@ -1,22 +1,92 @@
-from groq import Groq
-import os
+import asyncio
 import base64
 import json
-from dotenv import load_dotenv
+from ai_core.config import get_config
+from ai_core.cassette import cassette
+from ai_core.deadline import DeadlineExceeded, run_with_deadline
+from ai_core import usage
+from ai_core.http_pool import get_http_client, build_timeout
 
-load_dotenv()
+_client = None
+_client_key = None
+_client_pool = None
 
-api_key = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=api_key) if api_key else None
+def get_client():
+    """
+    Builds the async Groq client on the shared connection pool; rebuilt only when
+    GROQ_API_KEY changes or the pool does (new event loop).
+    """
+    global _client, _client_key, _client_pool
+    api_key = get_config().get("GROQ_API_KEY")
+    if not api_key:
+        return None
+    pool = get_http_client()
+    if api_key != _client_key or pool is not _client_pool:
+        from groq import AsyncGroq
+        _client = AsyncGroq(api_key=api_key, http_client=pool, timeout=build_timeout())
+        _client_key = api_key
+        _client_pool = pool
+    return _client
 
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
-def analyze_food_image(image_path):
+def extract_json(content):
+    """
+    Extracts a JSON object from a chat completion message content.
+    The SDK may return a dict, a JSON string, or a list of content parts.
+    """
+    # If it's already a dict, assume it's parsed JSON
+    if isinstance(content, dict):
+        return content
+
+    # If it's a string, try to load JSON
+    if isinstance(content, str):
+        try:
+            return json.loads(content)
+        except Exception:
+            return None
+
+    # If it's a list of parts, try to join any text pieces
+    if isinstance(content, list):
+        # Try to collect textual pieces
+        text_parts = []
+        for part in content:
+            if isinstance(part, dict):
+                # common keys: 'text' or 'content' or nested dict
+                if "text" in part and isinstance(part["text"], str):
+                    text_parts.append(part["text"]) 
+                elif "content" in part and isinstance(part["content"], str):
+                    text_parts.append(part["content"]) 
+                else:
+                    # try to stringify the dict
+                    try:
+                        text_parts.append(json.dumps(part))
+                    except Exception:
+                        pass
+            elif isinstance(part, str):
+                text_parts.append(part)
+
+        joined = "".join(text_parts)
+        if joined:
+            try:
+                return json.loads(joined)
+            except Exception:
+                # As a last resort, if any element is a dict, return the first
+                for part in content:
+                    if isinstance(part, dict):
+                        return part
+        return None
+
+    return None
+
+@cassette("groq.analyze_food_image", file_args=("image_path",))
+async def analyze_food_image(image_path):
     """
     Sends image to Groq (Llama 3.2 Vision) and returns parsed JSON.
     """
+    client = get_client()
     if not client:
         return {"error": "GROQ_API_KEY not found"}
 
@@ -27,8 +97,8 @@ def analyze_food_image(image_path):
         if not mime_type:
             mime_type = "image/jpeg" # Default fallback
             
-        # Encode image to base64
-        base64_image = encode_image(image_path)
+        # Encode image to base64 (off the event loop: uploads can be several MB)
+        base64_image = await asyncio.to_thread(encode_image, image_path)
         
         prompt = """
         You are an expert Nutritionist AI. Analyse the image provided and:
@@ -46,7 +116,7 @@ def analyze_food_image(image_path):
         }
         """
 
-        chat_completion = client.chat.completions.create(
+        chat_completion = await run_with_deadline(client.chat.completions.create(
             messages=[
                 {
                     "role": "user",
@@ -65,7 +135,10 @@ def analyze_food_image(image_path):
             temperature=0,
             stream=False,
             response_format={"type": "json_object"},
-        )
+        ), "groq llama-3.2-90b-vision-preview")
+        if chat_completion.usage:
+            usage.record("groq", "llama-3.2-90b-vision-preview",
+                         chat_completion.usage.prompt_tokens, chat_completion.usage.completion_tokens)
 
         # Extract content from the SDK's response. The SDK may return
         # a dict, a JSON string, or a list of content parts depending
@@ -76,51 +149,6 @@ def analyze_food_image(image_path):
         except Exception:
             return {"error": "Unexpected Groq response shape"}
 
-        def extract_json(content):
-            # If it's already a dict, assume it's parsed JSON
-            if isinstance(content, dict):
-                return content
-
-            # If it's a string, try to load JSON
-            if isinstance(content, str):
-                try:
-                    return json.loads(content)
-                except Exception:
-                    return None
-
-            # If it's a list of parts, try to join any text pieces
-            if isinstance(content, list):
-                # Try to collect textual pieces
-                text_parts = []
-                for part in content:
-                    if isinstance(part, dict):
-                        # common keys: 'text' or 'content' or nested dict
-                        if "text" in part and isinstance(part["text"], str):
-                            text_parts.append(part["text"]) 
-                        elif "content" in part and isinstance(part["content"], str):
-                            text_parts.append(part["content"]) 
-                        else:
-                            # try to stringify the dict
-                            try:
-                                text_parts.append(json.dumps(part))
-                            except Exception:
-                                pass
-                    elif isinstance(part, str):
-                        text_parts.append(part)
-
-                joined = "".join(text_parts)
-                if joined:
-                    try:
-                        return json.loads(joined)
-                    except Exception:
-                        # As a last resort, if any element is a dict, return the first
-                        for part in content:
-                            if isinstance(part, dict):
-                                return part
-                return None
-
-            return None
-
         parsed = extract_json(raw_content)
         if not parsed:
             return {"error": "Could not parse JSON from Groq response"}
@@ -145,6 +173,8 @@ def analyze_food_image(image_path):
 
         return result
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error calling Groq: {e}")
         # Try to print more details if available
@@ -0,0 +1,60 @@
+"""
+One shared HTTP connection pool for the model providers.
+
+The async Gemini, Groq and OpenAI clients all send through the same
+httpx.AsyncClient, so a worker keeps warm keep-alive connections to each
+provider and can have many model calls in flight on its event loop without
+threads. Tuning (environment, read when the pool is created):
+
+    AI_HTTP_MAX_CONNECTIONS   total open connections             (default 100)
+    AI_HTTP_MAX_KEEPALIVE     idle connections kept for reuse     (default 20)
+    AI_HTTP_KEEPALIVE_EXPIRY  seconds an idle connection is kept  (default 30)
+    AI_HTTP_CONNECT_TIMEOUT   seconds to open a connection        (default 5)
+    AI_HTTP_TIMEOUT           read/write/pool timeout per request (default 60)
+"""
+import asyncio
+import os
+
+_pool = None
+_pool_loop = None
+
+
+def _float_env(name, default):
+    return float(os.getenv(name, default))
+
+
+def timeout_seconds():
+    return _float_env("AI_HTTP_TIMEOUT", "60")
+
+
+def build_timeout():
+    import httpx
+    return httpx.Timeout(timeout_seconds(), connect=_float_env("AI_HTTP_CONNECT_TIMEOUT", "5"))
+
+
+def get_http_client():
+    """
+    Returns the pool for the running event loop. httpx connections belong to the
+    loop that opened them, so a new loop (tests, a second TestClient) gets a new pool.
+    """
+    global _pool, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool_loop is not loop or _pool.is_closed:
+        import httpx
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("AI_HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=_float_env("AI_HTTP_KEEPALIVE_EXPIRY", "30"),
+        )
+        _pool = httpx.AsyncClient(limits=limits, timeout=build_timeout())
+        _pool_loop = loop
+    return _pool
+
+
+async def close_http_client():
+    """Closes the pool's connections (app shutdown)."""
+    global _pool, _pool_loop
+    if _pool is not None and _pool_loop is asyncio.get_running_loop():
+        await _pool.aclose()
+    _pool = None
+    _pool_loop = None
@@ -1,28 +1,49 @@
-from openai import OpenAI
-import os
+import asyncio
 import base64
 import json
-from dotenv import load_dotenv
+from ai_core.config import get_config
+from ai_core.cassette import cassette
+from ai_core.deadline import DeadlineExceeded, run_with_deadline
+from ai_core import usage
+from ai_core.http_pool import get_http_client, build_timeout
 
-load_dotenv()
+_client = None
+_client_key = None
+_client_pool = None
 
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key) if api_key else None
+def get_client():
+    """
+    Builds the async OpenAI client on the shared connection pool; rebuilt only when
+    OPENAI_API_KEY changes or the pool does (new event loop).
+    """
+    global _client, _client_key, _client_pool
+    api_key = get_config().get("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    pool = get_http_client()
+    if api_key != _client_key or pool is not _client_pool:
+        from openai import AsyncOpenAI
+        _client = AsyncOpenAI(api_key=api_key, http_client=pool, timeout=build_timeout())
+        _client_key = api_key
+        _client_pool = pool
+    return _client
 
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
-def analyze_food_image(image_path):
+@cassette("openai.analyze_food_image", file_args=("image_path",))
+async def analyze_food_image(image_path):
     """
     Sends image to OpenAI GPT-4o and returns parsed JSON.
     """
+    client = get_client()
     if not client:
         return {"error": "OPENAI_API_KEY not found"}
 
     try:
-        # Encode image to base64
-        base64_image = encode_image(image_path)
+        # Encode image to base64 (off the event loop: uploads can be several MB)
+        base64_image = await asyncio.to_thread(encode_image, image_path)
         
         prompt = """
         You are an expert Nutritionist AI. Analyse the image provided and:
@@ -40,7 +61,7 @@ def analyze_food_image(image_path):
         }
         """
 
-        response = client.chat.completions.create(
+        response = await run_with_deadline(client.chat.completions.create(
             model="gpt-4o",
             messages=[
                 {
@@ -58,11 +79,15 @@ def analyze_food_image(image_path):
             ],
             max_tokens=300,
             response_format={ "type": "json_object" } # Force JSON mode
-        )
+        ), "openai gpt-4o")
+        if response.usage:
+            usage.record("openai", "gpt-4o", response.usage.prompt_tokens, response.usage.completion_tokens)
         
         result_text = response.choices[0].message.content
         return json.loads(result_text)
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error calling OpenAI: {e}")
         return {"error": str(e)}
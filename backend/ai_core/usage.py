@@ -0,0 +1,184 @@
+"""
+Token and cost accounting for model calls.
+
+Providers call record() with the usage metadata of every response. Calls are
+attributed to the user and endpoint set by usage_scope() (backend.main sets it
+for each request), aggregated in memory per (user, endpoint, model), and
+handed to a sink as delta rows every USAGE_FLUSH_INTERVAL seconds (default 60,
+0 disables flushing). Only the deltas not yet flushed are held, so memory stays
+bounded by the active users; report() aggregates the stored rows (from every
+worker) together with this worker's pending ones.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# USD per 1M tokens (input, output) at list price. Models missing here are
+# counted with cost 0 and reported with "priced": False.
+MODEL_PRICES = {
+    "gemini-2.0-flash-exp": (0.10, 0.40),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gpt-4o": (2.50, 10.00),
+    "llama-3.2-90b-vision-preview": (0.90, 0.90),
+}
+
+GROUPS = {"user": ("user_id",), "endpoint": ("endpoint",), "model": ("model",), "row": ("user_id", "endpoint", "model")}
+
+_scope = contextvars.ContextVar("usage_scope", default=(None, None))
+_capture = contextvars.ContextVar("usage_capture", default=None)
+
+
+@contextmanager
+def usage_scope(user_id, endpoint):
+    """Attributes model calls made inside the block to this user and endpoint."""
+    token = _scope.set((user_id, endpoint))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+@contextmanager
+def capture_usage():
+    """Also collects the calls recorded inside the block, as [[provider, model, input_tokens, output_tokens]]."""
+    calls = []
+    token = _capture.set(calls)
+    try:
+        yield calls
+    finally:
+        _capture.reset(token)
+
+
+def cost_usd(model, input_tokens, output_tokens):
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return 0.0
+    return (input_tokens * prices[0] + output_tokens * prices[1]) / 1_000_000
+
+
+def _empty(provider):
+    return {"provider": provider, "calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+
+
+def _add(row, other):
+    row["calls"] += other["calls"]
+    row["input_tokens"] += other["input_tokens"]
+    row["output_tokens"] += other["output_tokens"]
+    row["cost_usd"] += other["cost_usd"]
+
+
+class UsageLedger:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_since = datetime.now()
+        self.last_flush = None
+
+    def record(self, provider, model, input_tokens, output_tokens):
+        user_id, endpoint = _scope.get()
+        key = (user_id or "unknown", endpoint or "unknown", model)
+        delta = {
+            "provider": provider, "calls": 1,
+            "input_tokens": int(input_tokens or 0), "output_tokens": int(output_tokens or 0),
+        }
+        delta["cost_usd"] = cost_usd(model, delta["input_tokens"], delta["output_tokens"])
+        with self._lock:
+            _add(self._pending.setdefault(key, _empty(provider)), delta)
+
+    def drain(self):
+        """Takes the deltas recorded since the last drain as rows for the sink."""
+        now = datetime.now()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            since, self._pending_since = self._pending_since, now
+        return [
+            dict(row, user_id=user_id, endpoint=endpoint, model=model, window_start=since, window_end=now)
+            for (user_id, endpoint, model), row in pending.items()
+        ]
+
+    def pending_rows(self):
+        """The deltas not flushed yet, as rows, without taking them."""
+        with self._lock:
+            return [dict(row, user_id=user_id, endpoint=endpoint, model=model)
+                    for (user_id, endpoint, model), row in self._pending.items()]
+
+    def merge_back(self, rows):
+        with self._lock:
+            for row in rows:
+                _add(self._pending.setdefault((row["user_id"], row["endpoint"], row["model"]), _empty(row["provider"])), row)
+
+
+
+ledger = UsageLedger()
+
+
+def report(rows, since, group_by="endpoint", limit=50):
+    """Groups usage rows (stored and pending) by GROUPS[group_by], highest cost first."""
+    keys = GROUPS[group_by]
+    groups = {}
+    totals = _empty(None)
+    for row in rows:
+        group = groups.setdefault(tuple(row[k] for k in keys), dict({k: row[k] for k in keys}, **_empty(row.get("provider"))))
+        _add(group, row)
+        _add(totals, row)
+        group["priced"] = group.get("priced", True) and row["model"] in MODEL_PRICES
+    grouped = sorted(groups.values(), key=lambda g: (g["cost_usd"], g["input_tokens"]), reverse=True)
+    for row in grouped:
+        if "model" not in keys:
+            row.pop("provider")
+        # Large averages point at bloated prompts
+        row["avg_input_tokens"] = round(row["input_tokens"] / row["calls"]) if row["calls"] else 0
+        row["cost_usd"] = round(row["cost_usd"], 6)
+    del totals["provider"]
+    totals["cost_usd"] = round(totals["cost_usd"], 6)
+    return {
+        "since": since.isoformat(),
+        "last_flush": ledger.last_flush.isoformat() if ledger.last_flush else None,
+        "group_by": group_by,
+        "totals": totals,
+        "rows": grouped[:limit],
+    }
+
+
+def record(provider, model, input_tokens, output_tokens):
+    ledger.record(provider, model, input_tokens, output_tokens)
+    calls = _capture.get()
+    if calls is not None:
+        calls.append([provider, model, input_tokens, output_tokens])
+
+
+def flush(sink):
+    """Hands pending deltas to sink(rows); on failure they are kept for the next flush."""
+    rows = ledger.drain()
+    if not rows:
+        return 0
+    try:
+        sink(rows)
+    except Exception as e:
+        ledger.merge_back(rows)
+        print(f"⚠️ Usage flush failed ({e}); keeping {len(rows)} rows for the next one")
+        return 0
+    ledger.last_flush = datetime.now()
+    return len(rows)
+
+
+_flusher = None
+
+
+def start_flusher(sink):
+    global _flusher
+    interval = float(os.getenv("USAGE_FLUSH_INTERVAL", "60"))
+    if interval <= 0 or _flusher is not None:
+        return
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            flush(sink)
+
+    _flusher = threading.Thread(target=loop, name="usage-flush", daemon=True)
+    _flusher.start()
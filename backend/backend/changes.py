@@ -0,0 +1,102 @@
+"""
+In-process change feed for users' food logs and chats.
+
+Whoever completes a write calls notify(user_id, kind) once it is in storage:
+the request handlers, and journal replay for writes that were deferred. Each
+user has a version counter and a last-write time per kind; /changes/{user_id}
+streams them as Server-Sent Events so clients only refetch when something
+changed, subscribe() lets modules react to writes (the stats cache), and
+version() lets conditional GETs answer 304 without reading storage.
+
+Only writes made by this worker are seen. The deployment runs one worker per
+instance; with several, a client may miss writes handled by another worker
+until its caches expire. EPOCH changes on restart, so clients compare
+(epoch, version) rather than the version alone.
+"""
+import asyncio
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+KINDS = ("food_logs", "chats")
+EPOCH = uuid.uuid4().hex[:8]
+
+_lock = threading.Lock()
+# Users whose versions are kept; the least recently written are forgotten beyond this. A
+# forgotten user's versions restart at 1, which clients see as a change and refetch once.
+MAX_USERS = int(os.getenv("CHANGES_MAX_USERS", "10000"))
+
+_state = OrderedDict()  # user_id -> {kind: {"version": n, "at": datetime}}, least recently written first
+_listeners = {}  # user_id -> {(loop, queue)}
+_subscribers = []
+
+
+def notify(user_id, kind):
+    """Records a write of `kind` for the user and wakes their change streams."""
+    now = datetime.now()
+    with _lock:
+        entry = _state.setdefault(user_id, {}).setdefault(kind, {"version": 0, "at": None})
+        _state.move_to_end(user_id)
+        while len(_state) > MAX_USERS:
+            _state.popitem(last=False)
+        entry["version"] += 1
+        entry["at"] = now
+        event = {"epoch": EPOCH, "kind": kind, "version": entry["version"], "at": now.isoformat()}
+        listeners = list(_listeners.get(user_id, ()))
+    for loop, queue in listeners:
+        try:
+            # Writes can land on any thread (journal replay); queues belong to the stream's loop
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+        except RuntimeError:
+            pass  # loop already closed; the stream is gone
+    for callback in list(_subscribers):
+        try:
+            callback(user_id, kind)
+        except Exception as e:
+            print(f"⚠️ Change subscriber {getattr(callback, '__name__', callback)} failed: {e}")
+
+
+def subscribe(callback):
+    """Calls callback(user_id, kind) after every write notified in this process."""
+    _subscribers.append(callback)
+
+
+def snapshot(user_id):
+    """{"epoch", kind: {"version", "at"} for each kind}; version 0 and at None if nothing was written yet."""
+    with _lock:
+        state = _state.get(user_id, {})
+        result = {"epoch": EPOCH}
+        for kind in KINDS:
+            entry = state.get(kind, {"version": 0, "at": None})
+            result[kind] = {"version": entry["version"], "at": entry["at"].isoformat() if entry["at"] else None}
+    return result
+
+
+def version(user_id, kind):
+    """(version, at) of one kind of the user's data; (0, None) if nothing was written yet."""
+    with _lock:
+        entry = _state.get(user_id, {}).get(kind)
+        return (entry["version"], entry["at"]) if entry else (0, None)
+
+
+def listen(user_id):
+    """Registers a queue that receives the user's change events on the running loop."""
+    queue = asyncio.Queue()
+    with _lock:
+        _listeners.setdefault(user_id, set()).add((asyncio.get_running_loop(), queue))
+    return queue
+
+
+def unlisten(user_id, queue):
+    with _lock:
+        listeners = _listeners.get(user_id, set())
+        listeners.discard((asyncio.get_running_loop(), queue))
+        if not listeners:
+            _listeners.pop(user_id, None)
+
+
+def listener_count():
+    with _lock:
+        return sum(len(listeners) for listeners in _listeners.values())
@@ -0,0 +1,118 @@
+"""
+Bounded conversation memory for NutriChat.
+
+The prompt gets the last CHAT_MEMORY_TURNS exchanges verbatim plus a rolling
+summary of everything older, so its size stays flat however long someone has
+been chatting. After each exchange a background task folds the messages that
+just left the verbatim window into the user's summary (one short model call)
+and stores it with the timestamp it covers up to; the next request reads it
+back from storage. Each refresh folds at most FOLD_MAX_MESSAGES messages, so
+a long history that predates the summary is picked up from its recent end.
+"""
+import asyncio
+import contextvars
+import os
+
+from ai_core.deadline import deadline
+from ai_core.usage import usage_scope
+from ai_core.gemini_client import NO_KEY_REPLY, UNAVAILABLE_REPLY
+from backend.storage import get_storage
+
+TURNS = int(os.getenv("CHAT_MEMORY_TURNS", "6"))
+FOLD_MAX_MESSAGES = 20
+MESSAGE_MAX_CHARS = 600
+SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "1200"))
+SUMMARY_BUDGET = float(os.getenv("CHAT_SUMMARY_BUDGET", "30"))
+
+SUMMARY_PROMPT = """
+You keep a running summary of a conversation between a user and NutriChat, a nutrition assistant.
+
+Current summary:
+{summary}
+
+New messages to fold in:
+{messages}
+
+Rewrite the summary so it also covers the new messages. Keep what is worth remembering:
+the user's goals, preferences, allergies or restrictions, what they asked and the advice given.
+Plain text, at most 120 words.
+"""
+
+_refreshing = set()
+_tasks = set()
+
+
+def _clip(text, limit):
+    text = (text or "").strip()
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _format_messages(messages):
+    names = {"user": "User", "assistant": "NutriChat"}
+    return "\n".join(
+        f"{names.get(m.get('role'), m.get('role'))}: {_clip(m.get('content'), MESSAGE_MAX_CHARS)}"
+        for m in messages
+    )
+
+
+def load_memory(storage, user_id):
+    """Returns (summary, recent): the stored summary text and the last TURNS exchanges, oldest first."""
+    recent = storage.get_chats(user_id, limit=TURNS * 2)
+    record = storage.get_chat_summary(user_id) or {}
+    return record.get("summary", ""), recent
+
+
+def format_memory(summary, recent):
+    """Prompt block for the conversation so far (empty for a new conversation)."""
+    parts = []
+    if summary:
+        parts.append(f"Summary of the earlier conversation: {summary}")
+    if recent:
+        parts.append("Most recent messages:\n" + _format_messages(recent))
+    return "\n".join(parts)
+
+
+def schedule_refresh(user_id, summarize):
+    """
+    Folds messages that left the verbatim window into the summary, in the background.
+    `summarize` is an async prompt -> text function (generate_text). One refresh per user at a time.
+    """
+    if user_id in _refreshing:
+        return
+    _refreshing.add(user_id)
+    # Fresh context: the refresh has its own budget, not what is left of the request's
+    task = asyncio.get_running_loop().create_task(_refresh(user_id, summarize), context=contextvars.Context())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _refresh(user_id, summarize):
+    try:
+        with deadline(SUMMARY_BUDGET, "chat_summary"), usage_scope(user_id, "chat_summary"):
+            storage = get_storage()
+            if storage is None:
+                return
+            messages = await asyncio.to_thread(storage.get_chats, user_id, TURNS * 2 + FOLD_MAX_MESSAGES)
+            older = messages[:-TURNS * 2] if len(messages) > TURNS * 2 else []
+            record = await asyncio.to_thread(storage.get_chat_summary, user_id) or {}
+            covered_until = record.get("covered_until")
+            new = [m for m in older if covered_until is None or m["timestamp"] > covered_until]
+            if not new:
+                return
+
+            text = await summarize(SUMMARY_PROMPT.format(
+                summary=record.get("summary") or "(none yet)",
+                messages=_format_messages(new),
+            ))
+            if not text or text in (NO_KEY_REPLY, UNAVAILABLE_REPLY):
+                print(f"⚠️ Chat summary for {user_id} not refreshed: model unavailable")
+                return
+            await asyncio.to_thread(storage.set_chat_summary, user_id, {
+                "summary": _clip(text, SUMMARY_MAX_CHARS),
+                "covered_until": new[-1]["timestamp"],
+                "messages": record.get("messages", 0) + len(new),
+            })
+    except Exception as e:
+        print(f"⚠️ Chat summary refresh for {user_id} failed: {e}")
+    finally:
+        _refreshing.discard(user_id)
@@ -1,14 +1,19 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import os
-from dotenv import load_dotenv
+import threading
+from ai_core.config import get_config, subscribe, CREDENTIALS_FILE
 
-load_dotenv()
+_db = None
+_initialized = False
+_lock = threading.Lock()
 
 def initialize_firebase():
     """Initializes Firebase Admin SDK and returns Firestore client."""
-    cred_path = os.getenv("FIREBASE_CREDENTIALS_PATH", "serviceAccountKey.json")
-    
+    # firebase_admin pulls in google.cloud.firestore and gRPC; import it only when a DB is actually needed
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    cred_path = get_config().get("FIREBASE_CREDENTIALS_PATH")
+
     try:
         if not firebase_admin._apps:
             if os.path.exists(cred_path):
@@ -18,12 +23,33 @@ def initialize_firebase():
             else:
                 print(f"⚠️ WARNING: {cred_path} not found. Firebase not initialized.")
                 return None
-        
+
         # This part only runs if initialization succeeded or already existed
         return firestore.client()
     except Exception as e:
         print(f"❌ Firebase Critical Error: {e}")
         return None
 
-# Initialize on module load
-db = initialize_firebase()
+def get_db():
+    """Returns the Firestore client, initializing it on first use (None if credentials are missing)."""
+    global _db, _initialized
+    if not _initialized:
+        with _lock:
+            if not _initialized:
+                _db = initialize_firebase()
+                _initialized = True
+    return _db
+
+def reset_firebase(changed=None):
+    """Drops the Firestore client so the next get_db() re-initializes with the new credentials."""
+    global _db, _initialized
+    with _lock:
+        if _initialized:
+            import firebase_admin
+            if firebase_admin._apps:
+                firebase_admin.delete_app(firebase_admin.get_app())
+            print("🔄 Firebase credentials changed; client will be re-initialized on next use")
+        _db = None
+        _initialized = False
+
+subscribe(("FIREBASE_CREDENTIALS_PATH", CREDENTIALS_FILE), reset_firebase)
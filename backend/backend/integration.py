@@ -1,21 +1,251 @@
+"""
+Outbound sync to the fitness platform (compatible with Google Fit / Apple Health schema).
+
+Meals are not sent one by one. sync_workout() adds the meal to a per-user
+delta, and a background thread flushes all pending deltas every
+FITNESS_FLUSH_WINDOW seconds as batched POSTs (up to FITNESS_BATCH_SIZE users
+each) to FITNESS_API_URL. Failed batches are retried with full-jitter
+exponential backoff (honouring Retry-After on 429, up to the backoff cap); if they still fail, the
+batch is held as it is and sent again on the next window. Each batch carries an
+Idempotency-Key that it keeps across every retry and window, so a batch that
+timed out after the platform applied it is recognised as a duplicate rather than
+counted twice. Batches the platform rejects outright (a non-retryable 4xx) are
+dropped and counted in dropped_meals.
+
+Without FITNESS_API_URL the queue runs in dry-run mode and only logs a summary.
+"""
+import os
+import random
+import threading
+import uuid
 from datetime import datetime
 
+PLATFORM = "Fitness API (v1)"
+RETRYABLE_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+# Outcomes of FitnessSyncQueue._send
+SENT, REJECTED, FAILED = "sent", "rejected", "failed"
+
+
+class FitnessSyncQueue:
+    def __init__(self, url=None, flush_window=5.0, batch_size=100, max_retries=4, base_backoff=0.5, max_backoff=30.0, timeout=10.0,
+                 max_held_batches=1000):
+        self.url = url
+        self.flush_window = flush_window
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.max_held_batches = max_held_batches
+
+        self._pending = {}  # user_id -> delta
+        self._held = []  # failed batches awaiting the next window: {"key", "payload", "meals"}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._session = None
+        self.sent_batches = 0
+        self.sent_meals = 0
+        self.failed_batches = 0
+        self.dropped_meals = 0
+        self.last_error = None
+        self._thread = threading.Thread(target=self._flush_loop, name="fitness-sync", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, user_id, calories, protein):
+        """Adds one meal to the user's pending delta; returns how many meals are now pending for them."""
+        now = datetime.now().isoformat()
+        with self._lock:
+            delta = self._pending.get(user_id)
+            if delta is None:
+                delta = self._pending[user_id] = {
+                    "user_id": user_id, "calories_consumed": 0.0, "protein_g": 0.0,
+                    "meals": 0, "window_start": now,
+                }
+            delta["calories_consumed"] += calories or 0.0
+            delta["protein_g"] += protein or 0.0
+            delta["meals"] += 1
+            delta["window_end"] = now
+            return delta["meals"]
+
+    def _hold(self, batch):
+        """Keeps a failed batch, unchanged and with its key, for the next window."""
+        with self._lock:
+            self._held.append(batch)
+            overflow = self._held[:-self.max_held_batches] if len(self._held) > self.max_held_batches else []
+            del self._held[:len(overflow)]
+        if overflow:
+            meals = sum(b["meals"] for b in overflow)
+            self.dropped_meals += meals
+            print(f"❌ Fitness sync holding more than {self.max_held_batches} failed batches; dropping the oldest {meals} meals")
+
+    # -- sending -----------------------------------------------------------
+
+    def _get_session(self):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    @classmethod
+    def _batch(cls, deltas):
+        return {"key": uuid.uuid4().hex, "payload": cls._payload(deltas), "meals": sum(d["meals"] for d in deltas)}
+
+    @staticmethod
+    def _payload(deltas):
+        return {
+            "platform": PLATFORM,
+            "sent_at": datetime.now().isoformat(),
+            "entries": [
+                {
+                    "user_id": d["user_id"],
+                    "metrics": {
+                        "calories_burned": 0,
+                        "calories_consumed": round(d["calories_consumed"], 1),
+                        "protein_g": round(d["protein_g"], 1),
+                    },
+                    "meals": d["meals"],
+                    "window_start": d["window_start"],
+                    "window_end": d["window_end"],
+                }
+                for d in deltas
+            ],
+        }
+
+    def _send(self, batch):
+        """POSTs one batch, retrying transient failures. Returns SENT, REJECTED (not worth retrying) or FAILED."""
+        payload, meals = batch["payload"], batch["meals"]
+        users = len(payload["entries"])
+        if not self.url:
+            print(f"[FITNESS API] (dry run) {users} users, {meals} meals")
+            return SENT
+
+        headers = {"Idempotency-Key": batch["key"]}
+        backoff = self.base_backoff
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                resp = self._get_session().post(self.url, json=payload, headers=headers, timeout=self.timeout)
+                if resp.status_code < 300:
+                    print(f"[FITNESS API] Synced {users} users, {meals} meals")
+                    return SENT
+                self.last_error = f"HTTP {resp.status_code}"
+                if resp.status_code not in RETRYABLE_STATUSES:
+                    print(f"❌ Fitness sync rejected ({self.last_error}); dropping {meals} meals")
+                    return REJECTED
+                retry_after = resp.headers.get("Retry-After")
+            except Exception as e:
+                self.last_error = str(e)
+
+            if attempt == self.max_retries:
+                break
+            # Full jitter so many workers don't retry in lockstep against the platform's rate limit
+            delay = random.uniform(0, min(self.max_backoff, backoff))
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, min(self.max_backoff, float(retry_after)))
+            backoff *= 2
+            # Shutting down: stop retrying so close() gets to its final flush
+            if self._stop.wait(delay):
+                break
+
+        print(f"⚠️ Fitness sync failed after {self.max_retries + 1} attempts ({self.last_error}); holding {meals} meals for the next window")
+        return FAILED
+
+    def flush(self):
+        """Sends held batches, then everything pending. Returns the number of meals synced."""
+        with self._lock:
+            held, self._held = self._held, []
+            deltas, self._pending = list(self._pending.values()), {}
+        batches = held + [self._batch(deltas[i:i + self.batch_size]) for i in range(0, len(deltas), self.batch_size)]
+        synced = 0
+        for batch in batches:
+            outcome = self._send(batch)
+            if outcome == SENT:
+                self.sent_batches += 1
+                self.sent_meals += batch["meals"]
+                synced += batch["meals"]
+            elif outcome == REJECTED:
+                self.failed_batches += 1
+                self.dropped_meals += batch["meals"]
+            else:
+                self.failed_batches += 1
+                self._hold(batch)
+        return synced
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(timeout=self.flush_window)
+            self._wake.clear()
+            # A flush already running when close() is called still ends with one more, final flush
+            stopping = self._stop.is_set()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Fitness sync flush error: {e}")
+            if stopping:
+                return
+
+    def stats(self):
+        with self._lock:
+            pending_meals = sum(d["meals"] for d in self._pending.values())
+            pending_users = len(self._pending)
+            held_batches = len(self._held)
+            held_meals = sum(b["meals"] for b in self._held)
+        return {
+            "mode": "live" if self.url else "dry_run",
+            "pending_users": pending_users,
+            "pending_meals": pending_meals,
+            "held_batches": held_batches,
+            "held_meals": held_meals,
+            "sent_batches": self.sent_batches,
+            "sent_meals": self.sent_meals,
+            "failed_batches": self.failed_batches,
+            "dropped_meals": self.dropped_meals,
+            "last_error": self.last_error,
+        }
+
+    def close(self, timeout=5.0):
+        """Stops the flush thread and makes one last attempt, without retries, to send what is pending."""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=timeout)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_sync_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = FitnessSyncQueue(
+                    url=os.getenv("FITNESS_API_URL") or None,
+                    flush_window=float(os.getenv("FITNESS_FLUSH_WINDOW", "5")),
+                    batch_size=int(os.getenv("FITNESS_BATCH_SIZE", "100")),
+                    max_retries=int(os.getenv("FITNESS_MAX_RETRIES", "4")),
+                    max_held_batches=int(os.getenv("FITNESS_MAX_HELD_BATCHES", "1000")),
+                )
+    return _queue
+
+
+def sync_queue_stats():
+    """Stats for /health without starting the queue just to report on it."""
+    return _queue.stats() if _queue is not None else None
+
+
+def close_sync_queue():
+    if _queue is not None:
+        _queue.close()
+
+
 class FitnessIntegration:
     @staticmethod
     def sync_workout(user_id: str, calories: float, protein: float):
         """
         Integration to a fitness platform (compatible with Google Fit / Apply Health schema).
+        Queues the meal; it is sent with the user's other meals on the next flush.
         """
-        payload = {
-            "platform": "Fitness API (v1)",
-            "user_id": user_id,
-            "metrics": {
-                "calories_burned": 0,
-                "calories_consumed": calories,
-                "protein_g": protein
-            },
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        print(f"\n[FITNESS API] Syncing data to Cloud Health Platform: {payload}\n")
-        return {"status": "success", "synced_payload": payload}
+        pending = get_sync_queue().enqueue(user_id, calories, protein)
+        return {"status": "queued", "platform": PLATFORM, "pending_meals": pending}
@@ -0,0 +1,289 @@
+import asyncio
+import contextvars
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from fastapi import HTTPException
+
+FINISHED = ("done", "failed")
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+
+class JobStore:
+    """Holds job state for async endpoints. Records are plain JSON-serializable dicts."""
+    name = "base"
+
+    def create(self, kind, user_id):
+        raise NotImplementedError
+
+    def update(self, job_id, **fields):
+        raise NotImplementedError
+
+    def get(self, job_id):
+        raise NotImplementedError
+
+
+class MemoryJobStore(JobStore):
+    """Per-process store; finished jobs are dropped after JOB_TTL seconds."""
+    name = "memory"
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in FINISHED and now - job["_updated"] > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def create(self, kind, user_id):
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._prune(now)
+            self._jobs[job_id] = {
+                "job_id": job_id, "kind": kind, "user_id": user_id, "status": "queued",
+                "result": None, "error": None, "error_status": None,
+                "_created": now, "_updated": now,
+            }
+        return job_id
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+                job["_updated"] = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            record = {k: v for k, v in job.items() if not k.startswith("_")}
+        record["created_at"] = _iso(job["_created"])
+        record["updated_at"] = _iso(job["_updated"])
+        return record
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Durable store shared by every worker process on the host; survives restarts.
+
+    Each process owns the jobs it creates under a per-boot id and renews a lease on the
+    unfinished ones every heartbeat. Unfinished jobs whose lease lapsed (their process
+    died or the instance was replaced, taking the task and upload with it) are marked
+    failed, at startup and on every heartbeat, so polls and event streams for them end.
+    The same heartbeat drops finished jobs older than `ttl` seconds.
+    """
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        user_id TEXT,
+        status TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        error_status INTEGER,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        owner TEXT,
+        heartbeat_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_updated ON jobs (status, updated_at);
+    """
+    INSERT_JOB = (
+        "INSERT INTO jobs (id, kind, user_id, status, created_at, updated_at, owner, heartbeat_at) "
+        "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)"
+    )
+    RENEW_LEASES = "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ('queued', 'running')"
+    # Rows from before leases were kept fall back to their last update
+    FAIL_ORPHANED = (
+        "UPDATE jobs SET status = 'failed', error = ?, error_status = 503, updated_at = ? "
+        "WHERE status IN ('queued', 'running') AND owner IS NOT ? AND COALESCE(heartbeat_at, updated_at) < ?"
+    )
+    SELECT_JOB = "SELECT id, kind, user_id, status, result, error, error_status, created_at, updated_at FROM jobs WHERE id = ?"
+    DELETE_EXPIRED = "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?"
+    COLUMNS = ("status", "result", "error", "error_status")
+
+    def __init__(self, path="jobs.db", ttl=86400, lease_seconds=30.0, heartbeat_seconds=10.0):
+        self.path = path
+        self.ttl = ttl
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        # Per boot, never reused: a new process (or instance) never mistakes old jobs for its own
+        self.owner = uuid.uuid4().hex
+        self._local = threading.local()
+        self._stop = threading.Event()
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self.maintain()
+        threading.Thread(target=self._maintain_loop, name="job-lease", daemon=True).start()
+
+    def maintain(self):
+        """Renews our leases, fails jobs whose lease lapsed and drops expired ones; returns how many failed."""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(self.RENEW_LEASES, (now, self.owner))
+            failed = conn.execute(self.FAIL_ORPHANED, (
+                "Interrupted by a restart; please submit again", now, self.owner, now - self.lease_seconds
+            )).rowcount
+            conn.execute(self.DELETE_EXPIRED, (now - self.ttl,))
+        if failed:
+            print(f"⚠️ Marked {failed} jobs interrupted by a restart as failed")
+        return failed
+
+    def _maintain_loop(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            try:
+                self.maintain()
+            except Exception as e:
+                print(f"⚠️ Job lease upkeep failed: {e}")
+
+    def close(self):
+        """Stops the heartbeat; jobs still unfinished are failed by another process once their lease lapses."""
+        self._stop.set()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def create(self, kind, user_id):
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        with conn:
+            conn.execute(self.INSERT_JOB, (job_id, kind, user_id, now, now, self.owner, now))
+        return job_id
+
+    def update(self, job_id, **fields):
+        columns = [c for c in self.COLUMNS if c in fields]
+        values = [json.dumps(fields[c]) if c == "result" else fields[c] for c in columns]
+        assignments = ", ".join(f"{c} = ?" for c in columns + ["updated_at"])
+        conn = self._connect()
+        with conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", values + [time.time(), job_id])
+
+    def get(self, job_id):
+        row = self._connect().execute(self.SELECT_JOB, (job_id,)).fetchone()
+        if row is None:
+            return None
+        job_id, kind, user_id, status, result, error, error_status, created_at, updated_at = row
+        return {
+            "job_id": job_id, "kind": kind, "user_id": user_id, "status": status,
+            "result": json.loads(result) if result else None,
+            "error": error, "error_status": error_status,
+            "created_at": _iso(created_at), "updated_at": _iso(updated_at),
+        }
+
+
+class JobRunner:
+    """
+    Runs submitted jobs and records their progress in a JobStore. Coroutine functions
+    run as tasks on the caller's event loop, plain functions on a thread pool; either
+    way at most `workers` jobs run at once.
+    """
+
+    def __init__(self, store, workers=4):
+        self.store = store
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+        self._semaphore = None
+        self._semaphore_loop = None
+        self._tasks = set()
+
+    def submit(self, kind, user_id, func, *args):
+        job_id = self.store.create(kind, user_id)
+        if inspect.iscoroutinefunction(func):
+            loop = asyncio.get_running_loop()
+            if self._semaphore_loop is not loop:
+                self._semaphore = asyncio.Semaphore(self.workers)
+                self._semaphore_loop = loop
+            # Fresh context: the job must not add spans to the request trace that submitted it
+            task = loop.create_task(self._run_async(job_id, func, args), context=contextvars.Context())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self.executor.submit(self._run, job_id, func, args)
+        return job_id
+
+    def _run(self, job_id, func, args):
+        self.store.update(job_id, status="running")
+        try:
+            result = func(*args)
+            self.store.update(job_id, status="done", result=result)
+        except Exception as e:
+            self._fail(job_id, e)
+
+    async def _run_async(self, job_id, func, args):
+        # Store writes may hit disk (SQLite), so they run off the event loop
+        async with self._semaphore:
+            await asyncio.to_thread(self.store.update, job_id, status="running")
+            try:
+                result = await func(*args)
+                await asyncio.to_thread(self.store.update, job_id, status="done", result=result)
+            except Exception as e:
+                await asyncio.to_thread(self._fail, job_id, e)
+
+    def _fail(self, job_id, e):
+        if isinstance(e, HTTPException):
+            self.store.update(job_id, status="failed", error=str(e.detail), error_status=e.status_code)
+        else:
+            print(f"❌ Job {job_id} failed: {e}")
+            self.store.update(job_id, status="failed", error=str(e), error_status=500)
+
+
+def create_job_store():
+    """
+    Picks the job store from JOB_STORE (memory | sqlite). Finished jobs are kept JOB_TTL
+    seconds (default 3600 in memory, 86400 in SQLite); SQLite leases last JOB_LEASE_SECONDS.
+    """
+    if os.getenv("JOB_STORE", "memory").lower() == "sqlite":
+        return SQLiteJobStore(
+            os.getenv("JOB_STORE_PATH", "jobs.db"),
+            ttl=float(os.getenv("JOB_TTL", "86400")),
+            lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "30")),
+            heartbeat_seconds=float(os.getenv("JOB_LEASE_SECONDS", "30")) / 3,
+        )
+    return MemoryJobStore(ttl=float(os.getenv("JOB_TTL", "3600")))
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    """Process-wide job runner; the pool is only started once the first async job arrives."""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = JobRunner(create_job_store(), workers=int(os.getenv("ANALYZE_WORKERS", "4")))
+    return _runner
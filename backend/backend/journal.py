@@ -0,0 +1,400 @@
+"""
+Local write-ahead journal for storage writes that failed (or had no database to go to).
+
+Writes are appended as JSON lines to a per-boot file under JOURNAL_DIR and
+fsynced in small groups: concurrent appenders share one fsync per
+JOURNAL_FSYNC_WINDOW_MS. A background replayer drains the journal into the
+configured storage in batches, backing off exponentially (with jitter) while
+storage keeps failing. Journals left behind by dead processes are adopted and
+drained too (each live process holds an flock on its own file).
+
+Delivery is at-least-once: an entry can be replayed twice if the process dies
+between writing a batch and saving its checkpoint. An append whose write or fsync
+fails raises JournalError, so the caller never reports a lost write as queued; one
+that times out before its write started is dropped, so a retry can't duplicate it.
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, no cross-process locking needed
+    fcntl = None
+
+from backend import changes
+from backend.storage import get_storage
+
+
+# Longest an append waits for its fsync before the write counts as failed
+APPEND_TIMEOUT = 5.0
+
+
+class JournalError(Exception):
+    """A journal append could not be made durable; the write it carried is lost."""
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+def _decode(obj):
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def _try_lock(f):
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def apply_entry(storage, entry):
+    """Performs one journaled write against storage."""
+    payload = entry["payload"]
+    if entry["op"] == "add_food_log":
+        storage.add_food_log(entry["user_id"], payload["nutrition"], payload["timestamp"])
+        changes.notify(entry["user_id"], "food_logs")
+    elif entry["op"] == "add_chat_messages":
+        storage.add_chat_messages(entry["user_id"], [tuple(m) for m in payload["messages"]], payload["timestamp"])
+        changes.notify(entry["user_id"], "chats")
+    else:
+        raise ValueError(f"Unknown journal op: {entry['op']}")
+
+
+class WriteJournal:
+    def __init__(self, directory, fsync_window=0.02, batch_size=50, base_backoff=1.0, max_backoff=60.0, max_attempts=8):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        # Unique per boot: a restarted worker that gets the same pid adopts its predecessor's file
+        # like any other orphan instead of appending to it with no idea what is pending there
+        self.path = os.path.join(directory, f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+        self.fsync_window = fsync_window
+        self.batch_size = batch_size
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+
+        # Unbuffered, so a failed write can be cut off cleanly with nothing left to flush later
+        self._file = open(self.path, "ab", buffering=0)
+        _try_lock(self._file)
+        self._file_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._queue = []
+        self._pending = deque()  # enqueued_at of entries in our own file not yet replayed
+        self._orphans = {}  # path -> (open handle holding the lock, remaining entries)
+        self._attempts = {}
+        self._wake = threading.Event()
+        self._closed = False
+        self.backoff = 0.0
+        self._retry_at = 0.0
+        self.last_error = None
+        self.dead_letters = 0
+        self.replayed = 0
+
+        threading.Thread(target=self._flush_loop, name="journal-flush", daemon=True).start()
+        threading.Thread(target=self._replay_loop, name="journal-replay", daemon=True).start()
+
+    # -- appending ---------------------------------------------------------
+
+    def _enqueue(self, op, user_id, payload):
+        """Queues an entry for the next group fsync; the Future resolves once it is on disk."""
+        entry = {"id": uuid.uuid4().hex, "op": op, "user_id": user_id, "payload": payload, "enqueued_at": time.time()}
+        line = (json.dumps(entry, default=_encode) + "\n").encode("utf-8")
+        done = Future()
+        with self._cond:
+            self._queue.append((line, entry["enqueued_at"], done))
+            self._cond.notify()
+        return done
+
+    def append(self, op, user_id, payload):
+        """Journals a write and returns once it is fsynced; raises JournalError if it couldn't be."""
+        done = self._enqueue(op, user_id, payload)
+        try:
+            done.result(timeout=APPEND_TIMEOUT)
+        except FutureTimeout:
+            if done.cancel():
+                raise JournalError(f"fsync not confirmed within {APPEND_TIMEOUT:g}s")
+            # Already being written, so it can no longer be dropped: report how that ends
+            done.result()
+        print(f"📝 Journaled {op} for {user_id}; will replay when storage is reachable")
+
+    async def append_async(self, op, user_id, payload):
+        """append() for request handlers: waits for the fsync without blocking the event loop."""
+        done = self._enqueue(op, user_id, payload)
+        waiter = asyncio.wrap_future(done)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), APPEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            if done.cancel():
+                raise JournalError(f"fsync not confirmed within {APPEND_TIMEOUT:g}s")
+            await waiter
+        print(f"📝 Journaled {op} for {user_id}; will replay when storage is reachable")
+
+    def _write_all(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[self._file.write(view):]
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+            # Let concurrent writers join this fsync
+            time.sleep(self.fsync_window)
+            with self._cond:
+                batch, self._queue = self._queue, []
+            # Appends that gave up waiting were told the write failed; writing them would duplicate a retry
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            error = None
+            with self._file_lock:
+                size = os.fstat(self._file.fileno()).st_size
+                try:
+                    self._write_all(b"".join(line for line, _, _ in batch))
+                    os.fsync(self._file.fileno())
+                    self._pending.extend(enqueued_at for _, enqueued_at, _ in batch)
+                except Exception as e:
+                    error = JournalError(f"journal write failed: {e}")
+                    print(f"❌ Journal write failed; {len(batch)} writes not journaled: {e}")
+                    try:
+                        # Drop a partly written batch, or its torn line would block replay of later entries
+                        os.ftruncate(self._file.fileno(), size)
+                    except OSError:
+                        pass
+            for _, _, done in batch:
+                if error:
+                    done.set_exception(error)
+                else:
+                    done.set_result(None)
+            self._wake.set()
+
+    # -- replaying ---------------------------------------------------------
+
+    @staticmethod
+    def _offset_path(path):
+        return path + ".offset"
+
+    def _read_offset(self, path):
+        try:
+            with open(self._offset_path(path)) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_offset(self, path, offset):
+        tmp = self._offset_path(path) + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._offset_path(path))
+
+    def _read_batch(self, path, offset):
+        """Returns [(entry, end_offset)] for up to batch_size complete lines after offset."""
+        batch = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while len(batch) < self.batch_size:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break  # EOF or a line still being written
+                offset += len(line)
+                batch.append((json.loads(line, object_hook=_decode), offset))
+        return batch
+
+    def _dead_letter(self, entry, error):
+        with open(os.path.join(self.directory, "dead_letters.jsonl"), "a") as f:
+            f.write(json.dumps({"entry": entry, "error": str(error), "at": time.time()}, default=_encode) + "\n")
+        self.dead_letters += 1
+        print(f"☠️ Journal entry {entry['id']} moved to dead letters after {self.max_attempts} attempts: {error}")
+
+    def _drain(self, path, own):
+        """Replays one batch from a journal file. Returns the number of entries consumed."""
+        storage = get_storage()
+        if storage is None:
+            raise RuntimeError("storage not configured")
+        offset = self._read_offset(path)
+        if offset > os.path.getsize(path):
+            offset = 0  # checkpoint from before a compaction
+        if own:
+            # Read under the file lock so the batch and self._pending stay in step
+            with self._file_lock:
+                batch = self._read_batch(path, offset)
+        else:
+            batch = self._read_batch(path, offset)
+        consumed = 0
+        try:
+            for entry, end in batch:
+                try:
+                    apply_entry(storage, entry)
+                except Exception as e:
+                    attempts = self._attempts.get(entry["id"], 0) + 1
+                    self._attempts[entry["id"]] = attempts
+                    if attempts < self.max_attempts:
+                        raise
+                    self._dead_letter(entry, e)
+                self._attempts.pop(entry["id"], None)
+                offset = end
+                consumed += 1
+        finally:
+            if consumed:
+                self._write_offset(path, offset)
+                self.replayed += consumed
+                if own:
+                    for _ in range(consumed):
+                        if self._pending:
+                            self._pending.popleft()
+        return consumed
+
+    def _compact(self):
+        """Truncates our own journal once everything in it has been replayed."""
+        with self._file_lock:
+            if self._closed or self._pending or self._read_offset(self.path) != os.path.getsize(self.path):
+                return
+            # Checkpoint first: a crash in between replays entries again rather than skipping new ones
+            self._write_offset(self.path, 0)
+            self._file.truncate(0)
+
+    def _adopt_orphans(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".jsonl") or name == "dead_letters.jsonl" or path == self.path or path in self._orphans:
+                continue
+            handle = open(path, "ab")
+            if _try_lock(handle):
+                remaining = sum(1 for _ in self._iter_remaining(path))
+                self._orphans[path] = [handle, remaining]
+                if remaining:
+                    print(f"📥 Adopted journal {name} with {remaining} pending writes")
+            else:
+                handle.close()
+
+    def _iter_remaining(self, path):
+        with open(path, "rb") as f:
+            f.seek(self._read_offset(path))
+            for line in f:
+                if line.endswith(b"\n"):
+                    yield line
+
+    def _replay_loop(self):
+        last_orphan_scan = 0.0
+        while True:
+            self._wake.wait(timeout=max(0.0, self._retry_at - time.time()) or 1.0)
+            self._wake.clear()
+            if self._closed:
+                return
+            if time.time() < self._retry_at:
+                continue  # new appends don't cut a backoff short
+            try:
+                if time.time() - last_orphan_scan > 30:
+                    self._adopt_orphans()
+                    last_orphan_scan = time.time()
+
+                for path, state in list(self._orphans.items()):
+                    while state[1] > 0:
+                        consumed = self._drain(path, own=False)
+                        if not consumed:
+                            break
+                        state[1] -= consumed
+                    if state[1] <= 0:
+                        state[0].close()
+                        for p in (path, self._offset_path(path)):
+                            if os.path.exists(p):
+                                os.remove(p)
+                        del self._orphans[path]
+
+                while self._pending:
+                    if not self._drain(self.path, own=True):
+                        break
+                self._compact()
+                self.backoff = 0.0
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                self.backoff = min(self.max_backoff, max(self.base_backoff, self.backoff * 2))
+                # Full jitter so workers recovering together don't stampede Firestore
+                self.backoff = random.uniform(self.base_backoff, self.backoff)
+                self._retry_at = time.time() + self.backoff
+                print(f"⚠️ Journal replay failed ({e}); retrying in {self.backoff:.1f}s")
+
+    # -- reporting ---------------------------------------------------------
+
+    def stats(self):
+        depth = len(self._pending) + sum(state[1] for state in self._orphans.values())
+        oldest = self._pending[0] if self._pending else None
+        return {
+            "depth": depth,
+            "oldest_age_s": round(time.time() - oldest, 1) if oldest else None,
+            "replayed": self.replayed,
+            "dead_letters": self.dead_letters,
+            "retry_in_s": round(self.backoff, 1) if self.last_error else None,
+            "last_error": self.last_error,
+        }
+
+    def close(self):
+        """Removes our journal on shutdown if nothing is left to replay; otherwise another worker adopts it."""
+        with self._file_lock:
+            self._closed = True
+            empty = not self._pending and os.path.getsize(self.path) <= self._read_offset(self.path)
+            self._file.close()
+            if empty:
+                for p in (self.path, self._offset_path(self.path)):
+                    if os.path.exists(p):
+                        os.remove(p)
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = WriteJournal(
+                    os.getenv("JOURNAL_DIR", "journal"),
+                    fsync_window=float(os.getenv("JOURNAL_FSYNC_WINDOW_MS", "20")) / 1000,
+                    batch_size=int(os.getenv("JOURNAL_BATCH_SIZE", "50")),
+                )
+    return _journal
+
+
+def journal_stats():
+    """Stats for /health without creating a journal just to report on it."""
+    if _journal is None:
+        return {"depth": 0, "oldest_age_s": None, "replayed": 0, "dead_letters": 0, "retry_in_s": None, "last_error": None}
+    return _journal.stats()
+
+
+def resume_journals():
+    """Starts the replayer at boot if earlier processes left journals behind."""
+    directory = os.getenv("JOURNAL_DIR", "journal")
+    if os.path.isdir(directory) and any(n.endswith(".jsonl") and n != "dead_letters.jsonl" for n in os.listdir(directory)):
+        get_journal()
+
+
+def close_journal():
+    global _journal
+    with _journal_lock:
+        if _journal is not None:
+            _journal.close()
+            _journal = None
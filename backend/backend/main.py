@@ -1,16 +1,207 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Query
 # Force reload to pick up new .env changes
 from backend.models import AnalysisResponse, NutritionInfo, ChatRequest
-from backend.integration import FitnessIntegration
-from backend.firebase_utils import db
-from ai_core.gemini_client import analyze_food_image, generate_text, analyze_audio
+from backend.integration import FitnessIntegration, sync_queue_stats, close_sync_queue
+from backend.storage import get_storage, FOOD_LOG_FIELDS
+from backend.tracing import span, start_trace, server_timing_header, export_trace, flush_exports
+from ai_core.gemini_client import analyze_food_image, generate_text, analyze_audio, parse_json_text
 # from ai_core.openai_client import analyze_food_image
 # from ai_core.groq_client import analyze_food_image
+from backend.warmup import run_warmup, warmup_state
+from backend.jobs import get_job_runner, FINISHED
+from backend.journal import get_journal, journal_stats, resume_journals, close_journal, JournalError
+from backend.chat_memory import load_memory, format_memory, schedule_refresh
+from backend.stats import parse_range, load_stats
+from backend import changes
+from ai_core.config import get_config
+from ai_core.http_pool import close_http_client
+from ai_core.deadline import deadline, run_with_deadline, DeadlineExceeded
+from ai_core import usage
+from ai_core.usage import usage_scope
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+import asyncio
+import functools
+import hmac
+import json
 import shutil
+import threading
+import time
+import uuid
 import os
+import hashlib
+import orjson
 
-app = FastAPI(title="Food Vision API")
+def store_usage(rows):
+    """Sink for ai_core.usage flushes."""
+    storage = get_storage()
+    if storage is None:
+        raise RuntimeError("storage not configured")
+    storage.add_usage(rows)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background: the worker starts accepting connections right away,
+    # but /health reports it as not ready until connections and model handles are primed.
+    warmup_task = asyncio.create_task(run_warmup())
+    resume_journals()
+    usage.start_flusher(store_usage)
+    yield
+    warmup_task.cancel()
+    usage.flush(store_usage)
+    close_journal()
+    close_sync_queue()
+    await close_http_client()
+    flush_exports()
+
+def _json_default(value):
+    # Firestore timestamps are datetime subclasses, which orjson only serializes natively as exact datetimes
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+class FastJSONResponse(ORJSONResponse):
+    """orjson-encoded responses; datetimes (Firestore's included) become ISO 8601 strings."""
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+
+app = FastAPI(title="Food Vision API", lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# Longest an SSE client is kept waiting for a job to finish
+JOB_EVENTS_TIMEOUT = float(os.getenv("JOB_EVENTS_TIMEOUT", "300"))
+# A change stream is closed after this long; clients reconnect (and get a fresh 'hello')
+CHANGES_STREAM_TIMEOUT = float(os.getenv("CHANGES_STREAM_TIMEOUT", "300"))
+
+# Time budget per endpoint in seconds (override with e.g. DEADLINE_ANALYZE=20). Every model
+# call and storage operation in the request shares it; when it runs out the request gets a 504.
+# Model calls are also bounded here, not just inside ai_core, so cassettes and stubs obey it too,
+# and so are storage reads (see read_storage).
+DEADLINES = {
+    name: float(os.getenv(f"DEADLINE_{name.upper()}", default))
+    for name, default in (
+        ("analyze", "30"), ("analyze_job", "120"), ("history", "5"), ("coach", "20"),
+        ("chat", "25"), ("voice_chat", "30"), ("chats", "5"), ("stats", "10"),
+    )
+}
+
+def budgeted(name):
+    """Runs an endpoint under its DEADLINES budget and bills its model usage to the endpoint and user."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with deadline(DEADLINES[name], name), usage_scope(kwargs.get("user_id"), name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+async def read_storage(func, *args, **kwargs):
+    """
+    Runs a blocking storage read on a worker thread within what is left of the request's
+    budget. Firestore gets that budget per RPC too, but a paged or fallback scan can make
+    several; this bounds the whole read. A read cut off here finishes in the background and
+    is discarded. Writes are not cut off: one still in flight could land after being journaled.
+    """
+    return await run_with_deadline(asyncio.to_thread(func, *args, **kwargs), f"storage.{func.__name__}")
+
+# How long a served ETag is vouched for by this worker's change counter alone. Past that the
+# data is read again, so writes this worker never saw (another instance, a migration) show up.
+VALIDATOR_MAX_AGE = float(os.getenv("VALIDATOR_MAX_AGE", "30"))
+VALIDATORS_MAX_ENTRIES = 10000
+
+_validators = OrderedDict()  # (user_id, kind, variant) -> {"version", "etag", "modified", "checked_at"}
+_validators_lock = threading.Lock()
+
+class ConditionalGet:
+    """
+    If-None-Match / If-Modified-Since for one kind of a user's data (backend.changes.KINDS).
+
+    The ETag is a digest of the body, so every worker tags the same data alike. Once this
+    worker has served a tag, a client presenting it gets a 304 from not_modified() before
+    storage is read, as long as the user's change counter hasn't moved and the data was
+    read within VALIDATOR_MAX_AGE seconds; otherwise respond() renders the fresh read and
+    still answers 304 when the digest matches. Last-Modified is the last write this worker
+    saw, or when it first served data it didn't see being written.
+    """
+
+    def __init__(self, request: Request, user_id, kind, variant=None):
+        self.request = request
+        self.key = (user_id, kind, variant)
+        # Taken before storage is read, so a write landing during the read leaves the counter ahead
+        self.version, self.written_at = changes.version(user_id, kind)
+
+    def _headers(self, memo):
+        # Clients may keep the body but must check back before reusing it
+        return {
+            "ETag": memo["etag"],
+            "Last-Modified": format_datetime(memo["modified"].astimezone(timezone.utc), usegmt=True),
+            "Cache-Control": "private, no-cache",
+        }
+
+    def _matches(self, memo):
+        if_none_match = self.request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return if_none_match.strip() == "*" or memo["etag"] in [tag.strip() for tag in if_none_match.split(",")]
+        try:
+            since = parsedate_to_datetime(self.request.headers.get("If-Modified-Since", ""))
+        except (TypeError, ValueError):
+            return False
+        return since.tzinfo is not None and memo["modified"].astimezone(timezone.utc).replace(microsecond=0) <= since
+
+    def not_modified(self):
+        """A 304 if the client's copy is still current by the change counter, else None. Reads no storage."""
+        with _validators_lock:
+            memo = _validators.get(self.key)
+        if (memo is None or memo["version"] != self.version
+                or time.monotonic() - memo["checked_at"] > VALIDATOR_MAX_AGE or not self._matches(memo)):
+            return None
+        return Response(status_code=304, headers=self._headers(memo))
+
+    def respond(self, content):
+        """Renders freshly read `content`, or a 304 if the client already has it."""
+        body = FastJSONResponse(None).render(content)
+        etag = f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        with _validators_lock:
+            previous = _validators.get(self.key)
+            if previous is not None and previous["etag"] == etag:
+                modified = previous["modified"]
+            elif self.written_at is not None and (previous is None or previous["version"] != self.version):
+                modified = self.written_at
+            else:
+                modified = datetime.now()
+            memo = _validators[self.key] = {
+                "version": self.version, "etag": etag, "modified": modified, "checked_at": time.monotonic(),
+            }
+            _validators.move_to_end(self.key)
+            while len(_validators) > VALIDATORS_MAX_ENTRIES:
+                _validators.popitem(last=False)
+        if self._matches(memo):
+            return Response(status_code=304, headers=self._headers(memo))
+        return Response(body, media_type="application/json", headers=self._headers(memo))
+
+# What GET /history?fields=... may ask for: a top-level field or "nutrition.<key>"
+HISTORY_FIELDS = FOOD_LOG_FIELDS + tuple(f"nutrition.{name}" for name in NutritionInfo.model_fields)
+
+def parse_fields(fields):
+    """Comma-separated field list -> tuple (None for all fields); unknown names are a 400."""
+    if not fields:
+        return None
+    requested = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in requested if name not in HISTORY_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(HISTORY_FIELDS)}")
+    return requested or None
+
+# Responses above COMPRESS_MIN_BYTES are gzipped for clients that accept it (SSE streams never are)
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=int(os.getenv("COMPRESS_MIN_BYTES", "1024")),
+    compresslevel=int(os.getenv("COMPRESS_LEVEL", "6")),
+)
 
 # Add CORS middleware
 app.add_middleware(
@@ -19,18 +210,57 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "ETag"],
 )
 
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """Traces each request and reports its span breakdown in a Server-Timing header."""
+    trace = start_trace(f"{request.method} {request.url.path}", http_method=request.method, http_target=request.url.path)
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        trace.root.finish(error=e)
+        export_trace(trace)
+        raise
+    trace.root.set_attribute("http_status_code", response.status_code)
+    trace.root.finish()
+    response.headers["Server-Timing"] = server_timing_header(trace)
+    export_trace(trace)
+    return response
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    print(f"⏱️ {request.url.path}: {exc}")
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
 @app.get("/health")
 def health_check():
-    """Diagnostic endpoint for deployment debugging."""
+    """Diagnostic endpoint for deployment debugging. Returns 503 until warm-up completes."""
+    if not warmup_state.ready:
+        return JSONResponse(status_code=503, content={
+            "status": "warming_up",
+            "ready": False,
+            "warmup": warmup_state.as_dict()
+        })
+
+    storage = get_storage()
+    config = get_config()
     return {
         "status": "online",
-        "database": "connected" if db else "missing_credentials",
-        "ai_key": "configured" if os.getenv("GOOGLE_API_KEY") else "missing",
+        "ready": True,
+        "warmup": warmup_state.as_dict(),
+        "database": "connected" if storage else "missing_credentials",
+        "storage": storage.name if storage else None,
+        "write_journal": journal_stats(),
+        "fitness_sync": sync_queue_stats(),
+        "change_streams": changes.listener_count(),
+        "missing_indexes": storage.missing_indexes() if storage else [],
+        "ai_key": "configured" if config.get("GOOGLE_API_KEY") else "missing",
+        "config_version": config.version,
         "env_vars": {
-            "FIREBASE_CREDENTIALS_PATH": os.getenv("FIREBASE_CREDENTIALS_PATH", "default"),
-            "GOOGLE_API_KEY_PRESENT": bool(os.getenv("GOOGLE_API_KEY")),
+            "FIREBASE_CREDENTIALS_PATH": config.get("FIREBASE_CREDENTIALS_PATH", "default"),
+            "GOOGLE_API_KEY_PRESENT": bool(config.get("GOOGLE_API_KEY")),
             "BACKEND_URL_EXTERNAL": os.getenv("RENDER_EXTERNAL_URL", "not_set")
         }
     }
@@ -39,119 +269,242 @@ def health_check():
 def read_root():
     return {"status": "online", "message": "Food Vision Backend is Running. Visit /health for diagnostics."}
 
+async def journal_write(op, user_id, payload):
+    """Journals a storage write that failed; a 503 if the journal can't make it durable either."""
+    try:
+        await get_journal().append_async(op, user_id, payload)
+    except JournalError as e:
+        print(f"❌ Write lost for {user_id}: {e}")
+        raise HTTPException(status_code=503, detail="Could not save your data right now; please try again")
+
+async def run_analysis(temp_filename, user_id):
+    """
+    The /analyze pipeline: AI analysis, storage and fitness sync for a saved upload.
+    Awaited inline for sync requests and run as a job for mode=async. Removes the temp file.
+    """
+    try:
+        # 2. Call AI
+        with span("analyze_food_image", user_id=user_id):
+            ai_result = await run_with_deadline(analyze_food_image(temp_filename), "analyze_food_image")
+        # Use Groq result if available; on error return HTTP 502
+        if "error" in ai_result:
+            print(f"AI Error: {ai_result.get('error')}")
+            raise HTTPException(status_code=502, detail=f"AI analysis failed: {ai_result.get('error')}")
+
+        # Build nutrition model from AI result
+        nutrition_data = ai_result
+        nutrition_info = NutritionInfo(**nutrition_data)
+        final_message = "Food analyzed successfully"
+
+        # 3. Store in Firebase (journaled locally and replayed later if that fails)
+        logged_at = datetime.now()
+        try:
+            storage = get_storage()
+            if not storage:
+                raise RuntimeError("Database not initialized")
+            await asyncio.to_thread(storage.add_food_log, user_id, nutrition_info.dict(), logged_at)
+            changes.notify(user_id, "food_logs")
+        except Exception as e:
+            print(f"\n[WARNING] Database Write Failed: {e}")
+            await journal_write("add_food_log", user_id, {"nutrition": nutrition_info.dict(), "timestamp": logged_at})
+
+        # 4. Integrate with Fitness Platform
+        sync_result = FitnessIntegration.sync_workout(
+            user_id=user_id, 
+            calories=nutrition_info.calories, 
+            protein=nutrition_info.protein_g
+        )
+
+        return AnalysisResponse(
+            nutrition=nutrition_info,
+            message=final_message,
+            fitness_sync_status=sync_result
+        )
+    finally:
+        # Clean up
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+async def run_analysis_job(temp_filename, user_id):
+    try:
+        with deadline(DEADLINES["analyze_job"], "analyze_job"), usage_scope(user_id, "analyze_job"):
+            return (await run_analysis(temp_filename, user_id)).dict()
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
 @app.post("/analyze", response_model=AnalysisResponse)
-async def analyze_food(file: UploadFile = File(...), user_id: str = "demo_user"):
+@budgeted("analyze")
+async def analyze_food(file: UploadFile = File(...), user_id: str = "demo_user", mode: str = "sync"):
     """
     Receives an image, processing it via AI, 
     saves to Firebase, and syncs with Fitness Platform.
+    With mode=async, returns a job id right away; poll /jobs/{job_id} or stream /jobs/{job_id}/events.
     """
+    if mode not in ("sync", "async"):
+        raise HTTPException(status_code=400, detail="mode must be 'sync' or 'async'")
     
-    # 1. Save temp file
-    temp_filename = f"temp_{file.filename}"
+    # 1. Save temp file (unique name: uploads are processed concurrently)
+    temp_filename = f"temp_{uuid.uuid4().hex[:8]}_{os.path.basename(file.filename or 'upload.jpg')}"
     with open(temp_filename, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
-        
-    # 2. Call AI
-    ai_result = analyze_food_image(temp_filename)
-    # Use Groq result if available; on error return HTTP 502
-    if "error" in ai_result:
-        print(f"AI Error: {ai_result.get('error')}")
-        raise HTTPException(status_code=502, detail=f"AI analysis failed: {ai_result.get('error')}")
 
-    # Build nutrition model from AI result
-    nutrition_data = ai_result
-    nutrition_info = NutritionInfo(**nutrition_data)
-    final_message = "Food analyzed successfully"
+    if mode == "async":
+        job_id = get_job_runner().submit("analyze", user_id, run_analysis_job, temp_filename, user_id)
+        return JSONResponse(status_code=202, content={
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/jobs/{job_id}",
+            "events_url": f"/jobs/{job_id}/events"
+        })
 
-    # 3. Store in Firebase
+    return await run_analysis(temp_filename, user_id)
 
-    
-    # 3. Store in Firebase
-    try:
-        if db:
-            doc_ref = db.collection(u'food_logs').document()
-            doc_ref.set({
-                u'user_id': user_id,
-                u'food_name': nutrition_info.food_name,
-                u'calories': nutrition_info.calories,
-                u'timestamp': datetime.now(),
-                u'nutrition': nutrition_info.dict()
-            })
-    except Exception as e:
-        print(f"\n[WARNING] Database Write Failed: {e}")
-        print("Continuing without saving to DB (Hackathon Mode)\n")
-    
-    # 4. Integrate with Fitness Platform
-    sync_result = FitnessIntegration.sync_workout(
-        user_id=user_id, 
-        calories=nutrition_info.calories, 
-        protein=nutrition_info.protein_g
-    )
-    
-    # Clean up
-    if os.path.exists(temp_filename):
-        os.remove(temp_filename)
-        
-    return AnalysisResponse(
-        nutrition=nutrition_info,
-        message=final_message,
-        fitness_sync_status=sync_result
-    )
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Returns the state of an async job: queued, running, done (with result) or failed (with error).
+    """
+    job = await asyncio.to_thread(get_job_runner().store.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-Sent Events stream for an async job. Emits an event each time the status
+    changes and closes after the 'done' or 'failed' event.
+    """
+    store = get_job_runner().store
+    # The store may be SQLite; polls run off the event loop so streams don't stall other requests
+    if not await asyncio.to_thread(store.get, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        last_status = None
+        started = time.monotonic()
+        last_sent = started
+        while True:
+            job = await asyncio.to_thread(store.get, job_id)
+            if job and job["status"] != last_status:
+                last_status = job["status"]
+                last_sent = time.monotonic()
+                yield f"event: {last_status}\ndata: {json.dumps(job)}\n\n"
+                if last_status in FINISHED:
+                    return
+            if time.monotonic() - started > JOB_EVENTS_TIMEOUT:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            if time.monotonic() - last_sent > 15:
+                # Comment line keeps proxies from closing an idle stream
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(0.25)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.get("/changes/{user_id}")
+async def change_events(user_id: str):
+    """
+    Server-Sent Events stream of a user's writes. Opens with a 'hello' event holding the
+    current epoch and per-kind versions, then sends a 'change' event ({kind, version, at})
+    after each food log or chat write, so clients refetch only what changed.
+    """
+    async def event_stream():
+        # Listen before taking the snapshot so a write in between is not missed
+        queue = changes.listen(user_id)
+        try:
+            yield f"event: hello\ndata: {json.dumps(changes.snapshot(user_id))}\n\n"
+            closes_at = time.monotonic() + CHANGES_STREAM_TIMEOUT
+            while (left := closes_at - time.monotonic()) > 0:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=min(15, left))
+                    yield f"event: change\ndata: {json.dumps(event)}\n\n"
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+        finally:
+            changes.unlisten(user_id, queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
 
 @app.get("/history/{user_id}")
-async def get_history(user_id: str):
+@budgeted("history")
+async def get_history(user_id: str, request: Request, fields: str = None):
     """
     Fetches food history for a specific user from Firebase.
+    `fields` (e.g. "food_name,calories,timestamp,nutrition.protein_g") limits each entry to
+    those fields, and Firestore reads only those. Supports If-None-Match and If-Modified-Since:
+    unchanged history is answered with 304, usually without reading storage.
     """
-    if not db:
+    fields = parse_fields(fields)
+    storage = get_storage()
+    if not storage:
         raise HTTPException(status_code=503, detail="Database not initialized")
+    conditional = ConditionalGet(request, user_id, "food_logs", variant=fields)
+    not_modified = conditional.not_modified()
+    if not_modified is not None:
+        return not_modified
         
     try:
-        logs_ref = db.collection(u'food_logs')
-        query = logs_ref.where(u'user_id', u'==', user_id).order_by(u'timestamp', direction=firestore.Query.DESCENDING).limit(10)
-        docs = query.stream()
-        
-        history = []
-        for doc in docs:
-            log_data = doc.to_dict()
-            # Convert datetime to string for JSON serialization
-            if 'timestamp' in log_data and log_data['timestamp']:
-                log_data['timestamp'] = log_data['timestamp'].isoformat()
-            history.append(log_data)
-            
-        return {"user_id": user_id, "history": history}
+        # A missing Firestore index is handled in storage (backend.query_planner)
+        docs = await read_storage(storage.get_food_logs, user_id, limit=10, fields=fields)
+        return conditional.respond({"user_id": user_id, "history": docs})
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error fetching history: {e}")
-        # Fallback if index is not created yet (Firestore requires indexes for where + order_by)
-        try:
-            docs = logs_ref.where(u'user_id', u'==', user_id).limit(10).stream()
-            history = []
-            for doc in docs:
-                log_data = doc.to_dict()
-                if 'timestamp' in log_data and log_data['timestamp']:
-                    log_data['timestamp'] = log_data['timestamp'].isoformat()
-                history.append(log_data)
-            return {"user_id": user_id, "history": history, "note": "Simple query used (no ordering)"}
-        except:
-            raise HTTPException(status_code=500, detail=f"Failed to fetch history: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch history: {str(e)}")
+
+@app.get("/stats/{user_id}")
+@budgeted("stats")
+async def get_stats(user_id: str, from_date: str = Query(None, alias="from"), to_date: str = Query(None, alias="to"), granularity: str = "day"):
+    """
+    Calorie and macro series (per day or ISO week), totals and top foods for a date range.
+    `from` and `to` are inclusive YYYY-MM-DD dates (default: the last 30 days). Series are
+    parallel arrays with one entry per period, zero-filled where nothing was logged.
+    """
+    try:
+        start, end, granularity = parse_range(from_date, to_date, granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    storage = get_storage()
+    if not storage:
+        raise HTTPException(status_code=503, detail="Database not initialized")
+
+    try:
+        stats = await read_storage(load_stats, storage, user_id, start, end, granularity)
+        return dict(stats, user_id=user_id)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error computing stats: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to compute stats: {str(e)}")
 
 @app.get("/coach/{user_id}")
+@budgeted("coach")
 async def get_coaching(user_id: str):
     """
     Analyzes user history and provides coaching insights and meal suggestions.
     """
-    if not db:
+    storage = get_storage()
+    if not storage:
         raise HTTPException(status_code=503, detail="Database not initialized")
         
     try:
         # 1. Fetch recent history
-        logs_ref = db.collection(u'food_logs')
-        docs = logs_ref.where(u'user_id', u'==', user_id).order_by(u'timestamp', direction=firestore.Query.DESCENDING).limit(10).stream()
+        docs = await read_storage(storage.get_food_logs, user_id, limit=10, fields=("food_name", "calories"))
         
         history_summary = []
         total_calories = 0
-        for doc in docs:
-            data = doc.to_dict()
+        for data in docs:
             food_name = data.get('food_name', 'Unknown')
             calories = data.get('calories', 0)
             total_calories += calories
@@ -182,15 +535,16 @@ async def get_coaching(user_id: str):
         }}
         """
         
-        import json
-        text_response = generate_text(prompt)
+        with span("generate_text", endpoint="coach"):
+            text_response = await run_with_deadline(generate_text(prompt), "generate_text")
         
         # Clean and parse JSON
-        text_response = text_response.replace("```json", "").replace("```", "").strip()
-        result = json.loads(text_response)
+        result = parse_json_text(text_response)
         
         return result
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error in coaching: {e}")
         # Try a simpler query if ordering fails
@@ -207,71 +561,70 @@ async def get_coaching(user_id: str):
             }
 
 @app.post("/chat/{user_id}")
+@budgeted("chat")
 async def chat_with_ai(user_id: str, request: ChatRequest):
     """
     Interactive chat with AI about nutrition and food history.
     """
-    if not db:
+    storage = get_storage()
+    if not storage:
         raise HTTPException(status_code=503, detail="Database not initialized")
         
     try:
         # 1. Fetch recent history for context
-        logs_ref = db.collection(u'food_logs')
-        try:
-            docs = logs_ref.where(u'user_id', u'==', user_id).order_by(u'timestamp', direction=firestore.Query.DESCENDING).limit(5).stream()
-            history_context = []
-            for doc in docs:
-                data = doc.to_dict()
-                food_name = data.get('food_name', 'Unknown')
-                calories = data.get('calories', 0)
-                history_context.append(f"{food_name} ({calories} kcal)")
-        except Exception as e:
-            print(f"Firestore ordered query failed (likely missing index): {e}")
-            # Fallback to simple query
-            docs = logs_ref.where(u'user_id', u'==', user_id).limit(5).stream()
-            history_context = []
-            for doc in docs:
-                data = doc.to_dict()
-                food_name = data.get('food_name', 'Unknown')
-                calories = data.get('calories', 0)
-                history_context.append(f"{food_name} ({calories} kcal)")
+        docs = await read_storage(storage.get_food_logs, user_id, limit=5, fields=("food_name", "calories"))
+        history_context = []
+        for data in docs:
+            food_name = data.get('food_name', 'Unknown')
+            calories = data.get('calories', 0)
+            history_context.append(f"{food_name} ({calories} kcal)")
             
         context_str = ", ".join(history_context) if history_context else "No meals logged yet."
 
-        # 2. Build prompt
+        # 2. Conversation memory: the last few turns verbatim plus a rolling summary of older ones
+        try:
+            summary, recent = await read_storage(load_memory, storage, user_id)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"Chat memory unavailable: {e}")
+            summary, recent = "", []
+        memory_str = format_memory(summary, recent) or "This is the start of the conversation."
+
+        # 3. Build prompt
         prompt = f"""
         You are NutriChat, an AI health assistant.
         User's recent food history: {context_str}
         
+        {memory_str}
+        
         User's question: {request.message}
         
         Provide a helpful, concise response. If they ask about their history, refer to the data provided above.
+        Use the conversation so far to understand follow-up questions.
         Be scientific but friendly.
         """
         
-        ai_response = generate_text(prompt)
+        with span("generate_text", endpoint="chat"):
+            ai_response = await run_with_deadline(generate_text(prompt), "generate_text")
         
-        # 3. Store in Firebase
+        # 4. Store in Firebase
+        messages = [(u'user', request.message), (u'assistant', ai_response)]
+        sent_at = datetime.now()
         try:
-            chat_ref = db.collection(u'chats').document()
-            chat_ref.set({
-                u'user_id': user_id,
-                u'role': u'user',
-                u'content': request.message,
-                u'timestamp': datetime.now()
-            })
-            chat_ref_ai = db.collection(u'chats').document()
-            chat_ref_ai.set({
-                u'user_id': user_id,
-                u'role': u'assistant',
-                u'content': ai_response,
-                u'timestamp': datetime.now()
-            })
+            await asyncio.to_thread(storage.add_chat_messages, user_id, messages, sent_at)
+            changes.notify(user_id, "chats")
         except Exception as e:
-            print(f"Error saving chat to Firestore: {e}")
+            print(f"Error saving chat to {storage.name}: {e}")
+            await journal_write("add_chat_messages", user_id, {"messages": messages, "timestamp": sent_at})
+
+        # 5. Fold turns that just left the verbatim window into the summary (background)
+        schedule_refresh(user_id, generate_text)
 
         return {"response": ai_response}
 
+    except (DeadlineExceeded, HTTPException):
+        raise
     except Exception as e:
         import traceback
         error_msg = traceback.format_exc()
@@ -283,11 +636,13 @@ async def chat_with_ai(user_id: str, request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
 
 @app.post("/voice_chat/{user_id}")
+@budgeted("voice_chat")
 async def voice_chat_with_ai(user_id: str, file: UploadFile = File(...)):
     """
     Handles audio recording and returns AI response.
     """
-    if not db:
+    storage = get_storage()
+    if not storage:
         raise HTTPException(status_code=503, detail="Database not initialized")
         
     try:
@@ -295,11 +650,9 @@ async def voice_chat_with_ai(user_id: str, file: UploadFile = File(...)):
         audio_bytes = await file.read()
         
         # 2. Fetch recent history for context (simplified)
-        logs_ref = db.collection(u'food_logs')
-        docs = logs_ref.where(u'user_id', u'==', user_id).limit(5).stream()
+        docs = await read_storage(storage.get_food_logs, user_id, limit=5, ordered=False, fields=("food_name",))
         history_context = []
-        for doc in docs:
-            data = doc.to_dict()
+        for data in docs:
             food_name = data.get('food_name', 'Unknown')
             history_context.append(food_name)
         
@@ -315,67 +668,82 @@ async def voice_chat_with_ai(user_id: str, file: UploadFile = File(...)):
         """
         
         # 4. Analyze Audio
-        ai_response = analyze_audio(audio_bytes, mime_type=file.content_type, prompt=prompt)
+        with span("analyze_audio", mime_type=file.content_type or ""):
+            ai_response = await run_with_deadline(analyze_audio(audio_bytes, mime_type=file.content_type, prompt=prompt), "analyze_audio")
         
         # 5. Store in Firebase
+        messages = [(u'user', u"🎤 (Voice Message)"), (u'assistant', ai_response)]
+        sent_at = datetime.now()
         try:
-            chat_ref = db.collection(u'chats').document()
-            chat_ref.set({
-                u'user_id': user_id,
-                u'role': u'user',
-                u'content': u"🎤 (Voice Message)",
-                u'timestamp': datetime.now()
-            })
-            chat_ref_ai = db.collection(u'chats').document()
-            chat_ref_ai.set({
-                u'user_id': user_id,
-                u'role': u'assistant',
-                u'content': ai_response,
-                u'timestamp': datetime.now()
-            })
+            await asyncio.to_thread(storage.add_chat_messages, user_id, messages, sent_at)
+            changes.notify(user_id, "chats")
         except Exception as e:
-            print(f"Error saving voice chat to Firestore: {e}")
+            print(f"Error saving voice chat to {storage.name}: {e}")
+            await journal_write("add_chat_messages", user_id, {"messages": messages, "timestamp": sent_at})
 
         return {"response": ai_response}
 
+    except (DeadlineExceeded, HTTPException):
+        raise
     except Exception as e:
         print(f"❌ NutriVoice Error: {e}")
         raise HTTPException(status_code=500, detail=f"Voice processing failed: {str(e)}")
 
 @app.get("/chats/{user_id}")
-async def get_chats(user_id: str):
+@budgeted("chats")
+async def get_chats(user_id: str, request: Request):
     """
     Fetches chat history for a specific user.
+    Supports If-None-Match and If-Modified-Since: an unchanged transcript is answered with 304.
     """
-    if not db:
+    storage = get_storage()
+    if not storage:
         raise HTTPException(status_code=503, detail="Database not initialized")
+    conditional = ConditionalGet(request, user_id, "chats")
+    not_modified = conditional.not_modified()
+    if not_modified is not None:
+        return not_modified
         
     try:
-        chats_ref = db.collection(u'chats')
-        # Ordering by timestamp to get correct flow
-        docs = chats_ref.where(u'user_id', u'==', user_id).order_by(u'timestamp', direction=firestore.Query.ASCENDING).stream()
+        # Ordering by timestamp to get correct flow (sorted in storage if the index is missing)
+        docs = await read_storage(storage.get_chats, user_id)
         
         history = []
-        for doc in docs:
-            chat_data = doc.to_dict()
+        for chat_data in docs:
             history.append({
                 "role": chat_data.get("role"),
                 "content": chat_data.get("content")
             })
-        return {"user_id": user_id, "history": history}
+        return conditional.respond({"user_id": user_id, "history": history})
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error fetching chats: {e}")
-        # Fallback without ordering
-        try:
-            docs = chats_ref.where(u'user_id', u'==', user_id).limit(20).stream()
-            history = []
-            for doc in docs:
-                chat_data = doc.to_dict()
-                history.append({
-                    "role": chat_data.get("role"),
-                    "content": chat_data.get("content")
-                })
-            return {"user_id": user_id, "history": history}
-        except:
-            raise HTTPException(status_code=500, detail=f"Failed to fetch chats: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch chats: {str(e)}")
+
+def require_admin(request: Request):
+    """Admin endpoints need ADMIN_TOKEN set on the server and sent as X-Admin-Token."""
+    expected = os.getenv("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN not set)")
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), expected):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
 
+@app.get("/admin/usage")
+async def get_usage(request: Request, group_by: str = "endpoint", limit: int = 50, days: int = 30):
+    """
+    Token usage and estimated cost over the last `days` days across all workers (the
+    stored rows plus what this worker has not flushed yet), grouped by user, endpoint,
+    model or row (all three). Sorted by cost, highest first.
+    """
+    require_admin(request)
+    if group_by not in usage.GROUPS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(usage.GROUPS)}")
+    if days < 1:
+        raise HTTPException(status_code=400, detail="days must be at least 1")
+    storage = get_storage()
+    if not storage:
+        raise HTTPException(status_code=503, detail="Database not initialized")
+    since = datetime.now() - timedelta(days=days)
+    rows = await read_storage(storage.get_usage, since)
+    return usage.report(rows + usage.ledger.pending_rows(), since, group_by, limit)
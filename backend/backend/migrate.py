@@ -0,0 +1,222 @@
+"""
+Copies food logs and chats from the global `food_logs` and `chats` collections into the
+per-user layout (users/{uid}/food_logs, users/{uid}/chats) that FirestoreStorage reads
+with FIRESTORE_LAYOUT=per_user, and on request chats into the transcript chunks
+(users/{uid}/chat_chunks) read with CHAT_STORAGE=chunked. Once chats live in the per-user
+layout, --layout per_user (the default under FIRESTORE_LAYOUT=per_user) chunks them from
+users/{uid}/chats instead; food_logs and chats are always copied from the global collections.
+
+    python -m backend.migrate                        # copy everything, resuming from .migration_state.json
+    python -m backend.migrate --dry-run              # count what would be copied, write nothing
+    python -m backend.migrate --collections chats --batch-size 200
+    python -m backend.migrate --collections chat_chunks --chunk-size 100
+    python -m backend.migrate --collections chat_chunks --layout per_user
+    python -m backend.migrate --restart              # ignore the saved cursor and copy from the start
+
+Documents are streamed in pages ordered by (timestamp, document id), so only one page is
+held in memory. Each page is written in one batch commit under the documents' original
+ids, so copying a page twice overwrites the same documents. chat_chunks appends one batch
+per user and stores each source document id in its turn; turns whose id is already in the
+user's chunks are skipped, so re-copying adds nothing there either. The cursor (one per user
+when reading the per-user layout) is saved after every commit: an interrupted run continues
+with the next page, and a later run copies only what was written since (new documents sort
+after the cursor). Source documents are left in place.
+
+Cut-over: run the migration, deploy with FIRESTORE_LAYOUT=per_user, then run it again
+to copy the writes the old layout took in between. Journal replays keep their original
+timestamps, so if one may have landed behind the cursor, run once more with --restart.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict
+from datetime import datetime
+
+COLLECTIONS = ("food_logs", "chats")
+# Migration target -> collection it is read from (global, or under users/{uid} with layout per_user)
+SOURCES = {"food_logs": "food_logs", "chats": "chats", "chat_chunks": "chats"}
+# Targets read from users/{uid}/<source> when the layout is per_user
+PER_USER_SOURCES = ("chat_chunks",)
+DEFAULT_STATE = ".migration_state.json"
+# Firestore allows at most 500 writes per batch
+MAX_BATCH = 500
+# Users whose migrated turn ids are kept between pages (chat_chunks)
+SEEN_USERS = 1000
+
+
+def load_state(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    if not path:
+        return
+    # Written aside and renamed, so a crash never leaves a half-written cursor
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _write_page(db, name, docs, chunker=None, seen=None):
+    """
+    Writes [(doc_id, data)] (all with a user_id) to the per-user target `name`. For
+    chat_chunks, `seen` (user_id -> ids already in their chunks) is filled as users come up.
+    Returns how many documents were written.
+    """
+    if name == "chat_chunks":
+        seen = OrderedDict() if seen is None else seen
+        by_user = {}
+        for doc_id, data in docs:
+            by_user.setdefault(data[u'user_id'], []).append(
+                {u'id': doc_id, u'role': data.get(u'role'), u'content': data.get(u'content'), u'timestamp': data[u'timestamp']})
+        written = 0
+        for user_id, turns in by_user.items():
+            if user_id not in seen:
+                seen[user_id] = chunker.chat_turn_ids(user_id)
+                while len(seen) > SEEN_USERS:
+                    seen.popitem(last=False)
+            seen.move_to_end(user_id)
+            ids = seen[user_id]
+            turns = [turn for turn in turns if turn[u'id'] not in ids]
+            if turns:
+                chunker.append_chat_turns(user_id, turns)
+                ids.update(turn[u'id'] for turn in turns)
+                written += len(turns)
+        return written
+    batch = db.batch()
+    for doc_id, data in docs:
+        batch.set(db.collection(u'users').document(data[u'user_id']).collection(name).document(doc_id), data)
+    batch.commit()
+    return len(docs)
+
+
+def _pages(collection, saved, batch_size):
+    """Yields pages [(doc_id, data)] of `collection` in (timestamp, document id) order after the saved cursor."""
+    cursor = {u'timestamp': datetime.fromisoformat(saved["timestamp"]), u'__name__': saved["id"]} if saved else None
+    while True:
+        query = collection.order_by(u'timestamp').order_by(u'__name__').limit(batch_size)
+        if cursor:
+            query = query.start_after(cursor)
+        page = [(snapshot.id, snapshot.to_dict()) for snapshot in query.stream()]
+        if not page:
+            return
+        yield page
+        last_id, last = page[-1]
+        cursor = {u'timestamp': last[u'timestamp'], u'__name__': last_id}
+        if len(page) < batch_size:
+            return
+
+
+def migrate_collection(db, name, state, batch_size=400, dry_run=False, on_page=None, chunker=None, layout="global"):
+    """
+    Copies target `name` (see SOURCES) page by page from where state[name]["cursor"] left
+    off and updates state[name] ({"copied", "skipped", "cursor"}) after each page. With
+    layout per_user the source is every users/{uid}/<source>, each with its own cursor in
+    state[name]["cursors"]. Documents without a user_id can't be placed and are skipped (and
+    counted); for chat_chunks, so are turns already chunked. chat_chunks needs `chunker`, a
+    FirestoreStorage in chunked chat mode.
+    """
+    progress = state.setdefault(name, {"copied": 0, "skipped": 0, "cursor": None})
+    seen = OrderedDict()
+
+    def copy(pages, user_id=None):
+        for page in pages:
+            # Per-user documents carry user_id too; the path settles it if one doesn't
+            docs = [(doc_id, dict(data, user_id=data.get(u'user_id') or user_id)) for doc_id, data in page]
+            docs = [(doc_id, data) for doc_id, data in docs if data[u'user_id']]
+            written = len(docs)
+            if docs and not dry_run:
+                written = _write_page(db, name, docs, chunker, seen)
+            progress["copied"] += written
+            progress["skipped"] += len(page) - written
+            last_id, last = page[-1]
+            progress["cursor"] = {"timestamp": last[u'timestamp'].isoformat(), "id": last_id}
+            if user_id:
+                progress["cursors"][user_id] = progress["cursor"]
+            if on_page:
+                on_page(name, progress)
+
+    if layout == "per_user":
+        progress.setdefault("cursors", {})
+        for user_ref in db.collection(u'users').list_documents():
+            copy(_pages(user_ref.collection(SOURCES[name]), progress["cursors"].get(user_ref.id), batch_size), user_ref.id)
+    else:
+        copy(_pages(db.collection(SOURCES[name]), progress["cursor"], batch_size))
+    return progress
+
+
+def migrate(db, collections=COLLECTIONS, batch_size=400, state_path=None, restart=False, dry_run=False, verbose=True,
+            chunk_size=100, layout="global"):
+    """
+    Migrates each target in turn; returns the final state. Dry runs never save it. `layout`
+    is where PER_USER_SOURCES targets are read from; the others always read the global layout.
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH))
+    chunker = None
+    if "chat_chunks" in collections:
+        from backend.storage import FirestoreStorage
+        chunker = FirestoreStorage(db, chat_storage="chunked", chat_chunk_size=chunk_size)
+    state = {} if restart else load_state(state_path)
+    if dry_run:
+        # Count from the saved cursor on, not on top of what earlier runs copied
+        for progress in state.values():
+            progress["copied"] = progress["skipped"] = 0
+
+    def on_page(name, progress):
+        if not dry_run:
+            save_state(state_path, state)
+        if verbose:
+            print(f"📦 {name}: {progress['copied']} copied, {progress['skipped']} skipped "
+                  f"(up to {progress['cursor']['timestamp']})")
+
+    for name in collections:
+        migrate_collection(db, name, state, batch_size, dry_run, on_page, chunker,
+                           layout if name in PER_USER_SOURCES else "global")
+    return state
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Copy food logs and chats into the per-user Firestore layout")
+    p.add_argument("--collections", default=",".join(COLLECTIONS),
+                   help=f"comma-separated subset of {','.join(SOURCES)}")
+    p.add_argument("--batch-size", type=int, default=400, help=f"documents per page and batch commit (max {MAX_BATCH})")
+    p.add_argument("--state", default=DEFAULT_STATE, help="file the resume cursor is kept in")
+    p.add_argument("--restart", action="store_true", help="ignore the saved cursor and start from the beginning")
+    p.add_argument("--dry-run", action="store_true", help="read and count, but write nothing")
+    p.add_argument("--chunk-size", type=int, default=int(os.getenv("CHAT_CHUNK_SIZE", "100")),
+                   help="turns per transcript chunk for chat_chunks (default: CHAT_CHUNK_SIZE or 100)")
+    p.add_argument("--layout", choices=("global", "per_user"), default=os.getenv("FIRESTORE_LAYOUT", "global").lower(),
+                   help="where chat_chunks reads chats from (default: FIRESTORE_LAYOUT or global)")
+    args = p.parse_args(argv)
+
+    collections = [c.strip() for c in args.collections.split(",") if c.strip()]
+    unknown = [c for c in collections if c not in SOURCES]
+    if unknown:
+        p.error(f"unknown collections: {', '.join(unknown)}")
+
+    from backend.firebase_utils import get_db
+    db = get_db()
+    if db is None:
+        print("❌ Firestore is not configured (see FIREBASE_CREDENTIALS_PATH)")
+        return 1
+
+    try:
+        state = migrate(db, collections, args.batch_size, args.state, args.restart, args.dry_run,
+                        chunk_size=args.chunk_size, layout=args.layout)
+    except Exception as e:
+        print(f"❌ Migration stopped: {e}. Run again to resume from the last saved page.")
+        return 1
+    for name in collections:
+        progress = state.get(name, {})
+        print(f"✅ {name}: {progress.get('copied', 0)} {'to copy' if args.dry_run else 'copied'}, "
+              f"{progress.get('skipped', 0)} skipped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
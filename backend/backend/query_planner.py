@@ -0,0 +1,80 @@
+"""
+Remembers which Firestore query shapes fail for lack of a composite index.
+
+The global layout filters every collection by user_id, so ordered and ranged queries
+need composite indexes a fresh project may not have. FirestoreStorage runs those
+queries through QueryPlanner.run(shape, indexed, fallback): the first missing-index
+error for a shape is logged (it carries the link to create the index) and from then on
+requests go straight to the fallback, which reads the user's documents unordered and
+sorts them in memory. Every REPROBE_SECONDS one request tries the indexed query again,
+so a newly built index is picked up without a restart.
+"""
+import heapq
+import os
+import threading
+import time
+from datetime import datetime
+
+REPROBE_SECONDS = float(os.getenv("INDEX_REPROBE_SECONDS", "600"))
+
+
+def is_missing_index(exc):
+    # FailedPrecondition: "400 The query requires an index. You can create it here: ..."
+    return "requires an index" in str(exc)
+
+
+def newest(docs, limit, key="timestamp"):
+    """The `limit` documents with the latest `key`, newest first; holds at most `limit` at a time."""
+    # Documents without the field sort last instead of failing the comparison
+    return heapq.nlargest(limit, docs, key=lambda doc: (doc.get(key) is not None, doc.get(key)))
+
+
+class QueryPlanner:
+    def __init__(self, reprobe_seconds=REPROBE_SECONDS):
+        self.reprobe_seconds = reprobe_seconds
+        self._missing = {}  # shape -> {"since", "probe_at", "fallbacks"}
+        self._lock = threading.Lock()
+
+    def _should_probe(self, shape):
+        with self._lock:
+            entry = self._missing.get(shape)
+            if entry is None:
+                return True
+            if time.monotonic() >= entry["probe_at"]:
+                # Claimed by this request; the others keep using the fallback meanwhile
+                entry["probe_at"] = time.monotonic() + self.reprobe_seconds
+                return True
+            entry["fallbacks"] += 1
+            return False
+
+    def run(self, shape, indexed, fallback):
+        """indexed() unless `shape` is known to lack its index; fallback() if it does."""
+        if self._should_probe(shape):
+            try:
+                result = indexed()
+            except Exception as e:
+                if not is_missing_index(e):
+                    raise
+                with self._lock:
+                    entry = self._missing.setdefault(shape, {"since": datetime.now(), "fallbacks": 0})
+                    entry["probe_at"] = time.monotonic() + self.reprobe_seconds
+                    entry["fallbacks"] += 1
+                print(f"⚠️ Missing index for {shape}; answering it in memory until the index exists "
+                      f"(re-checked every {self.reprobe_seconds:g}s): {e}")
+            else:
+                with self._lock:
+                    recovered = self._missing.pop(shape, None)
+                if recovered:
+                    print(f"✅ Index for {shape} is available; querying it directly again")
+                return result
+        return fallback()
+
+    def missing(self):
+        """[{"query", "since", "fallbacks", "next_probe_in_s"}] for /health."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {"query": shape, "since": entry["since"].isoformat(), "fallbacks": entry["fallbacks"],
+                 "next_probe_in_s": round(max(0.0, entry["probe_at"] - now), 1)}
+                for shape, entry in self._missing.items()
+            ]
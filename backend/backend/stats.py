@@ -0,0 +1,153 @@
+"""
+Nutrition statistics for /stats/{user_id}.
+
+Meals in the requested date range are read once as plain rows and aggregated
+with numpy: each meal gets a bucket index (day or week) and the per-bucket sums
+are single bincount calls, so cost grows with the number of meals, not with
+the number of buckets times meals. Results are returned as parallel arrays
+that chart libraries take as-is, and cached per user and range for
+STATS_CACHE_TTL seconds (default 60); a new meal for the user (backend.changes) drops their entries.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+from backend import changes
+
+GRANULARITIES = ("day", "week")
+DEFAULT_DAYS = 30
+MAX_DAYS = 366
+TOP_FOODS = 5
+MACROS = ("calories", "protein_g", "carbs_g", "fats_g")
+
+CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = 1024
+
+_cache = OrderedDict()  # (user_id, start, end, granularity) -> (expires_at, result)
+_cache_lock = threading.Lock()
+
+
+def parse_range(from_date=None, to_date=None, granularity="day"):
+    """
+    Validates the query parameters. Dates are YYYY-MM-DD and both ends are inclusive;
+    the default is the last DEFAULT_DAYS days. Raises ValueError with a message for the client.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    try:
+        end = date.fromisoformat(to_date) if to_date else date.today()
+        start = date.fromisoformat(from_date) if from_date else end - timedelta(days=DEFAULT_DAYS - 1)
+    except ValueError:
+        raise ValueError("from and to must be dates in YYYY-MM-DD format") from None
+    if start > end:
+        raise ValueError("from must not be after to")
+    if (end - start).days + 1 > MAX_DAYS:
+        raise ValueError(f"The range can span at most {MAX_DAYS} days")
+    return start, end, granularity
+
+
+def _bucket_starts(start, end, granularity):
+    import numpy as np
+    if granularity == "week":
+        # ISO weeks: buckets start on Monday, the first one may begin before `start`
+        first = np.datetime64(start - timedelta(days=start.weekday()), "D")
+        return first, np.arange(first, np.datetime64(end, "D") + 1, 7)
+    first = np.datetime64(start, "D")
+    return first, np.arange(first, np.datetime64(end, "D") + 1)
+
+
+def compute_stats(rows, start, end, granularity):
+    """Aggregates storage.get_food_log_range() rows into series, totals and top foods."""
+    # Imported on first use so it stays out of worker start-up
+    import numpy as np
+    first, periods = _bucket_starts(start, end, granularity)
+    step = 7 if granularity == "week" else 1
+    n_buckets = len(periods)
+
+    if rows:
+        days = np.array([r[0] for r in rows], dtype="datetime64[us]").astype("datetime64[D]")
+        bucket = (days - first).astype(np.int64) // step
+        # Missing values (None) become nan and then 0
+        values = np.nan_to_num(np.array([r[2:6] for r in rows], dtype=float))
+        names = np.array([r[1] or "Unknown" for r in rows], dtype=object)
+        # Storage already filters by range; this keeps stray rows out of bincount
+        inside = (bucket >= 0) & (bucket < n_buckets)
+        bucket, values, names = bucket[inside], values[inside], names[inside]
+    else:
+        bucket = np.zeros(0, dtype=np.int64)
+        values = np.zeros((0, len(MACROS)))
+        names = np.zeros(0, dtype=object)
+
+    series = {"period": [str(p) for p in periods], "meals": np.bincount(bucket, minlength=n_buckets).tolist()}
+    for i, macro in enumerate(MACROS):
+        sums = np.bincount(bucket, weights=values[:, i], minlength=n_buckets)
+        series[macro] = np.round(sums, 0 if macro == "calories" else 1).tolist()
+
+    sums = values.sum(axis=0)
+    meals = len(bucket)
+    totals = {"meals": meals}
+    totals.update({macro: round(float(sums[i]), 1) for i, macro in enumerate(MACROS)})
+    totals["avg_calories_per_meal"] = round(float(sums[0]) / meals) if meals else 0
+
+    top = {"food_name": [], "count": [], "calories": []}
+    if meals:
+        foods, inverse, counts = np.unique(names.astype(str), return_inverse=True, return_counts=True)
+        food_calories = np.bincount(inverse, weights=values[:, 0])
+        # Most logged first, ties broken by calories contributed
+        order = np.lexsort((-food_calories, -counts))[:TOP_FOODS]
+        top = {
+            "food_name": foods[order].tolist(),
+            "count": counts[order].tolist(),
+            "calories": np.round(food_calories[order]).tolist(),
+        }
+
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "granularity": granularity,
+        "series": series,
+        "totals": totals,
+        "top_foods": top,
+    }
+
+
+def load_stats(storage, user_id, start, end, granularity):
+    """Cached compute_stats() for a user and range; reads storage on a miss."""
+    key = (user_id, start, end, granularity)
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and hit[0] > now:
+            _cache.move_to_end(key)
+            return hit[1]
+
+    range_start = datetime.combine(start, datetime.min.time())
+    range_end = datetime.combine(end + timedelta(days=1), datetime.min.time())
+    # Without the (user_id, timestamp) index storage applies the range itself (backend.query_planner)
+    rows = storage.get_food_log_range(user_id, range_start, range_end)
+    result = compute_stats(rows, start, end, granularity)
+
+    if CACHE_TTL > 0:
+        with _cache_lock:
+            _cache[key] = (now + CACHE_TTL, result)
+            _cache.move_to_end(key)
+            while len(_cache) > CACHE_MAX_ENTRIES:
+                _cache.popitem(last=False)
+    return result
+
+
+def invalidate_stats(user_id):
+    """Drops a user's cached stats."""
+    with _cache_lock:
+        for key in [k for k in _cache if k[0] == user_id]:
+            del _cache[key]
+
+
+def _on_write(user_id, kind):
+    if kind == "food_logs":
+        invalidate_stats(user_id)
+
+
+changes.subscribe(_on_write)
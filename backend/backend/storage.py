@@ -0,0 +1,608 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+
+from ai_core.config import subscribe, CREDENTIALS_FILE
+from ai_core.deadline import attempt_timeout
+from backend.tracing import span
+from backend.query_planner import QueryPlanner, newest
+
+# FirestoreStorage layouts (FIRESTORE_LAYOUT): top-level collections or users/{uid}/<collection>
+LAYOUTS = ("global", "per_user")
+
+# FirestoreStorage chat modes (CHAT_STORAGE): a document per message, or transcript chunks
+CHAT_STORAGES = ("messages", "chunked")
+
+# Fields a food log projection may ask for: top-level names or "nutrition.<key>"
+FOOD_LOG_FIELDS = ("user_id", "food_name", "calories", "timestamp", "nutrition")
+
+_storage = None
+_storage_ready = False
+_storage_injected = False
+_storage_lock = threading.Lock()
+
+
+class Storage(ABC):
+    """
+    Data layer used by backend.main. Food logs come back newest first,
+    chat messages oldest first; timestamps are datetime objects.
+    Every operation is bounded by the request deadline (ai_core.deadline), if one is set.
+    A backend must implement every abstract method; one that misses any can't be created.
+    """
+    name = "base"
+
+    @abstractmethod
+    def add_food_log(self, user_id, nutrition, timestamp=None):
+        """Stores one analyzed meal (a NutritionInfo dict) at `timestamp`, or now."""
+
+    @abstractmethod
+    def get_food_logs(self, user_id, limit=10, ordered=True, fields=None):
+        """With fields (see FOOD_LOG_FIELDS), each document holds only those; Firestore reads only those."""
+
+    @abstractmethod
+    def get_food_log_range(self, user_id, start, end, ranged=True):
+        """
+        Meals logged in [start, end) as (timestamp, food_name, calories, protein_g, carbs_g, fats_g)
+        tuples, in no particular order. With ranged=False the range is applied after reading all
+        of the user's logs (what Firestore does by itself while the composite index is missing).
+        """
+
+    @abstractmethod
+    def add_chat_messages(self, user_id, messages, timestamp=None):
+        """
+        Stores [(role, content), ...] for a user in one write where the backend allows it.
+        A given timestamp (journal replay) is used for the first message; later ones are
+        offset by a microsecond each so the conversation order is kept.
+        """
+
+    @abstractmethod
+    def get_chats(self, user_id, limit=None, ordered=True):
+        """With a limit (and ordering), returns the most recent `limit` messages, still oldest first."""
+
+    def missing_indexes(self):
+        """Queries currently answered without their index (see backend.query_planner)."""
+        return []
+
+    @abstractmethod
+    def get_chat_summary(self, user_id):
+        """The user's rolling conversation summary: {"summary", "covered_until", "messages"} or None."""
+
+    @abstractmethod
+    def set_chat_summary(self, user_id, record):
+        """Replaces the user's conversation summary (see get_chat_summary)."""
+
+    @abstractmethod
+    def add_usage(self, rows):
+        """Appends token usage deltas (see ai_core.usage), one row per user/endpoint/model per flush."""
+
+    @abstractmethod
+    def get_usage(self, since):
+        """Stored usage rows whose window ended at or after `since`, from every worker (not merged)."""
+
+    def warm_up(self):
+        """Opens connections ahead of traffic."""
+
+
+class FirestoreStorage(Storage):
+    """
+    layout="global" keeps food logs and chats in the top-level `food_logs` and `chats`
+    collections, filtered by user_id, so ordered and ranged queries need composite indexes.
+    layout="per_user" keeps them under users/{uid}/food_logs and users/{uid}/chats, where
+    the same queries use single-field indexes only (backend.migrate copies existing data).
+    Documents carry user_id in both layouts. Summaries and usage stay top-level.
+
+    chat_storage="chunked" appends chat turns to users/{uid}/chat_chunks/{seq} documents of
+    about chat_chunk_size turns each instead of writing a document per message, so loading
+    a conversation reads one document per chunk and a tail read only the last chunk or two.
+    """
+    name = "firestore"
+
+    def __init__(self, db, layout="global", chat_storage="messages", chat_chunk_size=100):
+        from firebase_admin import firestore
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown Firestore layout {layout!r}; expected one of {', '.join(LAYOUTS)}")
+        if chat_storage not in CHAT_STORAGES:
+            raise ValueError(f"Unknown chat storage {chat_storage!r}; expected one of {', '.join(CHAT_STORAGES)}")
+        self.db = db
+        self.layout = layout
+        self.chat_storage = chat_storage
+        self.chat_chunk_size = max(1, chat_chunk_size)
+        self._query = firestore.Query
+        self._array_union = firestore.ArrayUnion
+        self.planner = QueryPlanner()
+
+    def _user_collection(self, user_id, name):
+        if self.layout == "per_user":
+            return self.db.collection(u'users').document(user_id).collection(name)
+        return self.db.collection(name)
+
+    def _user_query(self, user_id, name):
+        """All of the user's documents in collection `name`."""
+        collection = self._user_collection(user_id, name)
+        return collection if self.layout == "per_user" else collection.where(u'user_id', u'==', user_id)
+
+    def add_food_log(self, user_id, nutrition, timestamp=None):
+        with span("firestore.food_logs.set"):
+            doc_ref = self._user_collection(user_id, u'food_logs').document()
+            doc_ref.set({
+                u'user_id': user_id,
+                u'food_name': nutrition["food_name"],
+                u'calories': nutrition["calories"],
+                u'timestamp': timestamp or datetime.now(),
+                u'nutrition': nutrition
+            }, timeout=attempt_timeout("firestore.food_logs.set"))
+
+    def missing_indexes(self):
+        return self.planner.missing()
+
+    def get_food_logs(self, user_id, limit=10, ordered=True, fields=None):
+        query = self._user_query(user_id, u'food_logs')
+
+        def indexed():
+            q = query.order_by(u'timestamp', direction=self._query.DESCENDING) if ordered else query
+            if fields:
+                q = q.select(list(fields))
+            with span("firestore.food_logs.query", ordered=ordered):
+                stream = q.limit(limit).stream(timeout=attempt_timeout("firestore.food_logs.query"))
+                return [doc.to_dict() for doc in stream]
+
+        def in_memory():
+            # All of the user's logs, the newest `limit` kept in a bounded heap; sorting needs the timestamp
+            q = query.select(list(dict.fromkeys([*fields, u'timestamp']))) if fields else query
+            with span("firestore.food_logs.scan"):
+                stream = q.stream(timeout=attempt_timeout("firestore.food_logs.scan"))
+                docs = newest((doc.to_dict() for doc in stream), limit)
+            if fields and u'timestamp' not in fields:
+                for doc in docs:
+                    doc.pop(u'timestamp', None)
+            return docs
+
+        if not ordered:
+            return indexed()
+        return self.planner.run("food_logs: user_id ==, order by timestamp desc", indexed, in_memory)
+
+    def get_food_log_range(self, user_id, start, end, ranged=True):
+        query = self._user_query(user_id, u'food_logs')
+
+        def scan(ranged):
+            q = query.where(u'timestamp', u'>=', start).where(u'timestamp', u'<', end) if ranged else query
+            with span("firestore.food_logs.range", ranged=ranged):
+                return [doc.to_dict() for doc in q.stream(timeout=attempt_timeout("firestore.food_logs.range"))]
+
+        if ranged:
+            docs = self.planner.run("food_logs: user_id ==, timestamp range", lambda: scan(True), lambda: scan(False))
+        else:
+            docs = scan(False)
+        rows = []
+        for doc in docs:
+            # Naive datetimes are stored as-is and come back tagged UTC; drop the tag to compare with local dates
+            ts = doc.get(u'timestamp')
+            ts = ts.replace(tzinfo=None) if ts else None
+            if ts is None or not start <= ts < end:
+                continue
+            nutrition = doc.get(u'nutrition') or {}
+            rows.append((ts, doc.get(u'food_name'), doc.get(u'calories'),
+                         nutrition.get('protein_g'), nutrition.get('carbs_g'), nutrition.get('fats_g')))
+        return rows
+
+    def add_chat_messages(self, user_id, messages, timestamp=None):
+        if self.chat_storage == "chunked":
+            # Ids come from the send time, so a journal replay of a write that did land repeats them
+            sent_at = timestamp or datetime.now()
+            return self.append_chat_turns(user_id, [
+                {u'id': f"{sent_at.isoformat()}#{i}", u'role': role, u'content': content,
+                 u'timestamp': sent_at + timedelta(microseconds=i)}
+                for i, (role, content) in enumerate(messages)
+            ])
+        with span("firestore.chats.set", count=len(messages)):
+            batch = self.db.batch()
+            for i, (role, content) in enumerate(messages):
+                batch.set(self._user_collection(user_id, u'chats').document(), {
+                    u'user_id': user_id,
+                    u'role': role,
+                    u'content': content,
+                    u'timestamp': timestamp + timedelta(microseconds=i) if timestamp else datetime.now()
+                })
+            batch.commit(timeout=attempt_timeout("firestore.chats.set"))
+
+    def get_chats(self, user_id, limit=None, ordered=True):
+        if self.chat_storage == "chunked":
+            # Chunks are ordered by seq alone (no composite index), so `ordered` changes nothing
+            return self._get_chat_chunks(user_id, limit)
+        query = self._user_query(user_id, u'chats')
+        # The tail is read newest first and flipped, so a limit keeps the latest messages
+        tail = bool(ordered and limit)
+
+        def indexed():
+            q = query
+            if ordered:
+                q = q.order_by(u'timestamp', direction=self._query.DESCENDING if tail else self._query.ASCENDING)
+            if limit:
+                q = q.limit(limit)
+            with span("firestore.chats.query", ordered=ordered):
+                docs = [doc.to_dict() for doc in q.stream(timeout=attempt_timeout("firestore.chats.query"))]
+            return docs[::-1] if tail else docs
+
+        def in_memory():
+            with span("firestore.chats.scan"):
+                stream = (doc.to_dict() for doc in query.stream(timeout=attempt_timeout("firestore.chats.scan")))
+                if tail:
+                    return newest(stream, limit)[::-1]
+                return sorted(stream, key=lambda doc: (doc.get(u'timestamp') is not None, doc.get(u'timestamp')))
+
+        if not ordered:
+            return indexed()
+        direction = "desc" if tail else "asc"
+        return self.planner.run(f"chats: user_id ==, order by timestamp {direction}", indexed, in_memory)
+
+    def _chat_chunks(self, user_id):
+        return self.db.collection(u'users').document(user_id).collection(u'chat_chunks')
+
+    def append_chat_turns(self, user_id, turns):
+        """
+        Appends [{"id", "role", "content", "timestamp"}, ...] to the user's last chunk, starting
+        new chunks as it fills (one read for the tail, one batch commit). Chunks are written with
+        merge + ArrayUnion, so appends that race on the same chunk both land (it just grows
+        past chat_chunk_size); a turn appended twice (same id) is dropped when reading.
+        """
+        chunks = self._chat_chunks(user_id)
+        with span("firestore.chat_chunks.tail"):
+            tail = [doc.to_dict() for doc in chunks.order_by(u'seq', direction=self._query.DESCENDING).limit(1)
+                    .stream(timeout=attempt_timeout("firestore.chat_chunks.tail"))]
+        seq, used = (tail[0][u'seq'], len(tail[0].get(u'turns') or [])) if tail else (0, 0)
+
+        with span("firestore.chat_chunks.set", count=len(turns)):
+            batch = self.db.batch()
+            while turns:
+                if used >= self.chat_chunk_size:
+                    seq, used = seq + 1, 0
+                part, turns = turns[:self.chat_chunk_size - used], turns[self.chat_chunk_size - used:]
+                batch.set(chunks.document(f"{seq:06d}"), {
+                    u'user_id': user_id,
+                    u'seq': seq,
+                    u'turns': self._array_union(part),
+                    u'updated_at': datetime.now(),
+                }, merge=True)
+                used += len(part)
+            batch.commit(timeout=attempt_timeout("firestore.chat_chunks.set"))
+
+    def _get_chat_chunks(self, user_id, limit=None):
+        chunks = self._chat_chunks(user_id)
+        if limit:
+            # Only the tail chunk can be short, so this many newest chunks always hold `limit` turns
+            count = -(-(limit - 1) // self.chat_chunk_size) + 1
+            query = chunks.order_by(u'seq', direction=self._query.DESCENDING).limit(count)
+        else:
+            query = chunks.order_by(u'seq')
+        with span("firestore.chat_chunks.query", limit=limit):
+            docs = [doc.to_dict() for doc in query.stream(timeout=attempt_timeout("firestore.chat_chunks.query"))]
+        # Keyed by turn id: a retried append (journal replay) can repeat turns in the next chunk.
+        # Turns written before ids were stored fall back to their whole content.
+        unique = {}
+        for doc in docs:
+            for turn in doc.get(u'turns') or []:
+                unique.setdefault(turn.get(u'id') or (turn[u'timestamp'], turn[u'role'], turn[u'content']), turn)
+        # Racing appends may interleave within a chunk; timestamps restore the conversation order
+        turns = sorted(unique.values(), key=lambda turn: turn[u'timestamp'])
+        turns = [dict(turn, user_id=user_id) for turn in (turns[-limit:] if limit else turns)]
+        return turns
+
+    def chat_turn_ids(self, user_id):
+        """Ids of every turn in the user's chunks (reads them all; for the migration)."""
+        with span("firestore.chat_chunks.ids"):
+            docs = self._chat_chunks(user_id).stream(timeout=attempt_timeout("firestore.chat_chunks.ids"))
+            return {turn[u'id'] for doc in docs for turn in doc.to_dict().get(u'turns') or [] if turn.get(u'id')}
+
+    def get_chat_summary(self, user_id):
+        with span("firestore.chat_summaries.get"):
+            snapshot = self.db.collection(u'chat_summaries').document(user_id).get(
+                timeout=attempt_timeout("firestore.chat_summaries.get"))
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def set_chat_summary(self, user_id, record):
+        with span("firestore.chat_summaries.set"):
+            self.db.collection(u'chat_summaries').document(user_id).set(
+                dict(record, user_id=user_id, updated_at=datetime.now()),
+                timeout=attempt_timeout("firestore.chat_summaries.set"))
+
+    def add_usage(self, rows):
+        with span("firestore.usage.set", count=len(rows)):
+            batch = self.db.batch()
+            for row in rows:
+                batch.set(self.db.collection(u'usage').document(), dict(row))
+            batch.commit(timeout=attempt_timeout("firestore.usage.set"))
+
+    def get_usage(self, since):
+        with span("firestore.usage.query"):
+            # A single-field range: served by Firestore's automatic index
+            query = self.db.collection(u'usage').where(u'window_end', u'>=', since)
+            return [doc.to_dict() for doc in query.stream(timeout=attempt_timeout("firestore.usage.query"))]
+
+    def warm_up(self):
+        # A one-document read sets up the gRPC channel and auth token
+        list(self.db.collection(u'food_logs').limit(1).stream())
+
+
+class SQLiteStorage(Storage):
+    """
+    Embedded storage for dev/edge deployments and benchmarks.
+    WAL mode lets readers run alongside the writer; the (user_id, timestamp)
+    indexes serve every history/chat query without a table scan.
+    """
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS food_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        food_name TEXT,
+        calories INTEGER,
+        timestamp TEXT NOT NULL,
+        nutrition TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_food_logs_user_ts ON food_logs (user_id, timestamp);
+    CREATE TABLE IF NOT EXISTS chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT,
+        timestamp TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_chats_user_ts ON chats (user_id, timestamp);
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        user_id TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        covered_until TEXT,
+        messages INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        endpoint TEXT NOT NULL,
+        model TEXT NOT NULL,
+        provider TEXT,
+        calls INTEGER NOT NULL,
+        input_tokens INTEGER NOT NULL,
+        output_tokens INTEGER NOT NULL,
+        cost_usd REAL NOT NULL,
+        window_start TEXT NOT NULL,
+        window_end TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_usage_user_window ON usage (user_id, window_end);
+    CREATE INDEX IF NOT EXISTS idx_usage_window ON usage (window_end);
+    """
+
+    # Statements are constant strings so sqlite3's per-connection statement cache
+    # prepares each one once and reuses it.
+    INSERT_FOOD_LOG = "INSERT INTO food_logs (user_id, food_name, calories, timestamp, nutrition) VALUES (?, ?, ?, ?, ?)"
+    SELECT_FOOD_LOGS = (
+        "SELECT user_id, food_name, calories, timestamp, nutrition FROM food_logs "
+        "WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?"
+    )
+    # Macros are pulled out of the JSON column in SQL so Python never parses it
+    SELECT_FOOD_LOG_RANGE = (
+        "SELECT timestamp, food_name, calories, json_extract(nutrition, '$.protein_g'), "
+        "json_extract(nutrition, '$.carbs_g'), json_extract(nutrition, '$.fats_g') FROM food_logs "
+        "WHERE user_id = ? AND timestamp >= ? AND timestamp < ?"
+    )
+    INSERT_CHAT = "INSERT INTO chats (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)"
+    SELECT_CHATS = "SELECT user_id, role, content, timestamp FROM chats WHERE user_id = ? ORDER BY timestamp, id"
+    SELECT_CHATS_TAIL = (
+        "SELECT user_id, role, content, timestamp FROM "
+        "(SELECT id, user_id, role, content, timestamp FROM chats WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?) "
+        "ORDER BY timestamp, id"
+    )
+    INSERT_USAGE = (
+        "INSERT INTO usage (user_id, endpoint, model, provider, calls, input_tokens, output_tokens, cost_usd, window_start, window_end) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    # Rows are summed per user/endpoint/model here; the report only regroups them
+    SELECT_USAGE = (
+        "SELECT user_id, endpoint, model, MAX(provider), SUM(calls), SUM(input_tokens), SUM(output_tokens), SUM(cost_usd) "
+        "FROM usage WHERE window_end >= ? GROUP BY user_id, endpoint, model"
+    )
+    SELECT_CHAT_SUMMARY = "SELECT summary, covered_until, messages FROM chat_summaries WHERE user_id = ?"
+    UPSERT_CHAT_SUMMARY = (
+        "INSERT INTO chat_summaries (user_id, summary, covered_until, messages, updated_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET summary = excluded.summary, covered_until = excluded.covered_until, "
+        "messages = excluded.messages, updated_at = excluded.updated_at"
+    )
+
+    def __init__(self, path="nutrisnap.db"):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+        print(f"✅ SQLite storage ready at {path}")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def warm_up(self):
+        self._connect().execute("SELECT 1 FROM food_logs LIMIT 1").fetchone()
+
+    def add_food_log(self, user_id, nutrition, timestamp=None):
+        # Local and fast: the deadline is only checked, never needed as a timeout
+        attempt_timeout("sqlite.food_logs.insert")
+        timestamp = timestamp or datetime.now()
+        with span("sqlite.food_logs.insert"):
+            conn = self._connect()
+            with conn:
+                conn.execute(self.INSERT_FOOD_LOG, (
+                    user_id, nutrition["food_name"], nutrition["calories"],
+                    timestamp.isoformat(), json.dumps(nutrition)
+                ))
+
+    def get_food_logs(self, user_id, limit=10, ordered=True, fields=None):
+        attempt_timeout("sqlite.food_logs.query")
+        with span("sqlite.food_logs.query"):
+            rows = self._connect().execute(self.SELECT_FOOD_LOGS, (user_id, limit)).fetchall()
+        # The nutrition JSON is only parsed when the projection needs it
+        parse_nutrition = not fields or any(f.split(".")[0] == "nutrition" for f in fields)
+        docs = [
+            {
+                "user_id": uid,
+                "food_name": food_name,
+                "calories": calories,
+                "timestamp": datetime.fromisoformat(ts),
+                "nutrition": json.loads(nutrition) if nutrition and parse_nutrition else {},
+            }
+            for uid, food_name, calories, ts, nutrition in rows
+        ]
+        return [project(doc, fields) for doc in docs] if fields else docs
+
+    def get_food_log_range(self, user_id, start, end, ranged=True):
+        attempt_timeout("sqlite.food_logs.range")
+        with span("sqlite.food_logs.range"):
+            rows = self._connect().execute(self.SELECT_FOOD_LOG_RANGE, (user_id, start.isoformat(), end.isoformat())).fetchall()
+        return [(datetime.fromisoformat(ts), *rest) for ts, *rest in rows]
+
+    def add_chat_messages(self, user_id, messages, timestamp=None):
+        attempt_timeout("sqlite.chats.insert")
+        with span("sqlite.chats.insert", count=len(messages)):
+            conn = self._connect()
+            with conn:
+                conn.executemany(self.INSERT_CHAT, [
+                    (user_id, role, content, (timestamp + timedelta(microseconds=i) if timestamp else datetime.now()).isoformat())
+                    for i, (role, content) in enumerate(messages)
+                ])
+
+    def get_chats(self, user_id, limit=None, ordered=True):
+        attempt_timeout("sqlite.chats.query")
+        with span("sqlite.chats.query"):
+            conn = self._connect()
+            if limit:
+                rows = conn.execute(self.SELECT_CHATS_TAIL, (user_id, limit)).fetchall()
+            else:
+                rows = conn.execute(self.SELECT_CHATS, (user_id,)).fetchall()
+        return [
+            {"user_id": uid, "role": role, "content": content, "timestamp": datetime.fromisoformat(ts)}
+            for uid, role, content, ts in rows
+        ]
+
+    def get_chat_summary(self, user_id):
+        attempt_timeout("sqlite.chat_summaries.get")
+        with span("sqlite.chat_summaries.get"):
+            row = self._connect().execute(self.SELECT_CHAT_SUMMARY, (user_id,)).fetchone()
+        if row is None:
+            return None
+        summary, covered_until, messages = row
+        return {
+            "summary": summary,
+            "covered_until": datetime.fromisoformat(covered_until) if covered_until else None,
+            "messages": messages,
+        }
+
+    def set_chat_summary(self, user_id, record):
+        attempt_timeout("sqlite.chat_summaries.set")
+        covered_until = record.get("covered_until")
+        with span("sqlite.chat_summaries.set"):
+            conn = self._connect()
+            with conn:
+                conn.execute(self.UPSERT_CHAT_SUMMARY, (
+                    user_id, record["summary"], covered_until.isoformat() if covered_until else None,
+                    record.get("messages", 0), datetime.now().isoformat()
+                ))
+
+    def add_usage(self, rows):
+        attempt_timeout("sqlite.usage.insert")
+        with span("sqlite.usage.insert", count=len(rows)):
+            conn = self._connect()
+            with conn:
+                conn.executemany(self.INSERT_USAGE, [
+                    (r["user_id"], r["endpoint"], r["model"], r["provider"], r["calls"], r["input_tokens"],
+                     r["output_tokens"], r["cost_usd"], r["window_start"].isoformat(), r["window_end"].isoformat())
+                    for r in rows
+                ])
+
+    def get_usage(self, since):
+        attempt_timeout("sqlite.usage.query")
+        with span("sqlite.usage.query"):
+            rows = self._connect().execute(self.SELECT_USAGE, (since.isoformat(),)).fetchall()
+        return [
+            {"user_id": user_id, "endpoint": endpoint, "model": model, "provider": provider, "calls": calls,
+             "input_tokens": input_tokens, "output_tokens": output_tokens, "cost_usd": cost}
+            for user_id, endpoint, model, provider, calls, input_tokens, output_tokens, cost in rows
+        ]
+
+
+def project(doc, fields):
+    """Keeps only `fields` of a document; "nutrition.protein_g" keeps that key of the nested map."""
+    out = {}
+    for field in fields:
+        top, _, sub = field.partition(".")
+        if top not in doc:
+            continue
+        if sub:
+            nested = doc[top] or {}
+            if sub in nested:
+                out.setdefault(top, {})[sub] = nested[sub]
+        else:
+            out[top] = doc[top]
+    return out
+
+
+def create_storage():
+    """
+    Picks the storage backend from STORAGE_BACKEND (firestore | sqlite), and for Firestore
+    the document layout from FIRESTORE_LAYOUT (global | per_user) and how chats are stored
+    from CHAT_STORAGE (messages | chunked, with CHAT_CHUNK_SIZE turns per chunk).
+    Returns None when Firestore is selected but not initialized.
+    """
+    backend = os.getenv("STORAGE_BACKEND", "firestore").lower()
+    if backend == "sqlite":
+        return SQLiteStorage(os.getenv("SQLITE_PATH", "nutrisnap.db"))
+
+    from backend.firebase_utils import get_db
+    db = get_db()
+    if not db:
+        return None
+    return FirestoreStorage(
+        db,
+        layout=os.getenv("FIRESTORE_LAYOUT", "global").lower(),
+        chat_storage=os.getenv("CHAT_STORAGE", "messages").lower(),
+        chat_chunk_size=int(os.getenv("CHAT_CHUNK_SIZE", "100")),
+    )
+
+
+def get_storage():
+    """Process-wide storage, created on first use so importing the app stays cheap."""
+    global _storage, _storage_ready
+    if not _storage_ready:
+        with _storage_lock:
+            if not _storage_ready:
+                _storage = create_storage()
+                _storage_ready = True
+    return _storage
+
+
+def _reset_firestore_storage(changed):
+    # New Firebase credentials: rebuild on next use (also picks up Firestore becoming available)
+    global _storage, _storage_ready
+    with _storage_lock:
+        if not _storage_injected and not isinstance(_storage, SQLiteStorage):
+            _storage = None
+            _storage_ready = False
+
+
+subscribe(("FIREBASE_CREDENTIALS_PATH", CREDENTIALS_FILE), _reset_firestore_storage)
+
+
+def set_storage(storage):
+    """Replaces the process-wide storage (load tests, scripts)."""
+    global _storage, _storage_ready, _storage_injected
+    with _storage_lock:
+        _storage = storage
+        _storage_ready = True
+        _storage_injected = True
@@ -0,0 +1,210 @@
+import contextvars
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-request trace. The middleware in backend.main opens one trace per request;
+# spans opened anywhere below it (endpoint code, AI calls, Firestore calls)
+# attach to it and end up in the Server-Timing header of that response.
+_current_trace = contextvars.ContextVar("nutrisnap_trace", default=None)
+_current_span = contextvars.ContextVar("nutrisnap_span", default=None)
+
+# Finished traces waiting to be written by the export thread; full means the disk can't keep up
+EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE", "1000"))
+_export_queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+_export_thread = None
+_export_lock = threading.Lock()
+export_dropped = 0
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self._start_perf = time.perf_counter()
+        self._duration_ms = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self, error=None):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self._duration_ms = (time.perf_counter() - self._start_perf) * 1000
+        if error is not None:
+            self.error = str(error)
+
+    @property
+    def duration_ms(self):
+        if self._duration_ms is None:
+            return (time.perf_counter() - self._start_perf) * 1000
+        return self._duration_ms
+
+
+class Trace:
+    def __init__(self, name, attributes=None):
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(name, self.trace_id, attributes=attributes)
+        self.spans = [self.root]
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def start_trace(name, **attributes):
+    """Opens a trace for the current request and makes it the active context."""
+    trace = Trace(name, attributes)
+    _current_trace.set(trace)
+    _current_span.set(trace.root)
+    return trace
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times a block of work as a child of the active span.
+    Outside of a request (scripts, background threads) the span is still timed
+    but not recorded anywhere.
+    """
+    trace = _current_trace.get()
+    parent = _current_span.get()
+    s = Span(
+        name,
+        trace.trace_id if trace else secrets.token_hex(16),
+        parent_id=parent.span_id if parent else None,
+        attributes=attributes,
+    )
+    if trace:
+        trace.add(s)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.finish(error=e)
+        raise
+    finally:
+        s.finish()
+        _current_span.reset(token)
+
+
+def server_timing_header(trace):
+    """
+    Builds a Server-Timing header value for a finished trace.
+    Spans sharing a name are summed so repeated Firestore writes show up as one entry.
+    """
+    totals = {}
+    counts = {}
+    for s in trace.spans[1:]:
+        metric = _metric_name(s.name)
+        totals[metric] = totals.get(metric, 0.0) + s.duration_ms
+        counts[metric] = counts.get(metric, 0) + 1
+
+    entries = []
+    for metric, dur in totals.items():
+        entry = f"{metric};dur={dur:.1f}"
+        if counts[metric] > 1:
+            entry += f';desc="{counts[metric]} calls"'
+        entries.append(entry)
+    entries.append(f"total;dur={trace.root.duration_ms:.1f}")
+    return ", ".join(entries)
+
+
+def _metric_name(name):
+    # Server-Timing metric names must be HTTP tokens
+    return "".join(c if c.isalnum() or c in "-._" else "_" for c in name)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace, service_name="nutrisnap-backend"):
+    """Converts a trace into an OTLP/JSON ExportTraceServiceRequest dict."""
+    spans = []
+    for s in trace.spans:
+        otlp_span = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 2 if s is trace.root else 1,  # SERVER / INTERNAL
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns or time.time_ns()),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            otlp_span["parentSpanId"] = s.parent_id
+        spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "backend.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+def export_trace(trace, path=None):
+    """
+    Queues the trace to be appended as one OTLP/JSON line to TRACE_EXPORT_PATH (if set).
+    Encoding and writing happen on a background thread, never on the request path; if
+    the queue is full the trace is dropped and counted in export_dropped.
+    The file can be fed to an OpenTelemetry collector's file receiver or inspected directly.
+    """
+    global _export_thread, export_dropped
+    path = path or os.getenv("TRACE_EXPORT_PATH")
+    if not path:
+        return
+    if _export_thread is None:
+        with _export_lock:
+            if _export_thread is None:
+                _export_thread = threading.Thread(target=_export_loop, name="trace-export", daemon=True)
+                _export_thread.start()
+    try:
+        _export_queue.put_nowait((trace, path))
+    except queue.Full:
+        export_dropped += 1
+
+
+def _export_loop():
+    while True:
+        trace, path = _export_queue.get()
+        try:
+            with open(path, "a") as f:
+                f.write(json.dumps(to_otlp(trace)) + "\n")
+        except Exception as e:
+            print(f"⚠️ Trace export failed: {e}")
+        finally:
+            _export_queue.task_done()
+
+
+def flush_exports(timeout=5.0):
+    """Waits (up to `timeout` seconds) for queued traces to be written; True if they all were."""
+    deadline = time.monotonic() + timeout
+    while _export_queue.unfinished_tasks:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
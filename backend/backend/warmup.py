@@ -0,0 +1,86 @@
+import asyncio
+import os
+import time
+
+from backend.storage import get_storage
+
+# Longest a single step may take; a slow one is reported and the worker goes ready without it
+STEP_TIMEOUT = float(os.getenv("WARMUP_STEP_TIMEOUT", "10"))
+
+
+class WarmupState:
+    """Tracks the startup warm-up so /health can report readiness."""
+
+    def __init__(self):
+        self.status = "pending"
+        self.duration_ms = None
+        self.steps = {}
+
+    @property
+    def ready(self):
+        # Failed steps don't keep the worker out of rotation; requests just pay the cost themselves
+        return self.status in ("done", "disabled")
+
+    def as_dict(self):
+        return {"status": self.status, "duration_ms": self.duration_ms, "steps": self.steps}
+
+
+warmup_state = WarmupState()
+
+
+def warm_storage():
+    storage = get_storage()
+    if storage:
+        storage.warm_up()
+        return storage.name
+    return "not configured"
+
+
+async def warm_gemini():
+    from ai_core.gemini_client import resolve_models
+    return await resolve_models()
+
+
+WARMUP_STEPS = {
+    "storage": warm_storage,
+    "gemini": warm_gemini,
+}
+
+
+def warmup_enabled():
+    return os.getenv("WARMUP_ON_STARTUP", "1").lower() not in ("0", "false", "no")
+
+
+async def _run_step(name, func, timeout=None):
+    timeout = STEP_TIMEOUT if timeout is None else timeout
+    start = time.perf_counter()
+    try:
+        # Blocking steps (Firestore) run in a thread; async ones (model clients) on the loop
+        result = await asyncio.wait_for(func() if asyncio.iscoroutinefunction(func) else asyncio.to_thread(func), timeout)
+        warmup_state.steps[name] = {"ok": True, "ms": round((time.perf_counter() - start) * 1000, 1), "result": result}
+    except asyncio.TimeoutError:
+        # A thread step keeps running in the background; the first request may still benefit from it
+        print(f"⚠️ Warm-up step '{name}' timed out after {timeout:g}s; continuing without it")
+        warmup_state.steps[name] = {"ok": False, "ms": round((time.perf_counter() - start) * 1000, 1),
+                                    "error": f"timed out after {timeout:g}s", "timed_out": True}
+    except Exception as e:
+        print(f"⚠️ Warm-up step '{name}' failed: {e}")
+        warmup_state.steps[name] = {"ok": False, "ms": round((time.perf_counter() - start) * 1000, 1), "error": str(e)}
+
+
+async def run_warmup():
+    """
+    Imports the SDKs, opens the Firestore channel and Google TLS connection,
+    and resolves the Gemini model list, all in parallel (blocking steps in threads).
+    Each step gets WARMUP_STEP_TIMEOUT seconds; one that fails or times out is recorded
+    and the warm-up still finishes.
+    """
+    if not warmup_enabled():
+        warmup_state.status = "disabled"
+        return
+    warmup_state.status = "running"
+    start = time.perf_counter()
+    await asyncio.gather(*(_run_step(name, func) for name, func in WARMUP_STEPS.items()))
+    warmup_state.duration_ms = round((time.perf_counter() - start) * 1000, 1)
+    warmup_state.status = "done"
+    print(f"🔥 Warm-up finished in {warmup_state.duration_ms}ms")
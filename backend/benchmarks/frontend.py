@@ -0,0 +1,115 @@
+"""
+Frontend CPU per interaction for the Streamlit app.
+
+    python -m benchmarks.frontend                          # frontend/app.py, 20 chat messages
+    python -m benchmarks.frontend --app /tmp/app_old.py    # compare another version of the app
+
+Starts the backend in a subprocess (SQLite, no model key, so /chat answers
+instantly) and drives the app with Streamlit's AppTest in this process, so the
+CPU time reported is the frontend's alone. "page" is a full script run with no
+interaction; "chat" is one message end to end (the run triggered by the input
+plus the rerun the app asks for). AppTest reruns the whole script for every
+widget event, so for fragment-based panels this understates the saving a
+browser sees, where the input itself only reruns its fragment.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FRONTEND = os.path.join(ROOT, "frontend")
+
+sys.path.insert(0, FRONTEND)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_backend(db_path, meals=10):
+    from backend.storage import SQLiteStorage
+    storage = SQLiteStorage(db_path)
+    now = datetime.now()
+    for i in range(meals):
+        storage.add_food_log("hackathon_judge_1", {
+            "food_name": f"Meal {i}", "calories": 300 + i, "protein_g": 20.0,
+            "carbs_g": 30.0, "fats_g": 10.0, "confidence": 0.9,
+        }, now - timedelta(hours=3 * i))
+
+    port = _free_port()
+    env = dict(os.environ, STORAGE_BACKEND="sqlite", SQLITE_PATH=db_path, USAGE_FLUSH_INTERVAL="0",
+               GOOGLE_API_KEY="", GEMINI_API_KEY="")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    import requests
+    for _ in range(200):
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return proc, url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.05)
+    proc.kill()
+    raise SystemExit("Backend did not start")
+
+
+def measure(app_path, messages):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(app_path, default_timeout=60)
+    at.run()
+    if at.exception:
+        raise SystemExit(f"App failed: {at.exception[0].message}")
+
+    page, chat = [], []
+    for _ in range(messages):
+        cpu = time.process_time()
+        at.run()
+        page.append(time.process_time() - cpu)
+
+    for i in range(messages):
+        cpu, wall = time.process_time(), time.perf_counter()
+        at.chat_input[0].set_value(f"Is meal {i} healthy?").run()
+        chat.append((time.process_time() - cpu, time.perf_counter() - wall))
+    return page, chat
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Frontend CPU per full run and per chat message")
+    p.add_argument("--app", default=os.path.join(FRONTEND, "app.py"))
+    p.add_argument("--messages", type=int, default=20)
+    args = p.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend, url = start_backend(os.path.join(tmp, "bench.db"))
+        os.environ["BACKEND_URL"] = url
+        try:
+            page, chat = measure(os.path.abspath(args.app), args.messages)
+        finally:
+            backend.terminate()
+            try:
+                # Graceful shutdown waits for open change-feed streams; don't wait them out
+                backend.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                backend.kill()
+                backend.wait()
+
+    print(f"app: {os.path.relpath(os.path.abspath(args.app), ROOT)}")
+    print(f"page run      : {statistics.median(page) * 1000:6.1f}ms CPU (median of {len(page)})")
+    print(f"chat message  : {statistics.median(c for c, _ in chat) * 1000:6.1f}ms CPU, "
+          f"{statistics.median(w for _, w in chat) * 1000:.1f}ms wall (median of {len(chat)})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
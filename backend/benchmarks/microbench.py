@@ -0,0 +1,222 @@
+"""
+Microbenchmarks for the CPU-only pieces of the request path.
+
+    python -m benchmarks.microbench --save          # record baselines for this machine
+    python -m benchmarks.microbench                 # compare against them; exits 1 on regression
+    python -m benchmarks.microbench --threshold 0.15 --only groq
+
+Every benchmark uses fixed fixtures (including the sample images in the repo)
+so runs are comparable. A benchmark counts as regressed when its best time per
+call (least affected by scheduler noise) is more than `threshold` slower
+than the saved baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+SAMPLE_IMAGES = ["temp_test.jpg", "temp_camera-input-2026-02-06T15_04_19.098Z.jpg"]
+
+sys.path.insert(0, os.path.join(ROOT, "frontend"))
+
+NUTRITION = {
+    "food_name": "Grilled Chicken Salad",
+    "calories": 420,
+    "protein_g": 38.0,
+    "carbs_g": 18.0,
+    "fats_g": 20.0,
+    "confidence": 0.92,
+}
+
+FENCED_REPLY = "```json\n" + json.dumps(NUTRITION, indent=4) + "\n```"
+
+COACH_REPLY = "```json\n" + json.dumps({
+    "insight": "Great protein intake this week. Add more fibre to your dinners to balance your carbs.",
+    "suggestions": ["Lentil soup with whole-grain bread", "Vegetable stir-fry with tofu", "Quinoa salad with chickpeas"],
+}, indent=4) + "\n```"
+
+GROQ_PARTS = [
+    {"type": "text", "text": json.dumps(NUTRITION)[:40]},
+    {"type": "text", "text": json.dumps(NUTRITION)[40:]},
+]
+
+
+def _history(n=10):
+    base = datetime(2026, 2, 6, 20, 0, 0)
+    foods = ["Oatmeal", "Chicken Salad", "Pizza Slice", "Salmon Bowl", "Greek Yogurt"]
+    rows = []
+    for i in range(n):
+        nutrition = dict(NUTRITION, food_name=foods[i % len(foods)], calories=300 + 25 * i)
+        rows.append({
+            "user_id": "bench_user",
+            "food_name": nutrition["food_name"],
+            "calories": nutrition["calories"],
+            "timestamp": (base - timedelta(hours=7 * i)).isoformat(),
+            "nutrition": nutrition,
+        })
+    return rows
+
+
+def _sample_image():
+    for name in SAMPLE_IMAGES:
+        path = os.path.join(ROOT, name)
+        if os.path.exists(path):
+            return path
+    raise SystemExit("Sample image not found; expected one of " + ", ".join(SAMPLE_IMAGES))
+
+
+def build_benchmarks():
+    """Returns {name: zero-arg callable}. Imports are done here so setup cost is not measured."""
+    from ai_core.groq_client import extract_json, encode_image
+    from ai_core.gemini_client import parse_json_text
+    from backend.models import NutritionInfo
+    from backend.stats import compute_stats
+    from backend.main import FastJSONResponse
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from analytics import today_totals, stats_frames, recent_meals
+
+    image_path = _sample_image()
+    history = _history()
+    today = datetime(2026, 2, 6).date()
+    start = today - timedelta(days=29)
+    rows = [
+        (datetime.fromisoformat(h["timestamp"]), h["food_name"], h["calories"],
+         h["nutrition"]["protein_g"], h["nutrition"]["carbs_g"], h["nutrition"]["fats_g"])
+        for h in _history(300)
+    ]
+    stats = compute_stats(rows, start, today, "day")
+    # GET /history as storage returns it (datetime timestamps), full and with the frontend's projection
+    stored = [dict(h, timestamp=datetime.fromisoformat(h["timestamp"])) for h in history]
+    projected = [
+        {"food_name": h["food_name"], "calories": h["calories"], "timestamp": h["timestamp"],
+         "nutrition": {k: h["nutrition"][k] for k in ("protein_g", "carbs_g", "fats_g")}}
+        for h in stored
+    ]
+
+    def history_default_encoder():
+        # The pre-orjson path: isoformat loop, jsonable_encoder, json.dumps
+        docs = [dict(d, timestamp=d["timestamp"].isoformat()) for d in stored]
+        return JSONResponse(None).render(jsonable_encoder({"user_id": "bench_user", "history": docs}))
+
+    return {
+        "groq.extract_json[str]": lambda: extract_json(json.dumps(NUTRITION)),
+        "groq.extract_json[parts]": lambda: extract_json(GROQ_PARTS),
+        "groq.encode_image": lambda: encode_image(image_path),
+        "gemini.parse_json_text[nutrition]": lambda: parse_json_text(FENCED_REPLY),
+        "coach.parse_json_text": lambda: parse_json_text(COACH_REPLY),
+        "models.NutritionInfo": lambda: NutritionInfo(**NUTRITION),
+        "frontend.today_totals": lambda: today_totals(history, today),
+        "stats.compute_stats[300 meals]": lambda: compute_stats(rows, start, today, "day"),
+        "frontend.stats_frames": lambda: stats_frames(stats),
+        "frontend.recent_meals": lambda: recent_meals(history),
+        "history.render[json]": history_default_encoder,
+        "history.render[orjson]": lambda: FastJSONResponse(None).render({"user_id": "bench_user", "history": stored}),
+        "history.render[orjson+fields]": lambda: FastJSONResponse(None).render({"user_id": "bench_user", "history": projected}),
+    }
+
+
+def measure(func, min_time=0.2, repeats=7):
+    """Median and best seconds per call, auto-scaling the loop count to ~min_time per repeat."""
+    func()  # warm-up
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 4 or number >= 1_000_000:
+            break
+        number *= 4
+    number = max(1, int(number * (min_time / max(elapsed, 1e-9))))
+
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return {"median_s": statistics.median(samples), "best_s": min(samples), "loops": number}
+
+
+def _fmt(seconds):
+    if seconds < 1e-6:
+        return f"{seconds * 1e9:.0f}ns"
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}µs"
+    return f"{seconds * 1e3:.2f}ms"
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Microbenchmarks with baseline regression gating")
+    p.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    p.add_argument("--save", action="store_true", help="write results as the new baseline")
+    p.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    p.add_argument("--only", default=None, help="run only benchmarks whose name contains this string")
+    p.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat")
+    args = p.parse_args(argv)
+
+    benches = build_benchmarks()
+    if args.only:
+        benches = {k: v for k, v in benches.items() if args.only in k}
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<36} {'median':>10} {'best':>10} {'baseline':>10} {'change':>8}")
+    for name, func in benches.items():
+        r = measure(func, min_time=args.min_time)
+        results[name] = r
+        base = baseline.get(name)
+        change = ""
+        base_str = "-"
+        if base:
+            ratio = r["best_s"] / base["best_s"] - 1
+            change = f"{ratio:+.0%}"
+            base_str = _fmt(base["best_s"])
+            if ratio > args.threshold:
+                regressions.append((name, ratio))
+                change += " ❌"
+        print(f"{name:<36} {_fmt(r['median_s']):>10} {_fmt(r['best_s']):>10} {base_str:>10} {change:>8}")
+
+    if args.save:
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                saved = json.load(f).get("results", {})
+        saved.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "saved_at": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.platform(),
+                "results": saved,
+            }, f, indent=2)
+        print(f"\n✅ Baseline saved to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"\n⚠️ No baseline at {args.baseline}; run with --save first.")
+        return 0
+    if regressions:
+        print(f"\n❌ {len(regressions)} benchmark(s) regressed more than {args.threshold:.0%}:")
+        for name, ratio in regressions:
+            print(f"   {name}: {ratio:+.0%}")
+        return 1
+    print(f"\n✅ No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
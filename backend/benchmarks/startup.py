@@ -0,0 +1,115 @@
+"""
+Cold-start report for the backend.
+
+    python -m benchmarks.startup                    # median of 5 fresh interpreters, per-package breakdown
+    python -m benchmarks.startup --budget-ms 800    # custom budget
+
+Each run starts a new interpreter, imports backend.main, runs the app's
+lifespan and polls /health until the worker reports ready, so the numbers
+match what a new gunicorn worker or a Vercel cold start pays. The
+per-package breakdown comes from `python -X importtime`. Exits 1 if the
+median import time exceeds the budget or if one of the heavy SDKs is
+imported eagerly.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Target for `import backend.main` on a Render starter instance; FastAPI itself is most of it.
+COLD_START_BUDGET_MS = 600
+
+# Must only be imported when first used, never by `import backend.main`
+LAZY_MODULES = ["google.genai", "firebase_admin", "google.cloud.firestore", "PIL", "groq", "openai"]
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import backend.main as m
+t1 = time.perf_counter()
+eager = [name for name in %r if name in sys.modules]
+from fastapi.testclient import TestClient
+t2 = time.perf_counter()
+with TestClient(m.app) as client:
+    while client.get("/health").status_code != 200:
+        time.sleep(0.005)
+    t3 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "ready_ms": (t3 - t2) * 1000, "eager": eager}))
+""" % (LAZY_MODULES,)
+
+
+def _run(args, env=None):
+    return subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, text=True, env=env)
+
+
+def measure(runs):
+    samples = []
+    for _ in range(runs):
+        proc = _run(["-c", _PROBE])
+        if proc.returncode != 0:
+            raise SystemExit(f"Probe failed:\n{proc.stderr}")
+        samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def import_breakdown():
+    """Parses `-X importtime` output into {module: (self_us, cumulative_us)}."""
+    proc = _run(["-X", "importtime", "-c", "import backend.main"])
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line.split(":", 1)[1].split("|")]
+        modules[name] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def by_package(modules):
+    totals = {}
+    for name, (self_us, _) in modules.items():
+        package = name.split(".")[0]
+        if package == "google" and "." in name:
+            package = ".".join(name.split(".")[:2])
+        totals[package] = totals.get(package, 0) + self_us
+    return sorted(totals.items(), key=lambda kv: kv[1], reverse=True)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Cold-start import time report")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--budget-ms", type=float, default=COLD_START_BUDGET_MS)
+    p.add_argument("--top", type=int, default=12, help="packages to list in the breakdown")
+    args = p.parse_args(argv)
+
+    samples = measure(args.runs)
+    import_ms = statistics.median(s["import_ms"] for s in samples)
+    ready_ms = statistics.median(s["ready_ms"] for s in samples)
+    eager = sorted({name for s in samples for name in s["eager"]})
+
+    modules = import_breakdown()
+    total_us = sum(self_us for self_us, _ in modules.values())
+    print(f"{'package':<32} {'self':>10} {'share':>7}")
+    for package, self_us in by_package(modules)[:args.top]:
+        print(f"{package:<32} {self_us / 1000:>8.1f}ms {self_us / total_us:>6.1%}")
+
+    print(f"\nimport backend.main  : {import_ms:.0f}ms (median of {args.runs}, budget {args.budget_ms:.0f}ms)")
+    print(f"startup to ready     : {ready_ms:.0f}ms (lifespan + warm-up)")
+
+    failed = False
+    if eager:
+        print(f"❌ Heavy modules imported eagerly: {', '.join(eager)}")
+        failed = True
+    if import_ms > args.budget_ms:
+        print(f"❌ Import time exceeds the {args.budget_ms:.0f}ms cold-start budget")
+        failed = True
+    if not failed:
+        print("✅ Within cold-start budget")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+import pandas as pd
+
+
+def today_totals(history_data, today):
+    """Returns (calories, protein_g, carbs_g) logged on `today` from /history entries."""
+    df_today = pd.DataFrame(history_data)
+    today_calories = 0
+    today_protein = 0
+    today_carbs = 0
+    if not df_today.empty:
+        df_today['timestamp'] = pd.to_datetime(df_today['timestamp'])
+        # Filter for today
+        mask = df_today['timestamp'].dt.date == today
+        df_filtered = df_today[mask]
+
+        today_calories = int(df_filtered['calories'].sum())
+        # Safely sum macros from the 'nutrition' dict column
+        for nut in df_filtered['nutrition']:
+            today_protein += nut.get('protein_g', 0)
+            today_carbs += nut.get('carbs_g', 0)
+    return today_calories, today_protein, today_carbs
+
+
+def stats_frames(stats):
+    """Chart frames for the Statistics view from a /stats response (arrays map straight to columns)."""
+    series = stats["series"]
+    totals = stats["totals"]
+    top_foods = stats["top_foods"]["food_name"]
+    daily_calories = pd.DataFrame({"date": pd.to_datetime(series["period"]), "calories": series["calories"]})
+    macro_df = pd.DataFrame({
+        "Macro": ["Protein", "Carbs", "Fats"],
+        "Grams": [totals["protein_g"], totals["carbs_g"], totals["fats_g"]],
+    })
+    return {
+        "avg_calories": totals["avg_calories_per_meal"],
+        "total_meals": totals["meals"],
+        "top_food": top_foods[0] if top_foods else "N/A",
+        "daily_calories": daily_calories,
+        "macro_df": macro_df,
+    }
+
+
+def recent_meals(history_data, count=5):
+    """Macro columns for the most recent meals in a /history response."""
+    recent_df = pd.DataFrame(history_data).head(count)
+    # Extract nutrition sub-dict to columns
+    recent_df['Protein'] = recent_df['nutrition'].apply(lambda x: x.get('protein_g', 0))
+    recent_df['Carbs'] = recent_df['nutrition'].apply(lambda x: x.get('carbs_g', 0))
+    recent_df['Fats'] = recent_df['nutrition'].apply(lambda x: x.get('fats_g', 0))
+    return recent_df
@@ -0,0 +1,85 @@
+import io
+import os
+
+from PIL import Image, ImageOps
+from urllib3 import encode_multipart_formdata
+
+# Longest side (px) and JPEG quality of the image sent to /analyze, kept within sane bounds
+MAX_SIDE = min(max(int(os.getenv("UPLOAD_MAX_SIDE", "1280")), 320), 4096)
+JPEG_QUALITY = min(max(int(os.getenv("UPLOAD_JPEG_QUALITY", "82")), 40), 95)
+CHUNK_SIZE = 16 * 1024
+
+
+def prepare_image(raw, filename, mime_type, max_side=MAX_SIDE, quality=JPEG_QUALITY):
+    """
+    Downscales a photo to fit max_side and re-encodes it as JPEG for upload.
+    Returns (bytes, filename, mime_type, info); the original is kept if it is already
+    within bounds and re-encoding would not make it smaller.
+    """
+    info = {"original_bytes": len(raw), "original_size": None, "size": None}
+    try:
+        img = Image.open(io.BytesIO(raw))
+        info["original_size"] = img.size
+        # Camera photos are often stored sideways with an EXIF rotation; bake it in before EXIF is dropped
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+        data = out.getvalue()
+    except Exception as e:
+        print(f"DEBUG: Image downscale skipped - {e}")
+        info.update(bytes=len(raw), size=info["original_size"])
+        return raw, filename, mime_type, info
+
+    within_bounds = max(info["original_size"]) <= max_side
+    if within_bounds and len(data) >= len(raw):
+        info.update(bytes=len(raw), size=info["original_size"])
+        return raw, filename, mime_type, info
+    info.update(bytes=len(data), size=img.size)
+    return data, os.path.splitext(filename or "meal")[0] + ".jpg", "image/jpeg", info
+
+
+def savings_caption(info):
+    """One-line readout of what downscaling saved, e.g. '3.1 MB → 214 KB (−93%) · 4032×3024 → 1280×960'."""
+    before, after = info["original_bytes"], info["bytes"]
+    text = f"📉 Upload {_fmt_bytes(before)} → {_fmt_bytes(after)}"
+    if before and after < before:
+        text += f" (−{round(100 * (before - after) / before)}%)"
+    if info["original_size"] and info["size"] and info["size"] != info["original_size"]:
+        text += " · {}×{} → {}×{}".format(*info["original_size"], *info["size"])
+    return text
+
+
+def _fmt_bytes(n):
+    if n >= 1024 * 1024:
+        return f"{n / (1024 * 1024):.1f} MB"
+    return f"{max(1, round(n / 1024))} KB"
+
+
+class ProgressBody:
+    """
+    Multipart body that reports upload progress as requests streams it.
+    on_progress(sent, total) is called after each chunk; the body can be re-read on retry.
+    """
+
+    def __init__(self, fields, on_progress):
+        self.body, self.content_type = encode_multipart_formdata(fields)
+        self.on_progress = on_progress
+
+    def __len__(self):
+        return len(self.body)
+
+    def __iter__(self):
+        total = len(self.body)
+        for start in range(0, total, CHUNK_SIZE):
+            chunk = self.body[start:start + CHUNK_SIZE]
+            yield chunk
+            self.on_progress(start + len(chunk), total)
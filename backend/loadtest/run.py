@@ -0,0 +1,278 @@
+"""
+Offline load test for the FastAPI backend.
+
+Boots backend.main on a local port with the model provider and Firestore
+replaced by the stubs in loadtest.stubs, then drives /analyze, /chat,
+/history and /coach at a fixed request rate (open loop) and reports
+throughput and p50/p95/p99 latency per endpoint.
+
+    python -m loadtest.run --rps 20 --duration 30 --model-latency-ms 800 --db-latency-ms 40
+
+Use --max-p95-ms / --max-error-rate to turn it into a pass/fail gate.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from loadtest.stubs import Faults, InMemoryFirestore, StubFitnessServer, StubModelProvider
+
+ENDPOINTS = ["analyze", "chat", "history", "coach"]
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def install_stubs(model_faults, db_faults, users, require_indexes=False, storage="memory", sqlite_path=None,
+                  layout="global", chat_storage="messages"):
+    """
+    Points backend.main at the stub provider and either the in-memory Firestore
+    (behind FirestoreStorage, in the given layout and chat mode) or a fresh SQLiteStorage file.
+    For the per-user layout the seeded logs are moved over with backend.migrate.
+    """
+    # Stubs are in-process already; nothing to warm up
+    os.environ["WARMUP_ON_STARTUP"] = "0"
+
+    import backend.main as main
+    from backend.storage import FirestoreStorage, SQLiteStorage, set_storage
+
+    provider = StubModelProvider(model_faults)
+    db = InMemoryFirestore(db_faults, require_indexes=require_indexes)
+    db.seed_food_logs(users)
+
+    if storage == "sqlite":
+        if os.path.exists(sqlite_path):
+            os.remove(sqlite_path)
+        storage = SQLiteStorage(sqlite_path)
+        for doc in db.collection("food_logs")._docs.values():
+            storage.add_food_log(doc["user_id"], doc["nutrition"], doc["timestamp"])
+        set_storage(storage)
+    else:
+        if layout == "per_user":
+            from backend.migrate import migrate
+            faults, db.faults = db.faults, Faults()
+            migrate(db, verbose=False)
+            db.faults = faults
+        set_storage(FirestoreStorage(db, layout, chat_storage))
+    main.analyze_food_image = provider.analyze_food_image
+    main.generate_text = provider.generate_text
+    main.analyze_audio = provider.analyze_audio
+    return main.app, db
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app, port):
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("uvicorn did not start within 10s")
+        time.sleep(0.05)
+    return server, thread
+
+
+def load_images():
+    paths = sorted(glob.glob(os.path.join(ROOT, "temp_*.jpg")))
+    if not paths:
+        raise SystemExit("No sample images (temp_*.jpg) found next to the backend package")
+    images = []
+    for p in paths:
+        with open(p, "rb") as f:
+            images.append((os.path.basename(p), f.read()))
+    return images
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+async def _issue(client, endpoint, user_id, images, rng):
+    if endpoint == "analyze":
+        name, data = rng.choice(images)
+        return await client.post("/analyze", params={"user_id": user_id}, files={"file": (name, data, "image/jpeg")})
+    if endpoint == "chat":
+        return await client.post(f"/chat/{user_id}", json={"message": "How much protein did I eat today?"})
+    if endpoint == "history":
+        return await client.get(f"/history/{user_id}")
+    if endpoint == "coach":
+        return await client.get(f"/coach/{user_id}")
+    raise ValueError(endpoint)
+
+
+async def drive(base_url, endpoints, weights, rps, duration, users, images, seed=0, timeout=60.0):
+    """Fires requests on a fixed schedule regardless of response times (open loop)."""
+    rng = random.Random(seed)
+    results = []
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=1000)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+
+        async def one(endpoint, user_id):
+            start = time.perf_counter()
+            try:
+                res = await _issue(client, endpoint, user_id, images, rng)
+                status = res.status_code
+            except Exception as e:
+                status = type(e).__name__
+            results.append((endpoint, status, (time.perf_counter() - start) * 1000))
+
+        total = int(rps * duration)
+        t0 = time.perf_counter()
+        tasks = []
+        for i in range(total):
+            delay = t0 + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            endpoint = rng.choices(endpoints, weights=weights)[0]
+            tasks.append(asyncio.create_task(one(endpoint, rng.choice(users))))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - t0
+    return results, elapsed
+
+
+def summarize(results, elapsed):
+    def stats(rows):
+        latencies = sorted(r[2] for r in rows)
+        errors = sum(1 for r in rows if not (isinstance(r[1], int) and r[1] < 500))
+        return {
+            "requests": len(rows),
+            "errors": errors,
+            "error_rate": errors / len(rows) if rows else 0.0,
+            "throughput_rps": len(rows) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": latencies[-1] if latencies else 0.0,
+        }
+
+    report = {"elapsed_s": elapsed, "overall": stats(results), "endpoints": {}}
+    for endpoint in sorted({r[0] for r in results}):
+        report["endpoints"][endpoint] = stats([r for r in results if r[0] == endpoint])
+    return report
+
+
+def print_report(report):
+    print(f"\n{'endpoint':<10} {'reqs':>6} {'err%':>6} {'rps':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    rows = list(report["endpoints"].items()) + [("ALL", report["overall"])]
+    for name, s in rows:
+        print(
+            f"{name:<10} {s['requests']:>6} {s['error_rate'] * 100:>5.1f}% {s['throughput_rps']:>7.1f} "
+            f"{s['p50_ms']:>7.1f}ms {s['p95_ms']:>7.1f}ms {s['p99_ms']:>7.1f}ms {s['max_ms']:>7.1f}ms"
+        )
+    print(f"\nWall time: {report['elapsed_s']:.1f}s")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Offline load test for the NutriSnap backend")
+    p.add_argument("--rps", type=float, default=10.0, help="target request rate")
+    p.add_argument("--duration", type=float, default=20.0, help="seconds of traffic to generate")
+    p.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated subset of " + ",".join(ENDPOINTS))
+    p.add_argument("--weights", default=None, help="comma-separated weights matching --endpoints")
+    p.add_argument("--users", type=int, default=20, help="number of distinct user ids")
+    p.add_argument("--model-latency-ms", type=float, default=500.0)
+    p.add_argument("--model-jitter-ms", type=float, default=100.0)
+    p.add_argument("--model-error-rate", type=float, default=0.0)
+    p.add_argument("--db-latency-ms", type=float, default=30.0)
+    p.add_argument("--db-jitter-ms", type=float, default=10.0)
+    p.add_argument("--db-error-rate", type=float, default=0.0)
+    p.add_argument("--storage", choices=["memory", "sqlite"], default="memory",
+                   help="in-memory Firestore stub or a local SQLite file")
+    p.add_argument("--sqlite-path", default="loadtest.db")
+    p.add_argument("--layout", choices=["global", "per_user"], default="global",
+                   help="Firestore document layout for --storage memory")
+    p.add_argument("--chat-storage", choices=["messages", "chunked"], default="messages",
+                   help="Firestore chat mode for --storage memory")
+    p.add_argument("--fitness-error-rate", type=float, default=None,
+                   help="send fitness syncs to a local stub platform failing at this rate (default: dry run)")
+    p.add_argument("--missing-indexes", action="store_true", help="fail ordered queries like a project without composite indexes")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--json", dest="json_path", help="also write the report to this file")
+    p.add_argument("--max-p95-ms", type=float, help="exit non-zero if overall p95 exceeds this")
+    p.add_argument("--max-error-rate", type=float, help="exit non-zero if overall error rate exceeds this")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+    weights = [float(w) for w in args.weights.split(",")] if args.weights else [1.0] * len(endpoints)
+    if len(weights) != len(endpoints):
+        raise SystemExit("--weights must have one entry per endpoint")
+
+    users = [f"load_user_{i}" for i in range(args.users)]
+    fitness = None
+    if args.fitness_error_rate is not None:
+        fitness = StubFitnessServer(Faults(20, 10, args.fitness_error_rate, seed=args.seed + 2)).start()
+        os.environ["FITNESS_API_URL"] = fitness.url
+        os.environ.setdefault("FITNESS_FLUSH_WINDOW", "1")
+    app, db = install_stubs(
+        Faults(args.model_latency_ms, args.model_jitter_ms, args.model_error_rate, seed=args.seed),
+        Faults(args.db_latency_ms, args.db_jitter_ms, args.db_error_rate, seed=args.seed + 1),
+        users,
+        require_indexes=args.missing_indexes,
+        storage=args.storage,
+        sqlite_path=args.sqlite_path,
+        layout=args.layout,
+        chat_storage=args.chat_storage,
+    )
+    images = load_images()
+
+    port = _free_port()
+    server, thread = start_server(app, port)
+    print(f"🚀 Driving {args.rps:g} rps for {args.duration:g}s against http://127.0.0.1:{port} ({', '.join(endpoints)})")
+    try:
+        results, elapsed = asyncio.run(
+            drive(f"http://127.0.0.1:{port}", endpoints, weights, args.rps, args.duration, users, images, seed=args.seed)
+        )
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        if fitness:
+            fitness.stop()
+
+    report = summarize(results, elapsed)
+    report["config"] = vars(args)
+    report["firestore_rpcs"] = db.rpc_count
+    if fitness:
+        report["fitness_sync"] = {"requests": fitness.requests, "batches": len(fitness.batches), "meals": fitness.meals}
+        print(f"Fitness platform: {fitness.requests} requests, {len(fitness.batches)} batches, {fitness.meals} meals")
+    print_report(report)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if args.max_p95_ms is not None and report["overall"]["p95_ms"] > args.max_p95_ms:
+        print(f"❌ p95 {report['overall']['p95_ms']:.1f}ms exceeds budget {args.max_p95_ms:g}ms")
+        failed = True
+    if args.max_error_rate is not None and report["overall"]["error_rate"] > args.max_error_rate:
+        print(f"❌ error rate {report['overall']['error_rate']:.2%} exceeds budget {args.max_error_rate:.2%}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,441 @@
+"""
+Offline stand-ins for the external services the backend talks to:
+the model provider (ai_core), Firestore and the fitness platform. All add
+configurable latency and can inject errors so the load test can exercise
+the fallback and retry paths.
+"""
+import asyncio
+import itertools
+import json
+import operator
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ai_core import usage
+
+
+class Faults:
+    """Latency / error-injection settings shared by a stub."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _seconds(self):
+        with self._lock:
+            jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def delay(self):
+        seconds = self._seconds()
+        if seconds:
+            time.sleep(seconds)
+
+    async def async_delay(self):
+        seconds = self._seconds()
+        if seconds:
+            await asyncio.sleep(seconds)
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+
+# ---------------------------------------------------------------------------
+# Model provider
+# ---------------------------------------------------------------------------
+
+STUB_FOODS = [
+    ("Grilled Chicken Salad", 420, 38.0, 18.0, 20.0),
+    ("Margherita Pizza Slice", 285, 12.0, 36.0, 10.0),
+    ("Oatmeal with Berries", 310, 9.0, 54.0, 6.0),
+    ("Salmon and Rice Bowl", 610, 35.0, 62.0, 22.0),
+    ("Greek Yogurt Parfait", 240, 15.0, 30.0, 6.0),
+]
+
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+
+class StubModelProvider:
+    """
+    Mirrors the ai_core client API (analyze_food_image / generate_text / analyze_audio)
+    and returns the same shapes as ai_core.gemini_client, including its error values.
+    Records usage like the real clients, estimating ~4 characters per token.
+    """
+
+    def __init__(self, faults=None):
+        self.faults = faults or Faults()
+        self._counter = itertools.count()
+
+    async def analyze_food_image(self, image_path):
+        await self.faults.async_delay()
+        if self.faults.should_fail():
+            return {"error": "All models failed. Last error: stub injected failure"}
+        name, calories, protein, carbs, fats = STUB_FOODS[next(self._counter) % len(STUB_FOODS)]
+        usage.record("stub", "stub-vision", 560, 40)
+        return {
+            "food_name": name,
+            "calories": calories,
+            "protein_g": protein,
+            "carbs_g": carbs,
+            "fats_g": fats,
+            "confidence": 0.9,
+        }
+
+    async def generate_text(self, prompt):
+        await self.faults.async_delay()
+        if self.faults.should_fail():
+            return "I'm sorry, I'm having trouble connecting to my AI brain right now. Please try again in a moment."
+        if '"suggestions"' in prompt:
+            reply = "```json\n" + json.dumps({
+                "insight": "Solid protein intake so far; add more fibre at dinner.",
+                "suggestions": ["Lentil soup", "Vegetable stir-fry", "Quinoa salad"],
+            }) + "\n```"
+        else:
+            reply = "Stub response: keep meals balanced and stay hydrated."
+        usage.record("stub", "stub-text", _tokens(prompt), _tokens(reply))
+        return reply
+
+    async def analyze_audio(self, audio_bytes, mime_type="audio/wav", prompt=""):
+        await self.faults.async_delay()
+        if self.faults.should_fail():
+            return "I couldn't hear you clearly. Could you please try recording again or typing your request?"
+        reply = f"Stub voice response ({len(audio_bytes)} bytes of {mime_type})."
+        usage.record("stub", "stub-audio", _tokens(prompt) + len(audio_bytes) // 1000, _tokens(reply))
+        return reply
+
+
+# ---------------------------------------------------------------------------
+# Firestore
+# ---------------------------------------------------------------------------
+
+class InjectedFirestoreError(Exception):
+    pass
+
+
+class _Snapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+def _write(doc_ref, data, merge):
+    # Caller holds the store lock. Handles firestore.ArrayUnion (by duck type) like Firestore:
+    # appends the values not already in the array
+    docs = doc_ref._collection._docs
+    current = dict(docs.get(doc_ref.id) or {}) if merge else {}
+    for key, value in data.items():
+        if type(value).__name__ == "ArrayUnion":
+            existing = list(current.get(key) or [])
+            current[key] = existing + [v for v in value.values if v not in existing]
+        else:
+            current[key] = value
+    docs[doc_ref.id] = current
+
+
+class _DocumentRef:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def set(self, data, merge=False, timeout=None):
+        self._collection._store._rpc(timeout)
+        with self._collection._store._lock:
+            _write(self, data, merge)
+
+    def get(self, timeout=None):
+        store = self._collection._store
+        store._rpc(timeout)
+        with store._lock:
+            data = self._collection._docs.get(self.id)
+            store.docs_read += 1
+        return _Snapshot(self.id, dict(data) if data is not None else None)
+
+    def collection(self, name):
+        # Subcollections are kept by path: "users/<uid>/food_logs"
+        return self._collection._store.collection(f"{self._collection.name}/{self.id}/{name}")
+
+
+class _WriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def set(self, doc_ref, data, merge=False):
+        self._writes.append((doc_ref, dict(data), merge))
+
+    def commit(self, timeout=None):
+        # One RPC for the whole batch, like Firestore
+        self._store._rpc(timeout)
+        with self._store._lock:
+            for doc_ref, data, merge in self._writes:
+                _write(doc_ref, data, merge)
+        self._writes = []
+
+
+_OPS = {"==": operator.eq, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+
+def _select(data, field_paths):
+    # Like a Firestore projection: "a.b" keeps key b of map a
+    out = {}
+    for path in field_paths:
+        top, _, sub = path.partition(".")
+        if top not in data:
+            continue
+        if not sub:
+            out[top] = data[top]
+        elif isinstance(data[top], dict) and sub in data[top]:
+            out.setdefault(top, {})[sub] = data[top][sub]
+    return out
+
+
+def _matches(value, op, target):
+    if op == "==":
+        return value == target
+    return value is not None and _OPS[op](value, target)
+
+
+class _Query:
+    def __init__(self, collection, filters=(), orders=(), limit=None, fields=None, cursor=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._fields = fields
+        self._cursor = cursor
+
+    def _copy(self, **changes):
+        args = dict(filters=self._filters, orders=self._orders, limit=self._limit, fields=self._fields, cursor=self._cursor)
+        args.update(changes)
+        return _Query(self._collection, **args)
+
+    def where(self, field, op, value):
+        if op not in _OPS:
+            raise NotImplementedError(f"In-memory Firestore does not support {op!r} filters")
+        return self._copy(filters=self._filters + [(field, op, value)])
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(orders=self._orders + [(field, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def start_after(self, values):
+        # {order field: value}; "__name__" is the document id
+        if any(direction != "ASCENDING" for _, direction in self._orders):
+            raise NotImplementedError("In-memory Firestore only supports cursors on ascending orders")
+        return self._copy(cursor=tuple(values[field] for field, _ in self._orders))
+
+    def _sort_key(self, doc_id, data):
+        return tuple(
+            doc_id if field == "__name__" else datetime.min if data.get(field) is None else data[field]
+            for field, _ in self._orders
+        )
+
+    def stream(self, timeout=None):
+        store = self._collection._store
+        store._rpc(timeout)
+        # Like Firestore: a query over more than one field with an order_by or a range needs a
+        # composite index (equality plus order_by, equality plus range); one field never does
+        ranged = any(op != "==" for _, op, _ in self._filters)
+        fields = {f for f, _, _ in self._filters} | {f for f, _ in self._orders if f != "__name__"}
+        needs_index = len(fields) > 1 and (self._orders or ranged)
+        if needs_index and store.require_indexes:
+            raise InjectedFirestoreError("400 The query requires an index (in-memory stub)")
+        with store._lock:
+            rows = [
+                (doc_id, data) for doc_id, data in self._collection._docs.items()
+                if all(_matches(data.get(f), op, v) for f, op, v in self._filters)
+            ]
+        for i in reversed(range(len(self._orders))):
+            field, direction = self._orders[i]
+            rows.sort(key=lambda r: self._sort_key(*r)[i], reverse=(direction == "DESCENDING"))
+        if self._cursor is not None:
+            rows = [r for r in rows if self._sort_key(*r) > self._cursor]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        with store._lock:
+            # Firestore bills a query per document returned (at least one)
+            store.docs_read += max(len(rows), 1)
+        for doc_id, data in rows:
+            if self._fields is not None:
+                data = _select(data, self._fields)
+            yield _Snapshot(doc_id, data)
+
+
+class _Collection(_Query):
+    def __init__(self, store, name):
+        self._store = store
+        self.name = name
+        self._docs = {}
+        self._ids = itertools.count()
+        super().__init__(self)
+
+    def document(self, doc_id=None):
+        if doc_id is None:
+            doc_id = f"{self.name.rsplit('/', 1)[-1]}-{next(self._ids)}"
+        return _DocumentRef(self, doc_id)
+
+    def list_documents(self):
+        # Like Firestore, includes "missing" documents that only hold subcollections
+        self._store._rpc(None)
+        prefix = f"{self.name}/"
+        with self._store._lock:
+            ids = set(self._docs) | {name[len(prefix):].split("/", 1)[0]
+                                     for name in self._store._collections if name.startswith(prefix)}
+        return [_DocumentRef(self, doc_id) for doc_id in sorted(ids)]
+
+
+class InMemoryFirestore:
+    """
+    Just enough of the google.cloud.firestore.Client surface used by backend.storage and
+    backend.migrate: collection().document().set()/get(), document().collection() for
+    subcollections, list_documents(), set(merge=True) with ArrayUnion, batch(), and
+    where().order_by().select().start_after().limit().stream().
+    Every set(), get(), batch commit and stream() counts as one RPC and pays the configured latency.
+    """
+
+    def __init__(self, faults=None, require_indexes=False):
+        self.faults = faults or Faults()
+        # Simulate a project without composite indexes (where + order_by fails)
+        self.require_indexes = require_indexes
+        self._collections = {}
+        self._lock = threading.Lock()
+        self.rpc_count = 0
+        self.docs_read = 0
+
+    def _rpc(self, timeout=None):
+        with self._lock:
+            self.rpc_count += 1
+        seconds = self.faults._seconds()
+        if timeout is not None and seconds > timeout:
+            # Like the real client: give up at the timeout instead of waiting for the reply
+            time.sleep(timeout)
+            raise InjectedFirestoreError("504 Deadline Exceeded (in-memory stub)")
+        if seconds:
+            time.sleep(seconds)
+        if self.faults.should_fail():
+            raise InjectedFirestoreError("503 Firestore unavailable (in-memory stub)")
+
+    def batch(self):
+        return _WriteBatch(self)
+
+    def collection(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = _Collection(self, name)
+            return self._collections[name]
+
+    def seed_food_logs(self, user_ids, per_user=10):
+        """Pre-populates food_logs so /history and /coach have data to read."""
+        logs = self.collection("food_logs")
+        now = time.time()
+        for uid in user_ids:
+            for i in range(per_user):
+                name, calories, protein, carbs, fats = STUB_FOODS[i % len(STUB_FOODS)]
+                logs._docs[f"seed-{uid}-{i}"] = {
+                    "user_id": uid,
+                    "food_name": name,
+                    "calories": calories,
+                    "timestamp": datetime.fromtimestamp(now - i * 3600),
+                    "nutrition": {
+                        "food_name": name, "calories": calories, "protein_g": protein,
+                        "carbs_g": carbs, "fats_g": fats, "confidence": 0.9,
+                    },
+                }
+
+
+# ---------------------------------------------------------------------------
+# Fitness platform
+# ---------------------------------------------------------------------------
+
+class StubFitnessServer:
+    """
+    Local HTTP endpoint for backend.integration's sync queue. Records every
+    accepted batch; injected failures answer 503, or 429 with Retry-After
+    when rate_limit_rate trips.
+
+        with StubFitnessServer(Faults(error_rate=0.3)) as server:
+            os.environ["FITNESS_API_URL"] = server.url
+    """
+
+    def __init__(self, faults=None, rate_limit_rate=0.0, port=0):
+        self.faults = faults or Faults()
+        self.rate_limit_rate = rate_limit_rate
+        self.batches = []
+        self.requests = 0
+        self.idempotency_keys = set()
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, headers = stub._handle(json.loads(body or b"{}"), self.headers.get("Idempotency-Key"))
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/v1/nutrition:batchSync"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def _handle(self, payload, idempotency_key):
+        with self._lock:
+            self.requests += 1
+            rate_limited = self.rate_limit_rate and self._rng.random() < self.rate_limit_rate
+        self.faults.delay()
+        if rate_limited:
+            return 429, {"Retry-After": "1"}
+        if self.faults.should_fail():
+            return 503, {}
+        with self._lock:
+            # A retried batch that already went through is acknowledged but not counted twice
+            if idempotency_key not in self.idempotency_keys:
+                self.idempotency_keys.add(idempotency_key)
+                self.batches.append(payload)
+        return 200, {}
+
+    @property
+    def meals(self):
+        with self._lock:
+            return sum(e["meals"] for b in self.batches for e in b["entries"])
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,45 @@
+"""
+Shared fixtures. Storage is SQLite in a temp dir or the in-memory Firestore from
+loadtest.stubs; nothing here needs credentials, a model key or the network.
+
+    cd backend && python -m pytest -q
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import storage as storage_module  # noqa: E402
+from backend.storage import SQLiteStorage, set_storage  # noqa: E402
+
+
+@pytest.fixture
+def use_storage():
+    """Installs a storage as the process-wide one for the test and restores the previous one after."""
+    saved = (storage_module._storage, storage_module._storage_ready, storage_module._storage_injected)
+    yield set_storage
+    with storage_module._storage_lock:
+        storage_module._storage, storage_module._storage_ready, storage_module._storage_injected = saved
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path, use_storage):
+    storage = SQLiteStorage(str(tmp_path / "test.db"))
+    use_storage(storage)
+    return storage
+
+
+@pytest.fixture
+def client(sqlite_storage, tmp_path, monkeypatch):
+    """A TestClient for the app on a fresh SQLite database, without warm-up or background flushes."""
+    monkeypatch.setenv("WARMUP_ON_STARTUP", "0")
+    monkeypatch.setenv("USAGE_FLUSH_INTERVAL", "0")
+    monkeypatch.setenv("JOURNAL_DIR", str(tmp_path / "journal"))
+    from fastapi.testclient import TestClient
+    from backend import main
+    # Validators are per process; a tag served in an earlier test must not vouch for this database
+    main._validators.clear()
+    with TestClient(main.app) as client:
+        yield client
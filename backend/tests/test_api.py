@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend import changes, main
+
+NUTRITION = {"food_name": "Oatmeal", "calories": 300, "protein_g": 10.0, "carbs_g": 54.0, "fats_g": 5.0}
+
+
+class CountingStorage:
+    """Counts the reads made through the storage it wraps."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.reads = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.inner, name)
+        if not name.startswith("get_"):
+            return attr
+
+        def read(*args, **kwargs):
+            self.reads += 1
+            return attr(*args, **kwargs)
+        return read
+
+
+@pytest.fixture
+def counting(sqlite_storage, use_storage):
+    storage = CountingStorage(sqlite_storage)
+    use_storage(storage)
+    return storage
+
+
+def test_history_is_answered_304_without_a_read_until_it_changes(client, sqlite_storage, counting):
+    sqlite_storage.add_food_log("u1", NUTRITION, datetime(2026, 3, 1, 8))
+
+    first = client.get("/history/u1")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert etag.startswith('W/"')
+    assert first.headers["cache-control"] == "private, no-cache"
+    assert first.headers["last-modified"].endswith(" GMT")
+
+    unchanged = client.get("/history/u1", headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.content == b"" and unchanged.headers["etag"] == etag
+    assert counting.reads == 1
+
+    # A write this worker makes bumps the user's change counter, which sends the next request to storage
+    sqlite_storage.add_food_log("u1", dict(NUTRITION, food_name="Banana"), datetime(2026, 3, 1, 9))
+    changes.notify("u1", "food_logs")
+    changed = client.get("/history/u1", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()["history"][0]["food_name"] == "Banana"
+    assert counting.reads == 2
+
+
+def test_writes_from_elsewhere_show_up_once_the_validator_ages(client, sqlite_storage, monkeypatch):
+    sqlite_storage.add_food_log("u1", NUTRITION, datetime(2026, 3, 1, 8))
+    etag = client.get("/history/u1").headers["etag"]
+    # Another instance's write: no change notification here
+    sqlite_storage.add_food_log("u1", dict(NUTRITION, food_name="Banana"), datetime(2026, 3, 1, 9))
+    assert client.get("/history/u1", headers={"If-None-Match": etag}).status_code == 304
+
+    monkeypatch.setattr(main, "VALIDATOR_MAX_AGE", 0)
+    changed = client.get("/history/u1", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["history"][0]["food_name"] == "Banana"
+    # Unchanged data read again still gets its 304
+    assert client.get("/history/u1", headers={"If-None-Match": changed.headers["etag"]}).status_code == 304
+
+
+def test_if_modified_since(client, sqlite_storage, counting):
+    sqlite_storage.add_food_log("u1", NUTRITION, datetime(2026, 3, 1, 8))
+    changes.notify("u1", "food_logs")
+    first = client.get("/history/u1")
+    last_modified = first.headers["last-modified"]
+
+    assert client.get("/history/u1", headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get("/history/u1", headers={"If-Modified-Since": "Sat, 01 Jan 2000 00:00:00 GMT"}).status_code == 200
+    assert client.get("/history/u1", headers={"If-Modified-Since": "yesterday"}).status_code == 200
+    # If-None-Match wins over If-Modified-Since
+    assert client.get("/history/u1", headers={"If-None-Match": 'W/"other"', "If-Modified-Since": last_modified}).status_code == 200
+
+
+def test_chats_are_answered_304_until_they_change(client, sqlite_storage):
+    sqlite_storage.add_chat_messages("u1", [("user", "hi"), ("assistant", "hello")], datetime(2026, 3, 1, 8))
+    first = client.get("/chats/u1")
+    assert first.json()["history"] == [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    assert client.get("/chats/u1", headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+
+    sqlite_storage.add_chat_messages("u1", [("user", "again")], datetime(2026, 3, 1, 9))
+    changes.notify("u1", "chats")
+    assert client.get("/chats/u1", headers={"If-None-Match": first.headers["etag"]}).status_code == 200
+
+
+def test_history_fields_projection(client, sqlite_storage):
+    logged_at = datetime(2026, 3, 1, 8)
+    for i in range(3):
+        sqlite_storage.add_food_log("u1", dict(NUTRITION, calories=300 + i), logged_at + timedelta(hours=i))
+
+    response = client.get("/history/u1", params={"fields": "food_name,calories,nutrition.protein_g"})
+    assert response.status_code == 200
+    history = response.json()["history"]
+    assert history == [
+        {"food_name": "Oatmeal", "calories": 300 + i, "nutrition": {"protein_g": 10.0}} for i in (2, 1, 0)
+    ]
+
+    # Each projection has its own tag
+    full = client.get("/history/u1")
+    assert set(full.json()["history"][0]) >= {"food_name", "calories", "timestamp", "nutrition"}
+    assert full.headers["etag"] != response.headers["etag"]
+    assert client.get("/history/u1", params={"fields": "food_name,calories,nutrition.protein_g"},
+                      headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+
+def test_history_rejects_unknown_fields(client):
+    response = client.get("/history/u1", params={"fields": "food_name,password"})
+    assert response.status_code == 400
+    assert "password" in response.json()["detail"]
+
+
+def test_firestore_reads_only_the_requested_fields():
+    from backend.storage import FirestoreStorage
+    from loadtest.stubs import InMemoryFirestore
+
+    storage = FirestoreStorage(InMemoryFirestore())
+    storage.add_food_log("u1", NUTRITION, datetime(2026, 3, 1, 8))
+    [log] = storage.get_food_logs("u1", fields=("food_name", "nutrition.protein_g"))
+    assert log == {"food_name": "Oatmeal", "nutrition": {"protein_g": 10.0}}
+
+
+def test_json_responses_serialize_firestore_timestamps():
+    class DatetimeWithNanoseconds(datetime):
+        """Stands in for Firestore's timestamp type, a datetime subclass."""
+
+    body = main.FastJSONResponse(None).render({"at": DatetimeWithNanoseconds(2026, 3, 1, 8, 30), "n": {1: "one"}})
+    assert body == b'{"at":"2026-03-01T08:30:00","n":{"1":"one"}}'
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import pytest
+
+from ai_core import usage
+from ai_core.cassette import CassetteMiss, cassette
+
+
+@pytest.fixture
+def cassette_path(tmp_path, monkeypatch):
+    path = tmp_path / "calls.jsonl"
+    monkeypatch.setenv("AI_CASSETTE_PATH", str(path))
+    monkeypatch.setenv("AI_REPLAY_LATENCY", "zero")
+    return path
+
+
+def make_provider():
+    calls = []
+
+    @cassette("test.describe", file_args=("image_path",))
+    async def describe(image_path, detail="low"):
+        calls.append(image_path)
+        usage.record("gemini", "gemini-1.5-flash", 120, 30)
+        with open(image_path, "rb") as f:
+            return {"food_name": f.read().decode(), "detail": detail}
+
+    return describe, calls
+
+
+def pending_for(user_id):
+    return [row for row in usage.ledger.pending_rows() if row["user_id"] == user_id]
+
+
+def test_record_then_replay(cassette_path, tmp_path, monkeypatch):
+    describe, calls = make_provider()
+    recorded_image = tmp_path / "temp_abc.jpg"
+    recorded_image.write_bytes(b"Oatmeal")
+
+    monkeypatch.setenv("AI_CASSETTE_MODE", "record")
+    with usage.usage_scope("cassette-rec", "analyze"):
+        assert asyncio.run(describe(str(recorded_image))) == {"food_name": "Oatmeal", "detail": "low"}
+    entry = json.loads(cassette_path.read_text())
+    assert entry["call"] == "test.describe" and entry["usage"] == [["gemini", "gemini-1.5-flash", 120, 30]]
+
+    # Replay matches by file content, not the temp file's name, and never calls the provider
+    replayed_image = tmp_path / "temp_xyz.jpg"
+    replayed_image.write_bytes(b"Oatmeal")
+    monkeypatch.setenv("AI_CASSETTE_MODE", "replay")
+    with usage.usage_scope("cassette-replay", "analyze"):
+        assert asyncio.run(describe(str(replayed_image))) == {"food_name": "Oatmeal", "detail": "low"}
+    assert calls == [str(recorded_image)]
+
+    # The recorded usage is billed again, so reports look the same as live
+    [row] = pending_for("cassette-replay")
+    assert (row["calls"], row["input_tokens"], row["output_tokens"]) == (1, 120, 30)
+
+
+def test_replay_miss(cassette_path, tmp_path, monkeypatch):
+    describe, calls = make_provider()
+    image = tmp_path / "meal.jpg"
+    image.write_bytes(b"Salad")
+    monkeypatch.setenv("AI_CASSETTE_MODE", "replay")
+    with pytest.raises(CassetteMiss):
+        asyncio.run(describe(str(image), detail="high"))
+    assert calls == []
+
+
+def test_off_calls_the_provider_and_records_nothing(cassette_path, tmp_path, monkeypatch):
+    describe, calls = make_provider()
+    image = tmp_path / "meal.jpg"
+    image.write_bytes(b"Soup")
+    monkeypatch.setenv("AI_CASSETTE_MODE", "off")
+    assert asyncio.run(describe(str(image)))["food_name"] == "Soup"
+    assert len(calls) == 1
+    assert not cassette_path.exists()
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+from backend.migrate import migrate
+from backend.storage import FirestoreStorage
+from loadtest.stubs import InMemoryFirestore
+
+T0 = datetime(2026, 1, 1)
+
+
+def chunk_docs(db, user_id):
+    return [doc.to_dict() for doc in db.collection("users").document(user_id).collection("chat_chunks").stream()]
+
+
+def test_turns_fill_chunks_and_a_tail_read_stays_small():
+    db = InMemoryFirestore()
+    storage = FirestoreStorage(db, chat_storage="chunked", chat_chunk_size=4)
+    for i in range(5):
+        storage.add_chat_messages("u1", [("user", f"q{i}"), ("assistant", f"a{i}")], T0 + timedelta(minutes=i))
+
+    assert [len(doc["turns"]) for doc in chunk_docs(db, "u1")] == [4, 4, 2]
+    assert [turn["content"] for turn in storage.get_chats("u1")][:4] == ["q0", "a0", "q1", "a1"]
+
+    before = db.docs_read
+    assert [turn["content"] for turn in storage.get_chats("u1", limit=3)] == ["a3", "q4", "a4"]
+    # The tail lives in the last two chunks
+    assert db.docs_read - before == 2
+
+
+def test_a_replayed_append_adds_nothing():
+    db = InMemoryFirestore()
+    storage = FirestoreStorage(db, chat_storage="chunked", chat_chunk_size=3)
+    messages = [("user", "hi"), ("assistant", "hello")]
+    storage.add_chat_messages("u1", messages, T0)
+    # A journal replay of a write that did land repeats the send time, so the turn ids match
+    storage.add_chat_messages("u1", messages, T0)
+
+    assert [turn["content"] for turn in storage.get_chats("u1")] == ["hi", "hello"]
+    assert storage.chat_turn_ids("u1") == {f"{T0.isoformat()}#0", f"{T0.isoformat()}#1"}
+
+
+def test_chat_chunks_rerun_adds_nothing(tmp_path):
+    db = InMemoryFirestore()
+    chats = db.collection("chats")
+    # Identical messages in the same second are still separate turns
+    for i in range(5):
+        chats.document(f"c{i}").set({"user_id": "u0", "role": "user", "content": "ok", "timestamp": T0})
+    state_path = str(tmp_path / "state.json")
+
+    for restart in (False, True):
+        migrate(db, ["chat_chunks"], batch_size=2, state_path=state_path, restart=restart, verbose=False, chunk_size=3)
+        stored = [turn for doc in db.collection("users").document("u0").collection("chat_chunks").stream()
+                  for turn in doc.to_dict()["turns"]]
+        assert sorted(turn["id"] for turn in stored) == [f"c{i}" for i in range(5)]
+
+    chunked = FirestoreStorage(db, chat_storage="chunked", chat_chunk_size=3)
+    assert [turn["content"] for turn in chunked.get_chats("u0")] == ["ok"] * 5
+
+
+def test_chat_chunks_from_the_per_user_layout(tmp_path):
+    db = InMemoryFirestore()
+    for user in ("u0", "u1"):
+        chats = db.collection("users").document(user).collection("chats")
+        for i in range(3):
+            chats.document(f"{user}-{i}").set({"user_id": user, "role": "user", "content": f"m{i}", "timestamp": T0 + timedelta(seconds=i)})
+
+    state = migrate(db, ["chat_chunks"], batch_size=2, state_path=str(tmp_path / "state.json"), verbose=False,
+                    chunk_size=2, layout="per_user")
+    assert state["chat_chunks"]["copied"] == 6
+    assert set(state["chat_chunks"]["cursors"]) == {"u0", "u1"}
+    chunked = FirestoreStorage(db, layout="per_user", chat_storage="chunked", chat_chunk_size=2)
+    assert [turn["content"] for turn in chunked.get_chats("u1")] == ["m0", "m1", "m2"]
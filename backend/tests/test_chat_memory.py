@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from ai_core.gemini_client import UNAVAILABLE_REPLY
+from backend import chat_memory
+from backend.chat_memory import format_memory, load_memory, schedule_refresh
+
+START = datetime(2026, 3, 1, 8)
+
+
+@pytest.fixture(autouse=True)
+def small_window(monkeypatch):
+    # One verbatim exchange (2 messages); folds of up to 4 messages
+    monkeypatch.setattr(chat_memory, "TURNS", 1)
+    monkeypatch.setattr(chat_memory, "FOLD_MAX_MESSAGES", 4)
+
+
+def chat(storage, user_id, exchanges, first=0):
+    for i in range(first, first + exchanges):
+        storage.add_chat_messages(user_id, [("user", f"question {i}"), ("assistant", f"answer {i}")], START + timedelta(minutes=i))
+
+
+class FakeModel:
+    def __init__(self, reply="Wants more protein"):
+        self.reply = reply
+        self.prompts = []
+
+    async def __call__(self, prompt):
+        self.prompts.append(prompt)
+        return self.reply
+
+
+def test_load_and_format_memory(sqlite_storage):
+    assert format_memory(*load_memory(sqlite_storage, "u1")) == ""
+
+    chat(sqlite_storage, "u1", 3)
+    sqlite_storage.set_chat_summary("u1", {"summary": "Vegetarian", "covered_until": START, "messages": 2})
+    summary, recent = load_memory(sqlite_storage, "u1")
+    assert summary == "Vegetarian"
+    assert [m["content"] for m in recent] == ["question 2", "answer 2"]
+    assert format_memory(summary, recent) == (
+        "Summary of the earlier conversation: Vegetarian\n"
+        "Most recent messages:\nUser: question 2\nNutriChat: answer 2"
+    )
+
+
+def test_refresh_folds_messages_that_left_the_window(sqlite_storage):
+    model = FakeModel()
+    chat(sqlite_storage, "u1", 3)
+    asyncio.run(chat_memory._refresh("u1", model))
+
+    [prompt] = model.prompts
+    assert "(none yet)" in prompt
+    assert "question 0" in prompt and "answer 1" in prompt and "question 2" not in prompt
+    record = sqlite_storage.get_chat_summary("u1")
+    assert record["summary"] == "Wants more protein" and record["messages"] == 4
+    assert record["covered_until"] == START + timedelta(minutes=1, microseconds=1)
+
+    # Nothing new has left the window: no model call
+    asyncio.run(chat_memory._refresh("u1", model))
+    assert len(model.prompts) == 1
+
+    # The next fold starts from the stored summary and only adds what is new
+    chat(sqlite_storage, "u1", 1, first=3)
+    model.reply = "Wants more protein; asked about oats"
+    asyncio.run(chat_memory._refresh("u1", model))
+    prompt = model.prompts[-1]
+    assert "Wants more protein" in prompt and "question 2" in prompt and "question 1" not in prompt
+    assert sqlite_storage.get_chat_summary("u1")["messages"] == 6
+
+
+def test_a_long_history_is_folded_from_its_recent_end(sqlite_storage):
+    model = FakeModel()
+    chat(sqlite_storage, "u1", 10)
+    asyncio.run(chat_memory._refresh("u1", model))
+    assert "question 7" in model.prompts[0] and "question 6" not in model.prompts[0]
+    assert sqlite_storage.get_chat_summary("u1")["messages"] == 4
+
+
+def test_an_unavailable_model_leaves_the_summary_alone(sqlite_storage):
+    chat(sqlite_storage, "u1", 3)
+    asyncio.run(chat_memory._refresh("u1", FakeModel(UNAVAILABLE_REPLY)))
+    assert sqlite_storage.get_chat_summary("u1") is None
+
+
+def test_one_refresh_per_user_at_a_time(sqlite_storage):
+    model = FakeModel()
+    chat(sqlite_storage, "u1", 3)
+
+    async def run():
+        schedule_refresh("u1", model)
+        schedule_refresh("u1", model)
+        await asyncio.gather(*chat_memory._tasks)
+
+    asyncio.run(run())
+    assert len(model.prompts) == 1
+    assert "u1" not in chat_memory._refreshing
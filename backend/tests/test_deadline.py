@@ -0,0 +1,102 @@
+import asyncio
+import gc
+import time
+import warnings
+
+import pytest
+
+from ai_core.deadline import DeadlineExceeded, attempt_timeout, current_deadline, deadline, run_with_deadline
+
+
+def test_a_nested_deadline_never_extends_the_outer_one():
+    with deadline(0.5, "chat") as outer:
+        with deadline(10, "generate_text") as inner:
+            assert inner is outer
+        with deadline(0.1, "storage") as inner:
+            assert inner is not outer and inner.remaining() <= 0.1
+            assert current_deadline() is inner
+        assert current_deadline() is outer
+    assert current_deadline() is None
+
+
+def test_attempt_timeout():
+    assert attempt_timeout("warm_up") is None
+    assert attempt_timeout("warm_up", cap=3) == 3
+    with deadline(5, "analyze"):
+        assert 4 < attempt_timeout("gemini") <= 5
+        assert attempt_timeout("gemini", cap=2) == 2
+    with deadline(0, "analyze"):
+        with pytest.raises(DeadlineExceeded) as exc:
+            attempt_timeout("gemini")
+    assert exc.value.operation == "gemini" and exc.value.budget == 0
+
+
+def test_hitting_only_the_attempt_cap_raises_timeout_error():
+    async def run():
+        with deadline(5, "analyze"):
+            await run_with_deadline(asyncio.sleep(1), "gemini-1.5-flash", cap=0.05)
+
+    # Plain TimeoutError, so the caller moves on to its next model
+    with pytest.raises(TimeoutError) as exc:
+        asyncio.run(run())
+    assert not isinstance(exc.value, DeadlineExceeded)
+
+
+def test_spending_the_budget_raises_deadline_exceeded():
+    async def run():
+        with deadline(0.05, "chat"):
+            await run_with_deadline(asyncio.sleep(1), "generate_text", cap=5)
+
+    with pytest.raises(DeadlineExceeded) as exc:
+        asyncio.run(run())
+    assert exc.value.operation == "generate_text"
+
+
+def test_a_spent_budget_stops_the_next_attempt_before_it_starts():
+    started = []
+
+    async def attempt():
+        started.append(True)
+
+    async def run():
+        with deadline(0.01, "analyze"):
+            await asyncio.sleep(0.02)
+            with pytest.raises(DeadlineExceeded):
+                await run_with_deadline(attempt(), "gemini-1.5-pro")
+
+    # The attempt is closed rather than left un-awaited
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        asyncio.run(run())
+        gc.collect()
+    assert started == []
+
+
+def test_the_deadline_reaches_threads_and_tasks():
+    async def in_task():
+        return current_deadline()
+
+    async def run():
+        with deadline(5, "history") as d:
+            return d, await asyncio.to_thread(current_deadline), await asyncio.create_task(in_task())
+
+    d, in_thread, in_task = asyncio.run(run())
+    assert in_thread is d and in_task is d
+
+
+def test_a_slow_storage_read_answers_504(client, sqlite_storage, use_storage, monkeypatch):
+    from backend import main
+
+    class SlowStorage:
+        def __getattr__(self, name):
+            return getattr(sqlite_storage, name)
+
+        def get_food_logs(self, *args, **kwargs):
+            time.sleep(0.3)
+            return sqlite_storage.get_food_logs(*args, **kwargs)
+
+    use_storage(SlowStorage())
+    monkeypatch.setitem(main.DEADLINES, "history", 0.05)
+    response = client.get("/history/u1")
+    assert response.status_code == 504
+    assert "storage.get_food_logs" in response.json()["detail"]
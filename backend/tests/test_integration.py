@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from backend.integration import FitnessSyncQueue
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSession:
+    """Answers POSTs from a script of responses; the last one repeats."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.posts = []
+        self.posted = threading.Event()
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.posts.append({"json": json, "key": headers["Idempotency-Key"]})
+        self.posted.set()
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+
+@pytest.fixture
+def make_queue():
+    queues = []
+
+    def make(session, **kwargs):
+        kwargs = {"flush_window": 3600, "base_backoff": 0.01, "max_backoff": 0.05, **kwargs}
+        queue = FitnessSyncQueue(url="https://fitness.test/v1/sync", **kwargs)
+        queue._session = session
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.close()
+
+
+def test_meals_are_summed_per_user_and_sent_in_batches(make_queue):
+    session = FakeSession(FakeResponse(200))
+    queue = make_queue(session, batch_size=2)
+    queue.enqueue("u1", 300, 10)
+    queue.enqueue("u2", 500, 20)
+    assert queue.enqueue("u1", 200, 5) == 2
+    queue.enqueue("u3", 100, 1)
+
+    assert queue.flush() == 4
+    assert [len(post["json"]["entries"]) for post in session.posts] == [2, 1]
+    u1 = session.posts[0]["json"]["entries"][0]
+    assert (u1["user_id"], u1["meals"], u1["metrics"]["calories_consumed"], u1["metrics"]["protein_g"]) == ("u1", 2, 500.0, 15.0)
+    assert session.posts[0]["key"] != session.posts[1]["key"]
+    assert queue.stats()["sent_meals"] == 4 and queue.stats()["pending_meals"] == 0
+
+
+def test_retry_after_is_honoured_up_to_the_backoff_cap(make_queue):
+    session = FakeSession(FakeResponse(429, {"Retry-After": "3600"}), FakeResponse(200))
+    queue = make_queue(session)
+    queue.enqueue("u1", 300, 10)
+
+    started = time.monotonic()
+    assert queue.flush() == 1
+    assert time.monotonic() - started < 1
+    # A retry is the same batch under the same key
+    assert len(session.posts) == 2 and session.posts[0]["key"] == session.posts[1]["key"]
+
+
+def test_rejected_batches_are_dropped_without_retrying(make_queue):
+    session = FakeSession(FakeResponse(400))
+    queue = make_queue(session)
+    queue.enqueue("u1", 300, 10)
+
+    assert queue.flush() == 0
+    stats = queue.stats()
+    assert len(session.posts) == 1
+    assert (stats["dropped_meals"], stats["held_batches"], stats["last_error"]) == (1, 0, "HTTP 400")
+
+
+def test_failed_batches_are_held_and_resent_with_their_key(make_queue):
+    session = FakeSession(FakeResponse(503), FakeResponse(503), FakeResponse(200))
+    queue = make_queue(session, max_retries=1)
+    queue.enqueue("u1", 300, 10)
+
+    assert queue.flush() == 0
+    assert queue.stats()["held_meals"] == 1
+    assert queue.flush() == 1
+    assert len({post["key"] for post in session.posts}) == 1
+    assert queue.stats()["held_batches"] == 0
+
+
+def test_close_cuts_a_backoff_short_for_the_final_flush(make_queue):
+    session = FakeSession(FakeResponse(503, {"Retry-After": "60"}))
+    queue = make_queue(session, max_backoff=60)
+    queue.enqueue("u1", 300, 10)
+    queue._wake.set()
+    assert session.posted.wait(5)
+
+    started = time.monotonic()
+    queue.close(timeout=5)
+    assert time.monotonic() - started < 2
+    assert not queue._thread.is_alive()
+    # The interrupted batch got its one last attempt
+    assert len(session.posts) == 2
@@ -0,0 +1,113 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from backend import jobs
+from backend.jobs import JobRunner, MemoryJobStore, SQLiteJobStore
+
+
+@pytest.fixture
+def job_store(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"), lease_seconds=0.2, heartbeat_seconds=3600)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def runner(job_store, monkeypatch):
+    runner = JobRunner(job_store, workers=2)
+    monkeypatch.setattr(jobs, "_runner", runner)
+    return runner
+
+
+def insert_foreign_job(path, owner, heartbeat_at):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, user_id, status, created_at, updated_at, owner, heartbeat_at) "
+            "VALUES (?, 'analyze', 'u1', 'running', ?, ?, ?, ?)",
+            (owner, heartbeat_at, heartbeat_at, owner, heartbeat_at),
+        )
+    conn.close()
+
+
+def test_async_job_lifecycle(runner):
+    async def analyze(name):
+        return {"food_name": name}
+
+    async def rejected():
+        raise HTTPException(status_code=422, detail="Not a food photo")
+
+    async def run():
+        done_id = runner.submit("analyze", "u1", analyze, "Oatmeal")
+        failed_id = runner.submit("analyze", "u1", rejected)
+        assert runner.store.get(done_id)["status"] in ("queued", "running")
+        await asyncio.gather(*[t for t in asyncio.all_tasks() if t is not asyncio.current_task()])
+        return done_id, failed_id
+
+    done_id, failed_id = asyncio.run(run())
+    done = runner.store.get(done_id)
+    assert (done["status"], done["result"]) == ("done", {"food_name": "Oatmeal"})
+    failed = runner.store.get(failed_id)
+    assert (failed["status"], failed["error"], failed["error_status"]) == ("failed", "Not a food photo", 422)
+
+
+def test_jobs_whose_lease_lapsed_are_failed_at_startup(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    SQLiteJobStore(path).close()
+    # Same host and possibly a reused pid: only the lease decides
+    insert_foreign_job(path, "dead", time.time() - 60)
+    insert_foreign_job(path, "alive", time.time())
+
+    store = SQLiteJobStore(path, lease_seconds=30)
+    try:
+        dead, alive = store.get("dead"), store.get("alive")
+        assert (dead["status"], dead["error_status"]) == ("failed", 503)
+        assert alive["status"] == "running"
+    finally:
+        store.close()
+
+
+def test_heartbeat_keeps_own_jobs_and_fails_lapsed_ones(job_store):
+    own = job_store.create("analyze", "u1")
+    job_store.update(own, status="running")
+    insert_foreign_job(job_store.path, "replaced-instance", time.time())
+
+    time.sleep(0.3)
+    assert job_store.maintain() == 1
+    assert job_store.get(own)["status"] == "running"
+    assert job_store.get("replaced-instance")["status"] == "failed"
+
+
+def test_finished_jobs_expire_after_the_ttl(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"), ttl=0.1, heartbeat_seconds=3600)
+    try:
+        job_id = store.create("analyze", "u1")
+        store.update(job_id, status="done", result={})
+        time.sleep(0.2)
+        store.maintain()
+        assert store.get(job_id) is None
+    finally:
+        store.close()
+
+
+def test_memory_store_expires_finished_jobs():
+    store = MemoryJobStore(ttl=0)
+    job_id = store.create("analyze", "u1")
+    store.update(job_id, status="failed")
+    store.create("analyze", "u1")
+    assert store.get(job_id) is None
+
+
+def test_job_endpoints(client, runner):
+    job_id = runner.store.create("analyze", "u1")
+    runner.store.update(job_id, status="done", result={"food_name": "Soup"})
+
+    assert client.get(f"/jobs/{job_id}").json()["result"] == {"food_name": "Soup"}
+    assert client.get("/jobs/missing").status_code == 404
+    # The stream reports the finished state and ends instead of polling forever
+    body = client.get(f"/jobs/{job_id}/events").text
+    assert body.startswith("event: done\n") and '"Soup"' in body
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from backend import journal as journal_module
+from backend.journal import JournalError, WriteJournal, _encode
+
+NUTRITION = {"food_name": "Apple", "calories": 95, "protein_g": 0.5, "carbs_g": 25, "fats_g": 0.3}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class FlakyStorage:
+    """Wraps a storage; writes fail while `down` is set."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.down = True
+
+    def __getattr__(self, name):
+        attr = getattr(self.inner, name)
+        if name.startswith("add_") and self.down:
+            def fail(*args, **kwargs):
+                raise RuntimeError("storage unavailable")
+            return fail
+        return attr
+
+
+@pytest.fixture
+def journal_dir(tmp_path):
+    return str(tmp_path / "journal")
+
+
+def test_replays_journaled_writes_once_storage_recovers(sqlite_storage, use_storage, journal_dir):
+    flaky = FlakyStorage(sqlite_storage)
+    use_storage(flaky)
+    journal = WriteJournal(journal_dir, fsync_window=0.001, base_backoff=0.05, max_backoff=0.1)
+    try:
+        logged_at = datetime(2026, 3, 1, 8, 30)
+        journal.append("add_food_log", "u1", {"nutrition": NUTRITION, "timestamp": logged_at})
+        journal.append("add_chat_messages", "u1", {"messages": [["user", "hi"], ["assistant", "hello"]], "timestamp": logged_at})
+        assert wait_for(lambda: journal.last_error is not None)
+        assert journal.stats()["depth"] == 2
+
+        flaky.down = False
+        assert wait_for(lambda: journal.stats()["depth"] == 0)
+        logs = sqlite_storage.get_food_logs("u1")
+        assert [(log["food_name"], log["timestamp"]) for log in logs] == [("Apple", logged_at)]
+        assert [chat["content"] for chat in sqlite_storage.get_chats("u1")] == ["hi", "hello"]
+        assert journal.replayed == 2
+        # Everything replayed: the journal is compacted
+        assert wait_for(lambda: os.path.getsize(journal.path) == 0)
+    finally:
+        journal.close()
+
+
+def test_adopts_and_drains_journals_left_by_dead_processes(sqlite_storage, journal_dir):
+    os.makedirs(journal_dir)
+    orphan = os.path.join(journal_dir, "old-host-99999.jsonl")
+    with open(orphan, "w") as f:
+        for i in range(3):
+            entry = {"id": f"e{i}", "op": "add_food_log", "user_id": "u2", "enqueued_at": time.time(),
+                     "payload": {"nutrition": dict(NUTRITION, food_name=f"Meal {i}"), "timestamp": datetime(2026, 3, 1, i)}}
+            f.write(json.dumps(entry, default=_encode) + "\n")
+
+    journal = WriteJournal(journal_dir, fsync_window=0.001)
+    try:
+        assert wait_for(lambda: not os.path.exists(orphan))
+        assert [log["food_name"] for log in sqlite_storage.get_food_logs("u2")] == ["Meal 2", "Meal 1", "Meal 0"]
+        assert journal.replayed == 3
+    finally:
+        journal.close()
+
+
+def test_resumes_an_adopted_journal_from_its_checkpoint(sqlite_storage, journal_dir):
+    os.makedirs(journal_dir)
+    orphan = os.path.join(journal_dir, "old-host-99998.jsonl")
+    lines = [
+        json.dumps({"id": f"e{i}", "op": "add_food_log", "user_id": "u3", "enqueued_at": time.time(),
+                    "payload": {"nutrition": dict(NUTRITION, food_name=f"Meal {i}"), "timestamp": datetime(2026, 3, 1, i)}},
+                   default=_encode) + "\n"
+        for i in range(3)
+    ]
+    with open(orphan, "w") as f:
+        f.writelines(lines)
+    # The first entry was replayed before that process died
+    with open(orphan + ".offset", "w") as f:
+        f.write(str(len(lines[0].encode())))
+
+    journal = WriteJournal(journal_dir, fsync_window=0.001)
+    try:
+        assert wait_for(lambda: not os.path.exists(orphan))
+        assert [log["food_name"] for log in sqlite_storage.get_food_logs("u3")] == ["Meal 2", "Meal 1"]
+    finally:
+        journal.close()
+
+
+def test_a_restart_with_the_same_pid_replays_its_predecessors_writes(sqlite_storage, use_storage, journal_dir):
+    flaky = FlakyStorage(sqlite_storage)
+    use_storage(flaky)
+    first = WriteJournal(journal_dir, fsync_window=0.001, base_backoff=10, max_backoff=10)
+    first.append("add_food_log", "u4", {"nutrition": NUTRITION, "timestamp": datetime(2026, 3, 1, 8)})
+    first.append("add_food_log", "u4", {"nutrition": dict(NUTRITION, food_name="Pear"), "timestamp": datetime(2026, 3, 1, 9)})
+    first.close()
+
+    # Same process, so the same pid: the new journal must not take over the old file as its own
+    second = WriteJournal(journal_dir, fsync_window=0.001, base_backoff=0.05, max_backoff=0.1)
+    try:
+        assert second.path != first.path
+        assert wait_for(lambda: second.stats()["depth"] == 2)
+        flaky.down = False
+        assert wait_for(lambda: second.stats()["depth"] == 0)
+        assert [log["food_name"] for log in sqlite_storage.get_food_logs("u4")] == ["Pear", "Apple"]
+        assert not os.path.exists(first.path)
+    finally:
+        second.close()
+
+
+def test_a_timed_out_append_is_not_written(sqlite_storage, journal_dir, monkeypatch):
+    monkeypatch.setattr(journal_module, "APPEND_TIMEOUT", 0.05)
+    journal = WriteJournal(journal_dir, fsync_window=0.3)
+    try:
+        with pytest.raises(JournalError):
+            journal.append("add_food_log", "u5", {"nutrition": NUTRITION, "timestamp": datetime(2026, 3, 1, 8)})
+        with pytest.raises(JournalError):
+            asyncio.run(journal.append_async("add_food_log", "u5", {"nutrition": NUTRITION, "timestamp": datetime(2026, 3, 1, 9)}))
+        time.sleep(0.5)
+        # The caller was told these failed, so its retry is the only copy
+        assert os.path.getsize(journal.path) == 0
+        assert journal.stats()["depth"] == 0
+        assert sqlite_storage.get_food_logs("u5") == []
+    finally:
+        journal.close()
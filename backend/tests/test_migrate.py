@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.migrate import load_state, migrate, migrate_collection, save_state
+from backend.storage import FirestoreStorage
+from loadtest.stubs import InMemoryFirestore
+
+T0 = datetime(2026, 1, 1)
+
+
+def seed_food_logs(db, count, start=0):
+    logs = db.collection("food_logs")
+    for i in range(start, start + count):
+        logs.document(f"log{i:03d}").set({
+            "user_id": f"u{i % 2}", "food_name": f"Meal {i}", "calories": 100 + i,
+            "timestamp": T0 + timedelta(minutes=i), "nutrition": {"calories": 100 + i},
+        })
+
+
+def migrated(db, collection="food_logs"):
+    return sorted(
+        snapshot.id
+        for user in ("u0", "u1")
+        for snapshot in db.collection("users").document(user).collection(collection).stream()
+    )
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_resumes_from_the_saved_cursor(tmp_path):
+    db = InMemoryFirestore()
+    seed_food_logs(db, 7)
+    db.collection("food_logs").document("orphan").set({"food_name": "No user", "timestamp": T0 + timedelta(minutes=3, seconds=30)})
+    state_path = str(tmp_path / "state.json")
+
+    # First run stops after its first page, as a crash would
+    state = {}
+
+    def crash_after_first_page(name, progress):
+        save_state(state_path, state)
+        raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        migrate_collection(db, "food_logs", state, batch_size=3, on_page=crash_after_first_page)
+    assert load_state(state_path)["food_logs"]["cursor"] == {"timestamp": (T0 + timedelta(minutes=2)).isoformat(), "id": "log002"}
+    assert migrated(db) == ["log000", "log001", "log002"]
+
+    # The next run continues after the cursor instead of starting over
+    state = migrate(db, ["food_logs"], batch_size=3, state_path=state_path, verbose=False)
+    assert state["food_logs"]["copied"] == 7
+    assert state["food_logs"]["skipped"] == 1
+    assert migrated(db) == [f"log{i:03d}" for i in range(7)]
+
+    # A later run copies only what was written since
+    seed_food_logs(db, 2, start=7)
+    state = migrate(db, ["food_logs"], batch_size=3, state_path=state_path, verbose=False)
+    assert state["food_logs"]["copied"] == 9
+    assert len(migrated(db)) == 9
+
+
+def test_dry_run_writes_nothing(tmp_path):
+    db = InMemoryFirestore()
+    seed_food_logs(db, 4)
+    state_path = tmp_path / "state.json"
+    state = migrate(db, ["food_logs"], batch_size=3, state_path=str(state_path), dry_run=True, verbose=False)
+    assert state["food_logs"]["copied"] == 4
+    assert migrated(db) == []
+    assert not state_path.exists()
+
+
+def test_per_user_layout_needs_no_composite_index():
+    db = InMemoryFirestore(require_indexes=True)
+    storage = FirestoreStorage(db, layout="per_user")
+    for i in range(3):
+        storage.add_food_log("u1", {"food_name": f"Meal {i}", "calories": 100 + i}, T0 + timedelta(hours=i))
+    storage.add_food_log("u2", {"food_name": "Other user", "calories": 1}, T0)
+    storage.add_chat_messages("u1", [("user", "hi"), ("assistant", "hello")], T0)
+
+    assert [log["food_name"] for log in storage.get_food_logs("u1", limit=2)] == ["Meal 2", "Meal 1"]
+    assert [chat["content"] for chat in storage.get_chats("u1", limit=1)] == ["hello"]
+    assert len(list(db.collection("users").document("u1").collection("food_logs").stream())) == 3
+    assert storage.missing_indexes() == []
@@ -0,0 +1,96 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.query_planner import QueryPlanner, is_missing_index, newest
+from backend.storage import FirestoreStorage
+from loadtest.stubs import Faults, InjectedFirestoreError, InMemoryFirestore
+
+SHAPE = "food_logs: user_id ==, order by timestamp desc"
+
+
+def seeded_storage(require_indexes):
+    db = InMemoryFirestore(require_indexes=require_indexes)
+    storage = FirestoreStorage(db)
+    start = datetime(2026, 3, 1)
+    # Written out of order, and mixed with another user's logs
+    for i in (3, 0, 4, 1, 2):
+        for user in ("u1", "u2"):
+            storage.add_food_log(user, {"food_name": f"{user} meal {i}", "calories": 100 * i, "protein_g": i},
+                                 start + timedelta(hours=i))
+    return db, storage
+
+
+def test_missing_index_falls_back_to_the_same_answer():
+    _, indexed = seeded_storage(require_indexes=False)
+    db, fallback = seeded_storage(require_indexes=True)
+
+    expected = indexed.get_food_logs("u1", limit=3)
+    assert [log["food_name"] for log in expected] == ["u1 meal 4", "u1 meal 3", "u1 meal 2"]
+    assert fallback.get_food_logs("u1", limit=3) == expected
+    assert [entry["query"] for entry in fallback.missing_indexes()] == [SHAPE]
+
+    # Known missing: later requests go straight to the fallback (one RPC, no failed probe)
+    before = db.rpc_count
+    assert fallback.get_food_logs("u2", limit=2, fields=("food_name",)) == [{"food_name": "u2 meal 4"}, {"food_name": "u2 meal 3"}]
+    assert db.rpc_count == before + 1
+    assert fallback.missing_indexes()[0]["fallbacks"] == 2
+
+
+def test_index_is_picked_up_on_the_next_probe():
+    db, storage = seeded_storage(require_indexes=True)
+    storage.get_food_logs("u1")
+    assert storage.missing_indexes()
+
+    db.require_indexes = False  # the index finished building
+    storage.planner._missing[SHAPE]["probe_at"] = 0
+    assert [log["food_name"] for log in storage.get_food_logs("u1", limit=1)] == ["u1 meal 4"]
+    assert storage.missing_indexes() == []
+
+
+def test_other_errors_are_not_treated_as_a_missing_index():
+    db = InMemoryFirestore(faults=Faults(error_rate=1.0), require_indexes=True)
+    with pytest.raises(InjectedFirestoreError):
+        FirestoreStorage(db).get_food_logs("u1")
+
+
+def test_only_one_request_claims_a_reprobe():
+    planner = QueryPlanner(reprobe_seconds=3600)
+    probes = []
+    barrier = threading.Barrier(2)
+
+    def indexed():
+        probes.append(threading.current_thread().name)
+        # The probe is slow, so the other request arrives while it is in flight
+        time.sleep(0.1)
+        raise RuntimeError("400 The query requires an index. You can create it here: https://...")
+
+    def fallback():
+        return "fallback"
+
+    assert planner.run("q", indexed, fallback) == "fallback"
+    probes.clear()
+    planner._missing["q"]["probe_at"] = 0  # REPROBE_SECONDS have passed
+
+    results = []
+
+    def request():
+        barrier.wait()
+        results.append(planner.run("q", indexed, fallback))
+
+    threads = [threading.Thread(target=request, name=f"request-{i}") for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["fallback", "fallback"]
+    assert len(probes) == 1
+    assert planner.missing()[0]["next_probe_in_s"] > 3500
+    assert is_missing_index(RuntimeError("The query requires an index"))
+
+
+def test_newest_sorts_missing_timestamps_last():
+    docs = [{"timestamp": 2}, {"timestamp": None}, {"timestamp": 5}, {}]
+    assert newest(docs, 3) == [{"timestamp": 5}, {"timestamp": 2}, {"timestamp": None}]
@@ -0,0 +1,88 @@
+from datetime import date, datetime
+
+import pytest
+
+from backend import changes, stats
+from backend.stats import compute_stats, load_stats, parse_range
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    stats._cache.clear()
+    yield
+    stats._cache.clear()
+
+
+def meal(storage, user_id, when, name, calories, protein=10.0):
+    storage.add_food_log(user_id, {"food_name": name, "calories": calories, "protein_g": protein, "carbs_g": 20.0, "fats_g": 5.0}, when)
+
+
+def test_parse_range():
+    assert parse_range("2026-03-01", "2026-03-07", "week") == (date(2026, 3, 1), date(2026, 3, 7), "week")
+    start, end, _ = parse_range()
+    assert end == date.today() and (end - start).days == stats.DEFAULT_DAYS - 1
+    for args, message in [
+        (("2026-03-01", "2026-03-07", "month"), "granularity"),
+        (("03/01/2026", None), "YYYY-MM-DD"),
+        (("2026-03-08", "2026-03-07"), "after"),
+        (("2025-01-01", "2026-03-07"), "366"),
+    ]:
+        with pytest.raises(ValueError, match=message):
+            parse_range(*args)
+
+
+def test_daily_series_are_zero_filled_bincounts():
+    rows = [
+        (datetime(2026, 3, 1, 8), "Oatmeal", 300.0, 10.0, 50.0, 5.0),
+        (datetime(2026, 3, 1, 13), "Salad", 250.0, None, 20.0, 10.0),
+        (datetime(2026, 3, 3, 19), "Oatmeal", 320.0, 11.0, 52.0, 6.0),
+        (datetime(2026, 3, 9, 8), "Out of range", 999.0, 0.0, 0.0, 0.0),
+    ]
+    result = compute_stats(rows, date(2026, 3, 1), date(2026, 3, 3), "day")
+    series = result["series"]
+    assert series["period"] == ["2026-03-01", "2026-03-02", "2026-03-03"]
+    assert series["meals"] == [2, 0, 1]
+    assert series["calories"] == [550.0, 0.0, 320.0]
+    assert series["protein_g"] == [10.0, 0.0, 11.0]
+    assert result["totals"] == {"meals": 3, "calories": 870.0, "protein_g": 21.0, "carbs_g": 122.0, "fats_g": 21.0, "avg_calories_per_meal": 290}
+    assert result["top_foods"] == {"food_name": ["Oatmeal", "Salad"], "count": [2, 1], "calories": [620.0, 250.0]}
+
+
+def test_weekly_buckets_start_on_monday():
+    rows = [(datetime(2026, 3, 4), "Soup", 200.0, 5.0, 20.0, 5.0), (datetime(2026, 3, 10), "Soup", 210.0, 5.0, 20.0, 5.0)]
+    result = compute_stats(rows, date(2026, 3, 4), date(2026, 3, 12), "week")
+    assert result["series"]["period"] == ["2026-03-02", "2026-03-09"]
+    assert result["series"]["meals"] == [1, 1]
+
+
+def test_an_empty_range():
+    result = compute_stats([], date(2026, 3, 1), date(2026, 3, 2), "day")
+    assert result["series"]["calories"] == [0.0, 0.0]
+    assert result["totals"]["meals"] == 0 and result["top_foods"]["food_name"] == []
+
+
+def test_stats_are_cached_until_the_user_logs_a_meal(sqlite_storage):
+    meal(sqlite_storage, "u1", datetime(2026, 3, 1, 8), "Oatmeal", 300)
+    first = load_stats(sqlite_storage, "u1", date(2026, 3, 1), date(2026, 3, 2), "day")
+    meal(sqlite_storage, "u1", datetime(2026, 3, 2, 8), "Eggs", 200)
+    # Cached: the write was not announced
+    assert load_stats(sqlite_storage, "u1", date(2026, 3, 1), date(2026, 3, 2), "day") is first
+
+    changes.notify("u2", "food_logs")
+    changes.notify("u1", "chats")
+    assert load_stats(sqlite_storage, "u1", date(2026, 3, 1), date(2026, 3, 2), "day") is first
+
+    changes.notify("u1", "food_logs")
+    assert load_stats(sqlite_storage, "u1", date(2026, 3, 1), date(2026, 3, 2), "day")["totals"]["meals"] == 2
+
+
+def test_stats_endpoint(client, sqlite_storage):
+    meal(sqlite_storage, "u1", datetime(2026, 3, 1, 8), "Oatmeal", 300)
+    response = client.get("/stats/u1", params={"from": "2026-03-01", "to": "2026-03-07", "granularity": "week"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["user_id"] == "u1" and body["series"]["period"] == ["2026-02-23", "2026-03-02"]
+    assert body["series"]["calories"] == [300.0, 0.0]
+
+    response = client.get("/stats/u1", params={"granularity": "month"})
+    assert response.status_code == 400 and "granularity" in response.json()["detail"]
@@ -0,0 +1,18 @@
+import pytest
+
+from backend.storage import FirestoreStorage, SQLiteStorage, Storage
+from loadtest.stubs import InMemoryFirestore
+
+
+def test_a_backend_missing_a_method_fails_when_created():
+    class Partial(Storage):
+        def add_food_log(self, user_id, nutrition, timestamp=None):
+            pass
+
+    with pytest.raises(TypeError, match="get_food_logs"):
+        Partial()
+
+
+def test_both_backends_implement_the_whole_interface(tmp_path):
+    assert isinstance(SQLiteStorage(str(tmp_path / "test.db")), Storage)
+    assert isinstance(FirestoreStorage(InMemoryFirestore()), Storage)
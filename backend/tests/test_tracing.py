@@ -0,0 +1,133 @@
+import contextvars
+import json
+from datetime import datetime
+
+import pytest
+
+from backend import tracing
+from backend.tracing import export_trace, flush_exports, server_timing_header, span, start_trace, to_otlp
+
+
+def in_fresh_context(func):
+    # start_trace() sets contextvars; keep each test's trace out of the others
+    return contextvars.copy_context().run(func)
+
+
+def test_spans_nest_under_the_active_span():
+    def run():
+        trace = start_trace("GET /history/u1", http_method="GET")
+        with span("firestore.food_logs.query", ordered=True) as outer:
+            with span("project") as inner:
+                pass
+        return trace, outer, inner
+
+    trace, outer, inner = in_fresh_context(run)
+    assert trace.spans == [trace.root, outer, inner]
+    assert outer.parent_id == trace.root.span_id
+    assert inner.parent_id == outer.span_id
+    assert {s.trace_id for s in trace.spans} == {trace.trace_id}
+    assert outer.end_ns is not None and outer.attributes == {"ordered": True}
+
+
+def test_span_records_the_error_and_reraises():
+    def run():
+        trace = start_trace("POST /chat/u1")
+        with pytest.raises(ValueError):
+            with span("generate_text"):
+                raise ValueError("model unavailable")
+        return trace
+
+    trace = in_fresh_context(run)
+    assert trace.spans[1].error == "model unavailable"
+
+
+def test_span_outside_a_request_is_not_recorded():
+    def run():
+        with span("warm_up") as s:
+            pass
+        return s, tracing.current_trace()
+
+    s, trace = in_fresh_context(run)
+    assert trace is None
+    assert s.parent_id is None and s.end_ns is not None
+
+
+def test_server_timing_sums_repeated_spans_and_sanitizes_names():
+    def run():
+        trace = start_trace("POST /chat/u1")
+        for _ in range(2):
+            with span("firestore.chats set"):
+                pass
+        with span("generate_text"):
+            pass
+        trace.root.finish()
+        return trace
+
+    header = server_timing_header(in_fresh_context(run))
+    entries = [entry.strip() for entry in header.split(",")]
+    assert entries[0].startswith("firestore.chats_set;dur=") and entries[0].endswith(';desc="2 calls"')
+    assert entries[1].startswith("generate_text;dur=") and "desc" not in entries[1]
+    assert entries[-1].startswith("total;dur=")
+
+
+def test_to_otlp():
+    def run():
+        trace = start_trace("GET /stats/u1", http_method="GET")
+        with pytest.raises(RuntimeError):
+            with span("sqlite.food_logs.range", rows=3, cached=False, ratio=0.5):
+                raise RuntimeError("disk I/O error")
+        trace.root.finish()
+        return trace
+
+    trace = in_fresh_context(run)
+    resource_spans = to_otlp(trace, service_name="test")["resourceSpans"][0]
+    assert resource_spans["resource"]["attributes"] == [{"key": "service.name", "value": {"stringValue": "test"}}]
+    root, child = resource_spans["scopeSpans"][0]["spans"]
+    assert root["kind"] == 2 and "parentSpanId" not in root and root["status"] == {"code": 1}
+    assert child["kind"] == 1 and child["parentSpanId"] == root["spanId"] and child["traceId"] == trace.trace_id
+    assert child["status"] == {"code": 2, "message": "disk I/O error"}
+    assert child["attributes"] == [
+        {"key": "rows", "value": {"intValue": "3"}},
+        {"key": "cached", "value": {"boolValue": False}},
+        {"key": "ratio", "value": {"doubleValue": 0.5}},
+    ]
+    assert int(child["endTimeUnixNano"]) >= int(child["startTimeUnixNano"])
+
+
+def test_export_trace_writes_in_the_background(tmp_path):
+    path = tmp_path / "traces.jsonl"
+
+    def run():
+        trace = start_trace("GET /")
+        trace.root.finish()
+        export_trace(trace, str(path))
+        return trace
+
+    trace = in_fresh_context(run)
+    assert flush_exports()
+    lines = path.read_text().splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["traceId"] == trace.trace_id
+
+
+def test_requests_report_their_storage_spans(client, sqlite_storage):
+    response = client.get("/history/u1")
+    assert response.status_code == 200
+    metrics = [entry.split(";")[0].strip() for entry in response.headers["server-timing"].split(",")]
+    assert "sqlite.food_logs.query" in metrics
+    assert metrics[-1] == "total"
+
+
+def test_sqlite_summaries_and_usage_are_traced(sqlite_storage):
+    def run():
+        trace = start_trace("POST /chat/u1")
+        sqlite_storage.set_chat_summary("u1", {"summary": "Likes oats", "covered_until": datetime(2026, 3, 1), "messages": 4})
+        sqlite_storage.get_chat_summary("u1")
+        sqlite_storage.add_usage([{
+            "user_id": "u1", "endpoint": "chat", "model": "gemini-1.5-flash", "provider": "gemini", "calls": 1,
+            "input_tokens": 10, "output_tokens": 5, "cost_usd": 0.0, "window_start": datetime.now(), "window_end": datetime.now(),
+        }])
+        return trace
+
+    trace = in_fresh_context(run)
+    assert [s.name for s in trace.spans[1:]] == ["sqlite.chat_summaries.set", "sqlite.chat_summaries.get", "sqlite.usage.insert"]
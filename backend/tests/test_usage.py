@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from ai_core import usage
+from ai_core.usage import UsageLedger, usage_scope
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    ledger = UsageLedger()
+    monkeypatch.setattr(usage, "ledger", ledger)
+    return ledger
+
+
+def test_calls_are_aggregated_per_user_endpoint_and_model(ledger):
+    with usage_scope("u1", "chat"):
+        usage.record("gemini", "gemini-1.5-flash", 1000, 200)
+        usage.record("gemini", "gemini-1.5-flash", 500, 100)
+    with usage_scope("u1", "analyze"):
+        usage.record("gemini", "gemini-1.5-pro", 2000, 300)
+    usage.record("openai", "unlisted-model", 10, None)
+
+    rows = {(r["user_id"], r["endpoint"], r["model"]): r for r in ledger.pending_rows()}
+    chat = rows["u1", "chat", "gemini-1.5-flash"]
+    assert (chat["calls"], chat["input_tokens"], chat["output_tokens"]) == (2, 1500, 300)
+    assert chat["cost_usd"] == pytest.approx((1500 * 0.075 + 300 * 0.30) / 1_000_000)
+    unknown = rows["unknown", "unknown", "unlisted-model"]
+    assert (unknown["output_tokens"], unknown["cost_usd"]) == (0, 0.0)
+
+
+def test_flush_hands_over_deltas_once(ledger):
+    with usage_scope("u1", "chat"):
+        usage.record("gemini", "gemini-1.5-flash", 100, 10)
+    sunk = []
+
+    assert usage.flush(sunk.extend) == 1
+    [row] = sunk
+    assert row["window_start"] <= row["window_end"] and row["calls"] == 1
+    assert ledger.pending_rows() == [] and ledger.last_flush is not None
+    # Only deltas are flushed: nothing new, nothing sent
+    assert usage.flush(sunk.extend) == 0 and len(sunk) == 1
+
+
+def test_a_failed_flush_merges_back_into_later_calls(ledger):
+    with usage_scope("u1", "chat"):
+        usage.record("gemini", "gemini-1.5-flash", 100, 10)
+
+    def broken(rows):
+        raise RuntimeError("storage unavailable")
+
+    assert usage.flush(broken) == 0
+    assert ledger.last_flush is None
+    with usage_scope("u1", "chat"):
+        usage.record("gemini", "gemini-1.5-flash", 50, 5)
+
+    sunk = []
+    assert usage.flush(sunk.extend) == 1
+    assert (sunk[0]["calls"], sunk[0]["input_tokens"], sunk[0]["output_tokens"]) == (2, 150, 15)
+
+
+def test_report_groups_stored_and_pending_rows(ledger, sqlite_storage):
+    with usage_scope("u1", "chat"):
+        usage.record("gemini", "gemini-1.5-pro", 1000, 100)
+    usage.flush(sqlite_storage.add_usage)
+    with usage_scope("u2", "chat"):
+        usage.record("gemini", "gemini-1.5-flash", 400, 40)
+    with usage_scope("u2", "analyze"):
+        usage.record("gemini", "mystery-model", 10, 1)
+
+    since = datetime.now() - timedelta(days=1)
+    report = usage.report(sqlite_storage.get_usage(since) + ledger.pending_rows(), since, group_by="user")
+    assert [row["user_id"] for row in report["rows"]] == ["u1", "u2"]
+    u2 = report["rows"][1]
+    assert (u2["calls"], u2["avg_input_tokens"], u2["priced"]) == (2, 205, False)
+    assert report["totals"]["calls"] == 3 and report["last_flush"] is not None
+
+    by_model = usage.report(ledger.pending_rows(), since, group_by="model", limit=1)
+    assert [row["model"] for row in by_model["rows"]] == ["gemini-1.5-flash"]
@@ -1,15 +1,32 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import json
 from datetime import datetime
 import pandas as pd
 import io
+import threading
+import time
 
 import os
+from analytics import today_totals, stats_frames, recent_meals
+from uploads import prepare_image, savings_caption, ProgressBody
+from live import ChangeWatcher
 
 # CONFIG
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+# (connect, read) seconds; reads cover a full model call on /analyze and /chat
+TIMEOUT = (3.05, 90)
+# Seconds between local checks of the change feed, and how stale data may get while it is down
+LIVE_CHECK_SECONDS = 2
+FEED_FALLBACK_SECONDS = 30
+# The feed only reports writes made by the backend worker it is connected to (not other workers,
+# replays or migrations), so cached data still expires after this long
+CACHE_BACKSTOP_SECONDS = 30
 
 st.set_page_config(page_title="NutriScan AI", layout="wide", initial_sidebar_state="collapsed")
 
@@ -153,39 +170,292 @@ with h_col3:
 # Main Application Logic
 user_id = "hackathon_judge_1"
 
-# Utility to fetch data
-@st.cache_data(ttl=30)
+@st.cache_resource
+def get_session():
+    """
+    One pooled keep-alive session per Streamlit process, shared by every rerun and user.
+    Idempotent GETs are retried on connection errors and 502/503/504; POSTs only when
+    the connection could not be opened (the request never reached the backend).
+    """
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=frozenset({"GET"}))
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+http = get_session()
+
+@st.cache_resource
+def get_validators():
+    """Last ETag and raw body per URL, shared by every session, for conditional GETs."""
+    return {}
+
+def get_json(url):
+    """GET with If-None-Match; when the backend answers 304 the previous body is reused."""
+    validators = get_validators()
+    cached = validators.get(url)
+    res = http.get(url, headers={"If-None-Match": cached[0]} if cached else {}, timeout=TIMEOUT)
+    if res.status_code == 304 and cached:
+        return json.loads(cached[1])
+    res.raise_for_status()
+    if res.headers.get("ETag"):
+        validators[url] = (res.headers["ETag"], res.content)
+    return res.json()
+
+# Only the history fields the page shows; the backend reads and sends nothing else
+HISTORY_FIELDS = "food_name,calories,timestamp,nutrition.protein_g,nutrition.carbs_g,nutrition.fats_g"
+
+# Utility to fetch data. History and stats are dropped as soon as the change feed reports a write,
+# and expire anyway after CACHE_BACKSTOP_SECONDS for writes the feed doesn't see.
+@st.cache_data(ttl=CACHE_BACKSTOP_SECONDS)
 def fetch_history(uid):
     try:
-        res = requests.get(f"{BACKEND_URL}/history/{uid}")
-        return res.json().get("history", [])
+        return get_json(f"{BACKEND_URL}/history/{uid}?fields={HISTORY_FIELDS}").get("history", [])
     except Exception as e: 
         print(f"DEBUG: History fetch error - {e}")
         return []
 
-history_data = fetch_history(user_id)
+def fetch_chats(uid):
+    try:
+        return get_json(f"{BACKEND_URL}/chats/{uid}").get("history", [])
+    except Exception as e:
+        print(f"DEBUG: Chat history load error - {e}")
+    return []
+
+# Aggregated server-side over the last 30 days; the Statistics view charts these arrays directly
+@st.cache_data(ttl=CACHE_BACKSTOP_SECONDS)
+def fetch_stats(uid):
+    stats_res = http.get(f"{BACKEND_URL}/stats/{uid}", params={"granularity": "day"}, timeout=TIMEOUT)
+    stats_res.raise_for_status()
+    return stats_res.json()
+
+# The coach runs a model call, so its insight is reused for 10 minutes (or until the feed reports
+# a new meal); failures are not cached
+@st.cache_data(ttl=600)
+def fetch_coach(uid):
+    coach_res = http.get(f"{BACKEND_URL}/coach/{uid}", timeout=TIMEOUT)
+    coach_res.raise_for_status()
+    return coach_res.json()
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def cached_prepare_image(raw, filename, mime_type):
+    return prepare_image(raw, filename, mime_type)
+
+def load_concurrently(tasks):
+    """Runs {name: fn} in parallel threads (with the script context, so st.cache_data works) and returns {name: result}."""
+    ctx = get_script_run_ctx()
+
+    def run(fn):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+        futures = {name: pool.submit(run, fn) for name, fn in tasks.items()}
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            print(f"DEBUG: {name} load error - {e}")
+            results[name] = None
+    return results
+
+@st.cache_resource
+def get_watcher(uid):
+    """One change-feed connection per user per Streamlit process, however many tabs are open."""
+    return ChangeWatcher(f"{BACKEND_URL}/changes/{uid}")
+
+watcher = get_watcher(user_id)
+
+def expect_own_write(kind):
+    """Marks a write this session made itself, so its echo on the change feed is not treated as news."""
+    own = st.session_state.setdefault("own_writes", {})
+    own[kind] = own.get(kind, 0) + 1
+
+def stale_kinds():
+    """Kinds written since this session last loaded them, not counting its own writes."""
+    tokens = watcher.tokens()
+    if "seen_changes" not in st.session_state:
+        # First run of the session: what it is about to load is current as of these versions
+        st.session_state.seen_changes = tokens
+    seen = st.session_state.seen_changes
+    own = st.session_state.setdefault("own_writes", {})
+    stale = set()
+    for kind, (epoch, version) in tokens.items():
+        last = seen.get(kind)
+        if last == (epoch, version):
+            continue
+        if last and last[0] == epoch and 0 < version - last[1] <= own.get(kind, 0):
+            own[kind] -= version - last[1]
+            seen[kind] = (epoch, version)
+        else:
+            stale.add(kind)
+    return stale
+
+# Drop whatever the change feed says is out of date before loading the page
+stale = stale_kinds()
+if not watcher.connected and time.monotonic() - st.session_state.get("fallback_refresh", 0) > FEED_FALLBACK_SECONDS:
+    # No feed (backend down or restarting): fall back to refreshing on a timer
+    st.session_state.fallback_refresh = time.monotonic()
+    stale.add("food_logs")
+if "food_logs" in stale:
+    fetch_history.clear(user_id)
+    fetch_stats.clear(user_id)
+    fetch_coach.clear(user_id)
+if "chats" in stale:
+    st.session_state.pop("messages", None)
+st.session_state.seen_changes.update({kind: token for kind, token in watcher.tokens().items() if kind in stale})
+
+@st.fragment(run_every=LIVE_CHECK_SECONDS)
+def live_updates():
+    # Compares with the watcher's in-memory state only; the page reruns when another tab or device wrote
+    if stale_kinds():
+        st.rerun(scope="app")
+
+live_updates()
+
+# History, chat transcript (first load only) and the coach insight (once consulted) in parallel
+page_loads = {"history": lambda: fetch_history(user_id)}
+if "messages" not in st.session_state:
+    page_loads["chats"] = lambda: fetch_chats(user_id)
+if st.session_state.get("coach_enabled"):
+    page_loads["coach"] = lambda: fetch_coach(user_id)
+if st.session_state.current_view == "STATISTICS":
+    page_loads["stats"] = lambda: fetch_stats(user_id)
+loaded = load_concurrently(page_loads)
+
+history_data = loaded["history"] or []
+if "chats" in loaded:
+    st.session_state.messages = loaded["chats"] or []
+if loaded.get("coach"):
+    st.session_state.coach_data = loaded["coach"]
+stats_data = loaded.get("stats")
 
 # Calculate Today's Macros
-df_today = pd.DataFrame(history_data)
-today_calories = 0
-today_protein = 0
-today_carbs = 0
-if not df_today.empty:
-    df_today['timestamp'] = pd.to_datetime(df_today['timestamp'])
-    today = datetime.now().date()
-    # Filter for today
-    mask = df_today['timestamp'].dt.date == today
-    df_filtered = df_today[mask]
-    
-    today_calories = int(df_filtered['calories'].sum())
-    # Safely sum macros from the 'nutrition' dict column
-    for nut in df_filtered['nutrition']:
-        today_protein += nut.get('protein_g', 0)
-        today_carbs += nut.get('carbs_g', 0)
+today_calories, today_protein, today_carbs = today_totals(history_data, datetime.now().date())
 
 kcal_goal = 2000
 kcal_left = max(0, kcal_goal - today_calories)
 
+# Dashboard panels are fragments: a widget inside one reruns only that panel, not the
+# whole script (CSS, data loads, other panels). Only a new meal refreshes the full page.
+@st.fragment
+def capture_panel():
+    # Capture Food Section
+    st.markdown('<div class="capture-card">', unsafe_allow_html=True)
+    option = st.radio("Input Method", ["Upload Image", "Camera"], horizontal=True, label_visibility="collapsed")
+    
+    uploaded_file = None
+    if option == "Upload Image":
+        uploaded_file = st.file_uploader("Drop image here or click to browse", type=["jpg", "jpeg", "png"])
+    else:
+        uploaded_file = st.camera_input("Point camera at your plate")
+
+    if uploaded_file:
+        # Downscaled once per photo (cached on its bytes); this is what is shown and uploaded
+        image_bytes, image_name, image_type, image_info = cached_prepare_image(
+            uploaded_file.getvalue(), uploaded_file.name, uploaded_file.type)
+        analyzed = st.session_state.get("last_analysis_image") == image_bytes
+        if not analyzed:
+            st.image(image_bytes, caption="Selected Meal", use_container_width=True)
+        st.caption(savings_caption(image_info))
+        if st.button("Analyze Food 🚀", type="primary"):
+            progress = st.progress(0.0, text="Uploading photo...")
+
+            def on_progress(sent, total):
+                progress.progress(sent / total, text=f"Uploading photo... {sent * 100 // total}%")
+
+            try:
+                body = ProgressBody({"file": (image_name, image_bytes, image_type)}, on_progress)
+                with st.spinner("Analyzing nutrients..."):
+                    response = http.post(f"{BACKEND_URL}/analyze", data=body, headers={"Content-Type": body.content_type},
+                                         params={"user_id": user_id}, timeout=TIMEOUT)
+                progress.empty()
+
+                if response.status_code == 200:
+                    expect_own_write("food_logs")
+                    st.session_state.last_analysis = response.json()
+                    st.session_state.last_analysis_image = image_bytes
+                    # A new meal changes the macro row, history and results below: refresh the whole page
+                    fetch_history.clear(user_id)
+                    fetch_stats.clear(user_id)
+                    st.rerun()
+                else:
+                    st.error("AI Analysis failed. Please try a clearer photo.")
+            except Exception as e:
+                progress.empty()
+                st.error(f"Error: {e}")
+    st.markdown('</div>', unsafe_allow_html=True)
+
+@st.fragment
+def coach_panel():
+    # Sidebar Info & Tools
+    with st.container(border=True):
+        st.subheader("🤖 AI Health Assistant")
+        if st.button("Consult AI Coach 🧠"):
+            with st.spinner("Analyzing habits..."):
+                try:
+                    # A click asks for a fresh insight; later reruns reuse it from the cache
+                    fetch_coach.clear(user_id)
+                    st.session_state.coach_data = fetch_coach(user_id)
+                    st.session_state.coach_enabled = True
+                except: st.error("Coach unavailable")
+        
+        if "coach_data" in st.session_state:
+            coach = st.session_state.coach_data
+            st.info(f"💡 {coach.get('insight')}")
+            st.caption("**Suggestions:** " + ", ".join(coach.get('suggestions', [])))
+
+@st.fragment
+def history_panel():
+    head_col, refresh_col = st.columns([4, 1])
+    head_col.subheader("🗓️ Recent Meals")
+    if refresh_col.button("↻", key="refresh_history", help="Reload meals"):
+        fetch_history.clear(user_id)
+    history_data = fetch_history(user_id)
+    if not history_data:
+        st.info("Log a meal to see history")
+    else:
+        for item in history_data:
+            with st.container(border=True):
+                h_c1, h_c2, h_c3 = st.columns([3, 1, 1])
+                h_c1.write(f"**{item.get('food_name')}**")
+                h_c2.write(f"{item.get('calories')} kcal")
+                h_c3.caption(f"🕒 {item.get('timestamp','').split('T')[1][:5] if 'T' in item.get('timestamp','') else ''}")
+
+@st.fragment
+def chat_panel():
+    st.subheader("💬 NutriChat")
+    with st.container(border=True, height=400):
+        for message in st.session_state.messages:
+            with st.chat_message(message["role"]): st.markdown(message["content"])
+
+        audio_file = st.audio_input("Record Voice 🎙️", label_visibility="collapsed")
+        if audio_file:
+            with st.spinner("AI listening..."):
+                try:
+                    files = {"file": (audio_file.name, audio_file.getvalue(), audio_file.type)}
+                    res = http.post(f"{BACKEND_URL}/voice_chat/{user_id}", files=files, timeout=TIMEOUT)
+                    if res.status_code == 200:
+                        expect_own_write("chats")
+                        answer = res.json()["response"]
+                        st.session_state.messages.append({"role": "user", "content": "🎤 (Voice Message)"})
+                        st.session_state.messages.append({"role": "assistant", "content": answer})
+                        st.rerun(scope="fragment")
+                except Exception as e: st.error(f"Voice fail: {e}")
+
+        if prompt := st.chat_input("Ask anything..."):
+            st.session_state.messages.append({"role": "user", "content": prompt})
+            with st.spinner("Thinking..."):
+                try:
+                    response = http.post(f"{BACKEND_URL}/chat/{user_id}", json={"message": prompt}, timeout=TIMEOUT)
+                    if response.status_code == 200:
+                        expect_own_write("chats")
+                        st.session_state.messages.append({"role": "assistant", "content": response.json()["response"]})
+                        st.rerun(scope="fragment")
+                except Exception as e: st.error(f"Chat fail: {e}")
+
 if st.session_state.current_view == "DASHBOARD":
     # Macro Summary Row
     st.markdown(f"""
@@ -202,52 +472,10 @@ if st.session_state.current_view == "DASHBOARD":
     col_main, col_side = st.columns([2, 1])
 
     with col_main:
-        # Capture Food Section
-        st.markdown('<div class="capture-card">', unsafe_allow_html=True)
-        option = st.radio("Input Method", ["Upload Image", "Camera"], horizontal=True, label_visibility="collapsed")
-        
-        uploaded_file = None
-        if option == "Upload Image":
-            uploaded_file = st.file_uploader("Drop image here or click to browse", type=["jpg", "jpeg", "png"])
-        else:
-            uploaded_file = st.camera_input("Point camera at your plate")
-
-        if uploaded_file:
-            st.image(uploaded_file, caption="Selected Meal", use_container_width=True)
-            if st.button("Analyze Food 🚀", type="primary"):
-                with st.spinner("Analyzing nutrients..."):
-                    try:
-                        files = {"file": (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-                        response = requests.post(f"{BACKEND_URL}/analyze", files=files, params={"user_id": user_id})
-                        
-                        if response.status_code == 200:
-                            data = response.json()
-                            nutrition = data["nutrition"]
-                            
-                            st.session_state.last_analysis = data
-                            st.success(f"Successfully Identified: **{nutrition['food_name']}**")
-                        else:
-                            st.error("AI Analysis failed. Please try a clearer photo.")
-                    except Exception as e:
-                        st.error(f"Error: {e}")
-        st.markdown('</div>', unsafe_allow_html=True)
+        capture_panel()
 
     with col_side:
-        # Sidebar Info & Tools
-        with st.container(border=True):
-            st.subheader("🤖 AI Health Assistant")
-            if st.button("Consult AI Coach 🧠"):
-                with st.spinner("Analyzing habits..."):
-                    try:
-                        coach_res = requests.get(f"{BACKEND_URL}/coach/{user_id}")
-                        if coach_res.status_code == 200:
-                            st.session_state.coach_data = coach_res.json()
-                    except: st.error("Coach unavailable")
-            
-            if "coach_data" in st.session_state:
-                coach = st.session_state.coach_data
-                st.info(f"💡 {coach.get('insight')}")
-                st.caption("**Suggestions:** " + ", ".join(coach.get('suggestions', [])))
+        coach_panel()
 
     # Recognition Results
     if "last_analysis" in st.session_state:
@@ -257,7 +485,8 @@ if st.session_state.current_view == "DASHBOARD":
         st.subheader("Recognition Results")
         res_col1, res_col2 = st.columns([1, 1.5])
         with res_col1:
-            st.image(uploaded_file, use_container_width=True)
+            if st.session_state.get("last_analysis_image"):
+                st.image(st.session_state.last_analysis_image, use_container_width=True)
         with res_col2:
             st.markdown(f"### {nutrition['food_name']}")
             st.markdown(f"<span style='background: rgba(142, 214, 0, 0.2); color: #8ed600; padding: 5px 12px; border-radius: 20px; font-size: 12px;'>✅ SUCCESSFULLY IDENTIFIED ({int(nutrition['confidence']*100)}% Confidence)</span>", unsafe_allow_html=True)
@@ -275,72 +504,23 @@ if st.session_state.current_view == "DASHBOARD":
     low_col1, low_col2 = st.columns([1.5, 1])
 
     with low_col1:
-        st.subheader("🗓️ Recent Meals")
-        if not history_data:
-            st.info("Log a meal to see history")
-        else:
-            for item in history_data:
-                with st.container(border=True):
-                    h_c1, h_c2, h_c3 = st.columns([3, 1, 1])
-                    h_c1.write(f"**{item.get('food_name')}**")
-                    h_c2.write(f"{item.get('calories')} kcal")
-                    h_c3.caption(f"🕒 {item.get('timestamp','').split('T')[1][:5] if 'T' in item.get('timestamp','') else ''}")
+        history_panel()
 
     with low_col2:
-        st.subheader("💬 NutriChat")
-        with st.container(border=True, height=400):
-            if "messages" not in st.session_state:
-                try:
-                    chat_res = requests.get(f"{BACKEND_URL}/chats/{user_id}")
-                    if chat_res.status_code == 200:
-                        st.session_state.messages = chat_res.json().get("history", [])
-                    else: st.session_state.messages = []
-                except Exception as e:
-                    print(f"DEBUG: Chat history load error - {e}")
-                    st.session_state.messages = []
-                    
-            for message in st.session_state.messages:
-                with st.chat_message(message["role"]): st.markdown(message["content"])
-
-            audio_file = st.audio_input("Record Voice 🎙️", label_visibility="collapsed")
-            if audio_file:
-                with st.spinner("AI listening..."):
-                    try:
-                        files = {"file": (audio_file.name, audio_file.getvalue(), audio_file.type)}
-                        res = requests.post(f"{BACKEND_URL}/voice_chat/{user_id}", files=files)
-                        if res.status_code == 200:
-                            answer = res.json()["response"]
-                            st.session_state.messages.append({"role": "user", "content": "🎤 (Voice Message)"})
-                            st.session_state.messages.append({"role": "assistant", "content": answer})
-                            st.rerun()
-                    except Exception as e: st.error(f"Voice fail: {e}")
-
-            if prompt := st.chat_input("Ask anything..."):
-                st.session_state.messages.append({"role": "user", "content": prompt})
-                with st.spinner("Thinking..."):
-                    try:
-                        response = requests.post(f"{BACKEND_URL}/chat/{user_id}", json={"message": prompt})
-                        if response.status_code == 200:
-                            st.session_state.messages.append({"role": "assistant", "content": response.json()["response"]})
-                            st.rerun()
-                    except Exception as e: st.error(f"Chat fail: {e}")
+        chat_panel()
 
 elif st.session_state.current_view == "STATISTICS":
     st.markdown("<div style='height: 80px;'></div>", unsafe_allow_html=True)
     st.title("Nutrition Analytics")
     
-    if not history_data:
+    if not stats_data or not stats_data["totals"]["meals"]:
         st.warning("No data available yet. Start logging your meals to see stats!")
     else:
         # Prepare Data for Charts
-        df = pd.DataFrame(history_data)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df['date'] = df['timestamp'].dt.date
-        
-        # Summary Metrics
-        avg_calories = int(df['calories'].mean())
-        total_meals = len(df)
-        top_food = df['food_name'].mode()[0] if not df['food_name'].empty else "N/A"
+        stats = stats_frames(stats_data)
+        avg_calories = stats["avg_calories"]
+        total_meals = stats["total_meals"]
+        top_food = stats["top_food"]
         
         m1, m2, m3 = st.columns(3)
         with m1:
@@ -350,7 +530,7 @@ elif st.session_state.current_view == "STATISTICS":
             </div>""", unsafe_allow_html=True)
         with m2:
             st.markdown(f"""<div class='stats-card'>
-                <p style='color: #888; font-size: 12px; font-weight: 800; margin-bottom: 5px;'>TOTAL MEALS LOGGED</p>
+                <p style='color: #888; font-size: 12px; font-weight: 800; margin-bottom: 5px;'>MEALS LOGGED (30 DAYS)</p>
                 <h2 style='color: #3b82f6; margin: 0;'>{total_meals} <span style='font-size: 14px; color: #666;'>entries</span></h2>
             </div>""", unsafe_allow_html=True)
         with m3:
@@ -365,32 +545,20 @@ elif st.session_state.current_view == "STATISTICS":
         
         with col1:
             st.subheader("📈 Caloric Trend")
-            daily_calories = df.groupby('date')['calories'].sum().reset_index()
+            daily_calories = stats["daily_calories"]
             st.line_chart(daily_calories.set_index('date'), color="#8ed600")
             st.caption("Total daily calorie consumption tracked over time.")
             
         with col2:
             st.subheader("📊 Macro Distribution")
-            # Calculate total macros across all history
-            macros = {'Protein': 0, 'Carbs': 0, 'Fats': 0}
-            for item in history_data:
-                nut = item.get('nutrition', {})
-                macros['Protein'] += nut.get('protein_g', 0)
-                macros['Carbs'] += nut.get('carbs_g', 0)
-                macros['Fats'] += nut.get('fats_g', 0)
-            
-            macro_df = pd.DataFrame(list(macros.items()), columns=['Macro', 'Grams'])
+            macro_df = stats["macro_df"]
             st.bar_chart(macro_df.set_index('Macro'), color="#3b82f6")
-            st.caption("Sum of macros consumed in all logged meals.")
-
-        st.divider()
-        st.subheader("🥩 Meal Macro Comparison")
-        # Detailed bar chart of last few meals
-        recent_df = df.head(5).copy()
-        # Extract nutrition sub-dict to columns
-        recent_df['Protein'] = recent_df['nutrition'].apply(lambda x: x.get('protein_g', 0))
-        recent_df['Carbs'] = recent_df['nutrition'].apply(lambda x: x.get('carbs_g', 0))
-        recent_df['Fats'] = recent_df['nutrition'].apply(lambda x: x.get('fats_g', 0))
-        
-        st.area_chart(recent_df.set_index('food_name')[['Protein', 'Carbs', 'Fats']])
-        st.caption("Macro breakdown comparison for your 5 most recent meals.")
+            st.caption("Sum of macros consumed in meals logged over the last 30 days.")
+
+        if history_data:
+            st.divider()
+            st.subheader("🥩 Meal Macro Comparison")
+            # Detailed bar chart of last few meals
+            recent_df = recent_meals(history_data)
+            st.area_chart(recent_df.set_index('food_name')[['Protein', 'Carbs', 'Fats']])
+            st.caption("Macro breakdown comparison for your 5 most recent meals.")
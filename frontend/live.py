@@ -0,0 +1,60 @@
+import json
+import threading
+import time
+
+import requests
+
+
+class ChangeWatcher:
+    """
+    Follows the backend's /changes/{user_id} SSE stream in a daemon thread and keeps
+    the latest (epoch, version) per kind ("food_logs", "chats"). Script reruns compare
+    tokens() with what they last saw, so checking for changes never hits the backend.
+    """
+
+    def __init__(self, url, read_timeout=60, max_backoff=30):
+        self.url = url
+        # Longer than the backend's 15s keep-alive, so a dead connection is noticed
+        self.read_timeout = read_timeout
+        self.max_backoff = max_backoff
+        self.connected = False
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+        self._thread.start()
+
+    def tokens(self):
+        with self._lock:
+            return dict(self._versions)
+
+    def _apply(self, event, data):
+        with self._lock:
+            if event == "hello":
+                for kind, state in data.items():
+                    if kind != "epoch":
+                        self._versions[kind] = (data["epoch"], state["version"])
+            elif event == "change":
+                self._versions[data["kind"]] = (data["epoch"], data["version"])
+
+    def _run(self):
+        session = requests.Session()
+        backoff = 1
+        while True:
+            try:
+                with session.get(self.url, stream=True, timeout=(3.05, self.read_timeout),
+                                 headers={"Accept": "text/event-stream"}) as res:
+                    res.raise_for_status()
+                    self.connected = True
+                    backoff = 1
+                    event = None
+                    for line in res.iter_lines(decode_unicode=True):
+                        if line.startswith("event:"):
+                            event = line[6:].strip()
+                        elif line.startswith("data:"):
+                            self._apply(event, json.loads(line[5:]))
+            except Exception as e:
+                print(f"DEBUG: Change feed error - {e}")
+            # The backend closes streams periodically; reconnect (with backoff if it is down)
+            self.connected = False
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)